@@ -0,0 +1,19 @@
+"""
+Gunicorn settings of the docker image. gunicorn loads this file from the working directory
+"""
+import os
+
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+
+# load the application in the master before the workers are forked, so every worker starts with all modules imported
+# and the app created. Connection pools, listeners and probers open their connections and threads lazily in the
+# worker processes, so nothing is shared between the workers but memory
+preload_app = os.getenv('P2REST_PRELOAD_APP', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def child_exit(server, worker):
+    """
+    Removes the live gauges of an exited worker from the shared prometheus metrics
+    """
+    if 'prometheus_multiproc_dir' in os.environ:
+        GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
@@ -0,0 +1,3 @@
+"""
+Benchmarks for p2rest. The modules can be run with 'python -m p2rest.benchmark.<module>'
+"""
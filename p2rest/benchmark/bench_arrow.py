@@ -0,0 +1,84 @@
+"""
+Benchmark of the streamed output formats: json (RowConverter and json.dumps) against arrow ipc stream and parquet
+written by ArrowBatchBuilder. The payload size, the time the server needs to encode the batches and the time a client
+needs to decode them are compared. No database is needed, the rows and the cursor description are synthetic.
+Requires pyarrow.
+
+    python -m p2rest.benchmark.bench_arrow --rows 100000 --columns 20 --batch-size 1000
+"""
+import argparse
+import io
+import json
+
+from p2rest.src.database.arrow import pyarrow, write_batches
+from p2rest.src.database.converters import RowConverter
+from p2rest.benchmark.bench_converters import COLUMN_TYPES, create_data, measure
+
+
+def encode_json(data, description, batch_size):
+    """
+    Encodes the rows like the ndjson stream of POST /query/select
+    """
+    converter = RowConverter(description)
+    parts = []
+    for start in range(0, len(data), batch_size):
+        parts.append(''.join(json.dumps(row) + '\n' for row in converter.to_dicts(data[start:start + batch_size])))
+    return ''.join(parts).encode('utf-8')
+
+
+def decode_json(payload):
+    return [json.loads(line) for line in payload.splitlines()]
+
+
+def encode_columnar(data, description, batch_size, output_format):
+    """
+    Encodes the rows like the arrow and parquet streams of POST /query/select
+    """
+    batches = (data[start:start + batch_size] for start in range(0, len(data), batch_size))
+    return b''.join(write_batches(description, batches, output_format))
+
+
+def decode_arrow(payload):
+    return pyarrow.ipc.open_stream(payload).read_all()
+
+
+def decode_parquet(payload):
+    return pyarrow.parquet.read_table(io.BytesIO(payload))
+
+
+def run(rows, columns, batch_size, repeat):
+    """
+    Runs the benchmark for every format
+    :return: List of results
+    """
+    data, description = create_data(rows, columns, COLUMN_TYPES)
+    formats = (
+        ('json', lambda: encode_json(data, description, batch_size), decode_json),
+        ('arrow', lambda: encode_columnar(data, description, batch_size, 'arrow'), decode_arrow),
+        ('parquet', lambda: encode_columnar(data, description, batch_size, 'parquet'), decode_parquet),
+    )
+    results = []
+    for name, encode, decode in formats:
+        payload = encode()
+        results.append({'format': name, 'rows': rows, 'columns': columns, 'size': len(payload),
+                        'encode': measure(encode, repeat), 'decode': measure(lambda: decode(payload), repeat)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if pyarrow is None:
+        parser.error('pyarrow is not installed')
+
+    print('{:<8} {:>8} {:>8} {:>12} {:>10} {:>10}'.format('format', 'rows', 'columns', 'bytes', 'encode', 'decode'))
+    for result in run(args.rows, args.columns, args.batch_size, args.repeat):
+        print('{format:<8} {rows:>8} {columns:>8} {size:>12} {encode:>9.4f}s {decode:>9.4f}s'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
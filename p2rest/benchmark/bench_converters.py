@@ -0,0 +1,97 @@
+"""
+Micro benchmark of the row conversion: the original per cell implementation of ConvertPsycopg2Data against the
+precompiled RowConverter. No database is needed, the rows and the cursor description are synthetic.
+
+    python -m p2rest.benchmark.bench_converters --rows 10000 --columns 40
+"""
+import argparse
+import datetime
+import decimal
+import timeit
+from collections import namedtuple
+
+from p2rest.src.database.converters import RowConverter
+
+Column = namedtuple('Column', ['name', 'type_code'])
+
+# type oid and a generator for the value of a column
+COLUMN_TYPES = [
+    (23, lambda i: i),
+    (1043, lambda i: 'value {}'.format(i)),
+    (701, lambda i: i / 3),
+    (1114, lambda i: datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=i)),
+    (16, lambda i: i % 2 == 0),
+    (1700, lambda i: decimal.Decimal(i) / 4),
+]
+
+
+def legacy_convert(data, columns):
+    """
+    The implementation of ConvertPsycopg2Data before the converters were precompiled
+    """
+    result = []
+    for row in data:
+        entry = {}
+        for i in range(0, len(columns)):
+            if isinstance(row[i], datetime.datetime):
+                entry[columns[i].name] = row[i].strftime('%Y-%m-%dT%H:%M:%S.%f')
+            elif isinstance(row[i], datetime.timedelta):
+                entry[columns[i].name] = str(row[i])
+            else:
+                entry[columns[i].name] = row[i]
+        result.append(entry)
+    return result
+
+
+def create_data(rows, columns, types):
+    """
+    Creates a synthetic result
+    :param rows: Amount of rows
+    :param columns: Amount of columns
+    :param types: Column types to cycle through
+    :return: rows and cursor description
+    """
+    description = [Column('column_{}'.format(i), types[i % len(types)][0]) for i in range(columns)]
+    data = [tuple(types[c % len(types)][1](r) for c in range(columns)) for r in range(rows)]
+    return data, description
+
+
+def measure(function, repeat):
+    """
+    Returns the best time of several runs in seconds
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def run(rows, columns, repeat):
+    """
+    Runs the benchmark for a result with mixed column types and one with types that need no conversion
+    :return: List of results
+    """
+    results = []
+    for name, types in (('mixed', COLUMN_TYPES), ('passthrough', [COLUMN_TYPES[0], COLUMN_TYPES[1]])):
+        data, description = create_data(rows, columns, types)
+        legacy = measure(lambda: legacy_convert(data, description), repeat)
+        dicts = measure(lambda: RowConverter(description).to_dicts(data), repeat)
+        lists = measure(lambda: RowConverter(description).to_lists(data), repeat)
+        results.append({'data': name, 'rows': rows, 'columns': columns, 'legacy': legacy, 'dicts': dicts,
+                        'compact': lists})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--columns', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:<12} {:>8} {:>8} {:>10} {:>10} {:>10} {:>8}'.format('data', 'rows', 'columns', 'legacy', 'dicts',
+                                                              'compact', 'speedup'))
+    for result in run(args.rows, args.columns, args.repeat):
+        print('{data:<12} {rows:>8} {columns:>8} {legacy:>9.4f}s {dicts:>9.4f}s {compact:>9.4f}s {speedup:>7.1f}x'
+              .format(speedup=result['legacy'] / result['dicts'], **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark of the response rendering of POST /query/select: marshal of flask-restplus and json.dumps (the rendering
+before the encoders) against the envelope written by the encoders with the standard library json module and orjson.
+No database is needed, the rows are synthetic and converted with RowConverter like in the service.
+
+    python -m p2rest.benchmark.bench_encoders --rows 1000 10000 --columns 20
+"""
+import argparse
+import json
+
+from flask_restplus import marshal
+
+from p2rest.src.api.query import schema_result_model
+from p2rest.src.database.converters import RowConverter
+from p2rest.src.encoders import envelope, dumps_json, dumps_orjson, orjson
+from p2rest.benchmark.bench_converters import COLUMN_TYPES, create_data, measure
+
+
+def create_response(rows, columns):
+    """
+    Creates a response envelope of a select with converted rows
+    """
+    data, description = create_data(rows, columns, COLUMN_TYPES)
+    return {'status_code': 200, 'message': 'Get data', 'description': 'Get data from from table or view',
+            'count': rows, 'duration': '0:00:00.012345', 'data': RowConverter(description).to_dicts(data),
+            'continuation': None, 'total': None}
+
+
+def render_marshal(response):
+    return json.dumps(marshal(response, schema_result_model)).encode()
+
+
+def render_json(response):
+    return dumps_json(envelope(response, schema_result_model))
+
+
+def render_orjson(response):
+    return dumps_orjson(envelope(response, schema_result_model))
+
+
+def run(rows_list, columns, repeat):
+    """
+    Runs the benchmark for every amount of rows
+    :return: List of results
+    """
+    renderers = [('marshal', render_marshal), ('json', render_json)]
+    if orjson is not None:
+        renderers.append(('orjson', render_orjson))
+
+    results = []
+    for rows in rows_list:
+        response = create_response(rows, columns)
+        baseline = None
+        for name, render in renderers:
+            seconds = measure(lambda: render(response), repeat)
+            baseline = baseline or seconds
+            results.append({'encoder': name, 'rows': rows, 'columns': columns, 'seconds': seconds,
+                            'rows_per_second': rows / seconds, 'speedup': baseline / seconds})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:<8} {:>8} {:>8} {:>10} {:>12} {:>8}'.format('encoder', 'rows', 'columns', 'time', 'rows/s', 'speedup'))
+    for result in run(args.rows, args.columns, args.repeat):
+        print('{encoder:<8} {rows:>8} {columns:>8} {seconds:>9.4f}s {rows_per_second:>12.0f} {speedup:>7.1f}x'
+              .format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Micro benchmarks of the helpers on the query path: the row conversion (ConvertPsycopg2Data) of wide and narrow
+results, the filter compilation (convert_request_filter_to_string) of deep and wide filters and of selections of ids,
+and the order by clause (convert_order_by_to_string) of many fields. No database is needed, the data is synthetic.
+
+    python -m p2rest.benchmark.bench_helper --rows 10000 --output helper.json --baseline helper-baseline.json
+"""
+import argparse
+import json
+import sys
+import timeit
+
+from p2rest.src.database.helper import PostgresHelper
+from p2rest.benchmark.bench_converters import COLUMN_TYPES, create_data
+from p2rest.benchmark.report import write_report, compare, print_comparison
+
+
+def create_deep_filter(depth, index=0):
+    """
+    Creates a filter whose logical nodes alternate between and and or down to the given depth, every logical node
+    has two children, so the filter has 2^depth distinct leaves
+    """
+    if depth == 0:
+        return {'column': 'column_{}'.format(index % 10), 'operator': '>=', 'value': index}
+    return {'operator': 'and' if depth % 2 else 'or', 'childs': [create_deep_filter(depth - 1, index * 2),
+                                                                  create_deep_filter(depth - 1, index * 2 + 1)]}
+
+
+def create_wide_filter(leaves):
+    """
+    Creates a filter of one or node with the given amount of leaves
+    """
+    return {'operator': 'or', 'childs': [{'column': 'column_{}'.format(i), 'operator': '>=', 'value': i}
+                                         for i in range(leaves)]}
+
+
+def create_in_filter(values):
+    """
+    Creates a filter of one or node with an equality of the same column per value, like a selection of ids
+    """
+    return {'operator': 'or', 'childs': [{'column': 'id', 'operator': '=', 'value': i} for i in range(values)]}
+
+
+def measure_call(function, repeat):
+    """
+    Returns the best time of a single call in seconds, fast calls are repeated within one measurement
+    """
+    number, _ = timeit.Timer(function).autorange()
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def run(rows, repeat):
+    """
+    Runs the micro benchmarks
+    :return: List of results
+    """
+    cases = []
+    for name, columns in (('narrow', 6), ('wide', 200)):
+        data, description = create_data(rows if columns < 100 else rows // 10, columns, COLUMN_TYPES)
+        cases.append(('convert_{}_dicts'.format(name), len(data), columns,
+                      lambda data=data, description=description: PostgresHelper.ConvertPsycopg2Data(data,
+                                                                                                    description)))
+        cases.append(('convert_{}_compact'.format(name), len(data), columns,
+                      lambda data=data, description=description: PostgresHelper.ConvertPsycopg2Data(
+                          data, description, compact=True)))
+    for depth in (4, 8):
+        json_filter = create_deep_filter(depth)
+        cases.append(('filter_deep_{}'.format(depth), 2 ** depth, None,
+                      lambda json_filter=json_filter: PostgresHelper.convert_request_filter_to_string(json_filter)))
+    for leaves in (10, 500):
+        json_filter = create_wide_filter(leaves)
+        cases.append(('filter_wide_{}'.format(leaves), leaves, None,
+                      lambda json_filter=json_filter: PostgresHelper.convert_request_filter_to_string(json_filter)))
+    for values in (10, 500):
+        json_filter = create_in_filter(values)
+        cases.append(('filter_in_{}'.format(values), values, None,
+                      lambda json_filter=json_filter: PostgresHelper.convert_request_filter_to_string(json_filter)))
+    for fields in (1, 50):
+        order_fields = ['column_{}'.format(i) for i in range(fields)]
+        cases.append(('order_by_{}'.format(fields), fields, None,
+                      lambda order_fields=order_fields: PostgresHelper.convert_order_by_to_string(order_fields,
+                                                                                                   'asc')))
+
+    results = []
+    for name, size, columns, function in cases:
+        seconds = measure_call(function, repeat)
+        results.append({'name': name, 'size': size, 'columns': columns, 'seconds': seconds,
+                        'per_item_us': seconds / size * 1e6})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='Rows of the narrow results, wide ones have a tenth')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the results as json report to this file')
+    parser.add_argument('--baseline', help='Compare the results against this stored report')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.repeat)
+    print('{:<24} {:>8} {:>8} {:>12} {:>12}'.format('benchmark', 'size', 'columns', 'time', 'per item'))
+    for result in results:
+        print('{name:<24} {size:>8} {columns:>8} {ms:>10.4f}ms {per_item_us:>10.3f}us'.format(
+            ms=result['seconds'] * 1000, **dict(result, columns=result['columns'] or '')))
+
+    report = {'results': results}
+    if args.output:
+        report = write_report(args.output, 'bench_helper', results, rows=args.rows, repeat=args.repeat)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if not print_comparison(compare(report, baseline, args.tolerance)):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+Load test of the http endpoints. A throwaway database on the configured postgres server is seeded with tables of the
+given sizes, then /query/select, the schema endpoints and the health probes are requested by concurrent clients for a
+fixed time. Latency percentiles, requests per second and the peak memory are reported and can be written to a json
+report and compared against a stored baseline (see p2rest.benchmark.report).
+
+The service runs in this process on a threaded werkzeug server unless --url points to a running one (e.g. gunicorn);
+the database settings are taken from the configuration and the P2REST_DB_* environment variables.
+
+    python -m p2rest.benchmark.bench_load --rows 10000 1000000 --concurrency 1 8 --duration 10 --output load.json
+    python -m p2rest.benchmark.bench_load --rows 10000 --baseline load.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+from time import perf_counter
+from urllib.parse import urlsplit
+
+import psycopg2
+from werkzeug.serving import make_server
+
+from p2rest.src.config import config_by_name
+from p2rest.benchmark.report import summarize, peak_rss, write_report, compare, print_comparison
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        name varchar(50) NOT NULL,
+        price numeric(10, 2),
+        created timestamp,
+        category integer,
+        active boolean,
+        code text
+    );
+    INSERT INTO public.{table_name}
+    SELECT i, 'Name ' || i, (i % 1000) * 1.25, timestamp '2020-01-01' + i * interval '1 minute', i % 100, i % 2 = 0,
+           md5(i::text)
+    FROM generate_series(1, {rows}) i;
+    CREATE INDEX ON public.{table_name} (category);
+    ANALYZE public.{table_name};
+"""
+
+
+def connect(config, dbname):
+    connection = psycopg2.connect(host=config['P2REST_DB_HOST'], port=config['P2REST_DB_PORT'], dbname=dbname,
+                                  user=config['P2REST_DB_USER'], password=config['P2REST_DB_PASSWORD'])
+    connection.autocommit = True
+    return connection
+
+
+def seed(config, database, rows_list, reseed=False):
+    """
+    Creates the benchmark database and its tables. Tables that exist with the expected amount of rows are kept
+    :param config: Dictionary with the P2REST_DB_* settings, P2REST_DB_NAME is the database the new one is created from
+    :param database: Name of the benchmark database
+    :param rows_list: Amount of rows of every table
+    :param reseed: Create the tables even if they exist
+    """
+    connection = connect(config, config['P2REST_DB_NAME'])
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1 FROM pg_database WHERE datname = %s', (database,))
+        if cursor.fetchone() is None:
+            cursor.execute('CREATE DATABASE "{}"'.format(database.replace('"', '""')))
+    finally:
+        connection.close()
+
+    connection = connect(config, database)
+    try:
+        cursor = connection.cursor()
+        for rows in rows_list:
+            table_name = 'bench_{}'.format(rows)
+            if not reseed:
+                cursor.execute("SELECT to_regclass(%s) IS NOT NULL", ('public.' + table_name,))
+                if cursor.fetchone()[0]:
+                    cursor.execute('SELECT count(*) FROM public.{}'.format(table_name))
+                    if cursor.fetchone()[0] == rows:
+                        continue
+            logging.info('Seeding %s with %s rows', table_name, rows)
+            cursor.execute(QUERY_CREATE_TABLE.format(table_name=table_name, rows=rows))
+    finally:
+        connection.close()
+
+
+def drop(config, database):
+    """
+    Drops the benchmark database, the sessions of the service are terminated first
+    """
+    connection = connect(config, config['P2REST_DB_NAME'])
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid <> '
+                       'pg_backend_pid()', (database,))
+        cursor.execute('DROP DATABASE IF EXISTS "{}"'.format(database.replace('"', '""')))
+    finally:
+        connection.close()
+
+
+def create_scenarios(rows_list, max_results):
+    """
+    Returns the requests of the benchmark as tuples of name, method, path, body and headers
+    """
+    scenarios = [
+        ('health_live', 'GET', '/health/live', None, {}),
+        ('health_ready', 'GET', '/health/ready', None, {}),
+        ('schema_list', 'GET', '/schema/', None, {}),
+        ('schema_relations', 'GET', '/schema/public', None, {}),
+    ]
+    for rows in rows_list:
+        relation = {'schema': 'public', 'relation': 'bench_{}'.format(rows)}
+        limit = min(rows, max_results)
+        scenarios.extend([
+            ('select_page_{}'.format(rows), 'POST', '/query/select',
+             dict(relation, limit=100, order_fields=['id']), {}),
+            ('select_filter_{}'.format(rows), 'POST', '/query/select',
+             dict(relation, limit=100, filter={'column': 'category', 'operator': '=', 'value': 7}), {}),
+            ('select_large_{}'.format(rows), 'POST', '/query/select', dict(relation, limit=limit), {}),
+            ('select_stream_{}'.format(rows), 'POST', '/query/select', dict(relation, limit=limit),
+             {'Accept': 'application/x-ndjson'}),
+        ])
+    return scenarios
+
+
+def drive(url, scenario, concurrency, duration):
+    """
+    Sends the request of a scenario from concurrent clients until the duration is over
+    :param url: Base url of the service
+    :param scenario: Tuple of name, method, path, body and headers
+    :param concurrency: Amount of clients sending requests one after the other
+    :param duration: Seconds the clients send requests
+    :return: Summary of the latencies, see summarize
+    """
+    _, method, path, body, headers = scenario
+    location = urlsplit(url)
+    headers = dict(headers)
+    if body is not None:
+        body = json.dumps(body).encode()
+        headers['Content-Type'] = 'application/json'
+    latencies = []
+    errors = []
+    start = perf_counter()
+    deadline = start + duration
+
+    def client():
+        connection = http.client.HTTPConnection(location.hostname, location.port or 80, timeout=60)
+        own_latencies = []
+        own_errors = 0
+        try:
+            while perf_counter() < deadline:
+                begin = perf_counter()
+                try:
+                    connection.request(method, location.path.rstrip('/') + path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        own_errors += 1
+                        continue
+                except (OSError, http.client.HTTPException):
+                    own_errors += 1
+                    connection.close()
+                    continue
+                own_latencies.append(perf_counter() - begin)
+        finally:
+            connection.close()
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, perf_counter() - start, sum(errors))
+
+
+def start_server(config_name):
+    """
+    Creates the app and serves it on a free port in a background thread
+    :return: The base url and the server
+    """
+    from p2rest.src import create_app
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, create_app(config_name), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_port), server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000], help='Rows of the seeded tables')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per scenario and concurrency')
+    parser.add_argument('--scenarios', nargs='+', help='Run only the scenarios starting with these names')
+    parser.add_argument('--database', default='p2rest_benchmark', help='Name of the throwaway database')
+    parser.add_argument('--config', default='prod', choices=sorted(config_by_name))
+    parser.add_argument('--url', help='Base url of a running service that uses the benchmark database')
+    parser.add_argument('--reseed', action='store_true', help='Create the tables even if they exist')
+    parser.add_argument('--drop', action='store_true', help='Drop the benchmark database afterwards')
+    parser.add_argument('--output', help='Write the results as json report to this file')
+    parser.add_argument('--baseline', help='Compare the results against this stored report')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    config_class = config_by_name[args.config]
+    config = {key: getattr(config_class, key) for key in dir(config_class) if key.startswith('P2REST_')}
+    config.update({key: os.environ[key] for key in config if key in os.environ})
+    seed(config, args.database, args.rows, args.reseed)
+
+    url = args.url
+    if url is None:
+        os.environ['P2REST_DB_NAME'] = args.database
+        url, _ = start_server(args.config)
+
+    results = []
+    print('{:<28} {:>4} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('scenario', 'c', 'requests', 'errors', 'rps',
+                                                                  'p50', 'p95', 'p99'))
+    for scenario in create_scenarios(args.rows, int(config['P2REST_MAX_RESULTS'])):
+        if args.scenarios and not any(scenario[0].startswith(name) for name in args.scenarios):
+            continue
+        for concurrency in args.concurrency:
+            result = drive(url, scenario, concurrency, args.duration)
+            result.update(name='{}@c{}'.format(scenario[0], concurrency), scenario=scenario[0],
+                          concurrency=concurrency, peak_rss_mb=peak_rss())
+            results.append(result)
+            print('{scenario:<28} {concurrency:>4} {requests:>8} {errors:>7} {rps:>9.1f} {p50:>7.2f}ms {p95:>7.2f}ms '
+                  '{p99:>7.2f}ms'.format(**dict(result, **{key: result[key] or 0 for key in ('p50', 'p95', 'p99')})))
+    print('peak rss {:.1f} MB{}'.format(peak_rss(), ' (client only)' if args.url else ''))
+
+    report = {'results': results}
+    if args.output:
+        report = write_report(args.output, 'bench_load', results, rows=args.rows, concurrency=args.concurrency,
+                              duration=args.duration, url=args.url, in_process=args.url is None)
+    if args.drop:
+        drop(config, args.database)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if not print_comparison(compare(report, baseline, args.tolerance)):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of the cold start of a worker: the import of the package, the creation of the app and the latency of the
+first requests (/health/live, which needs no database, and the first and second /swagger.json, whose specification
+is generated on the first request). Every run is a new python process. No database is needed, the connections are
+opened lazily.
+
+    python -m p2rest.benchmark.bench_startup --repeat 5
+    P2REST_DOCS=false python -m p2rest.benchmark.bench_startup
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+PHASES = ('import', 'create_app', 'first_request', 'first_swagger', 'second_swagger')
+
+
+def measure_startup(config_name):
+    """
+    Measures the startup phases in the current process, the package must not have been imported yet
+    :return: Dictionary of the phases to milliseconds, None for the specification if the docs are disabled
+    """
+    start = perf_counter()
+    from p2rest.src import create_app
+    imported = perf_counter()
+    app = create_app(config_name)
+    created = perf_counter()
+    client = app.test_client()
+    client.get('/health/live')
+    first_request = perf_counter()
+    results = {'import': imported - start, 'create_app': created - imported, 'first_request': first_request - created}
+    for phase in ('first_swagger', 'second_swagger'):
+        begin = perf_counter()
+        response = client.get('/swagger.json')
+        results[phase] = perf_counter() - begin if response.status_code == 200 else None
+    return {phase: None if value is None else value * 1000 for phase, value in results.items()}
+
+
+def run(config_name, repeat):
+    """
+    Runs the measurement in new processes
+    :return: Dictionary of the phases to the list of milliseconds of all runs
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-m', 'p2rest.benchmark.bench_startup', '--child', '--config',
+                                 config_name], check=True, stdout=subprocess.PIPE).stdout
+        runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+    return {phase: [result[phase] for result in runs] for phase in PHASES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--config', default='prod')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure_startup(args.config)))
+        return
+
+    print('{:<16} {:>10} {:>10} {:>10}'.format('phase', 'min', 'median', 'max'))
+    for phase, values in run(args.config, args.repeat).items():
+        if None in values:
+            print('{:<16} {:>10}'.format(phase, 'disabled'))
+            continue
+        print('{:<16} {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms'.format(phase, min(values), statistics.median(values),
+                                                               max(values)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Reports of the benchmark suite: latency percentiles, peak memory and the comparison of a run against a stored
+baseline. The reports are json documents of the form
+
+    {"benchmark": "bench_load", "environment": {...}, "results": [{"name": ..., "p50": ..., "rps": ...}, ...]}
+
+and can be compared with 'python -m p2rest.benchmark.report <report> <baseline>'.
+"""
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+
+# metrics of a result where a higher value is better, the other compared metrics are better when lower
+HIGHER_IS_BETTER = ('rps',)
+# metrics compared against the baseline
+COMPARED_METRICS = ('p50', 'p95', 'p99', 'rps', 'seconds')
+
+
+def percentile(values, share):
+    """
+    Returns the percentile of a list of values by linear interpolation between the closest ranks
+    :param values: The measured values
+    :param share: The percentile as a share between 0 and 1, e.g. 0.95
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * share
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies, seconds, errors=0):
+    """
+    Summarizes the latencies of the requests of a load run
+    :param latencies: Seconds of every successful request
+    :param seconds: Wall clock seconds of the run
+    :param errors: Amount of failed requests
+    :return: Dictionary with the percentiles in milliseconds and the requests per second
+    """
+    return {'requests': len(latencies), 'errors': errors, 'duration': seconds,
+            'rps': len(latencies) / seconds if seconds else None,
+            'p50': percentile(latencies, 0.5) * 1000 if latencies else None,
+            'p95': percentile(latencies, 0.95) * 1000 if latencies else None,
+            'p99': percentile(latencies, 0.99) * 1000 if latencies else None,
+            'max': max(latencies) * 1000 if latencies else None}
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in megabytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def write_report(path, benchmark, results, **environment):
+    """
+    Writes the results of a benchmark as json report
+    :param path: File name of the report
+    :param benchmark: Name of the benchmark
+    :param results: List of result dictionaries, each with a unique "name"
+    :param environment: Settings of the run that are stored with the results
+    :return: The report
+    """
+    report = {'benchmark': benchmark, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'environment': dict(environment, python=platform.python_version(), platform=platform.platform(),
+                                  peak_rss_mb=peak_rss()),
+              'results': results}
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+    return report
+
+
+def compare(report, baseline, tolerance=0.1):
+    """
+    Compares the results of a report against a baseline
+    :param report: The report of the current run
+    :param baseline: The stored report
+    :param tolerance: Relative change of a metric in the worse direction that counts as regression
+    :return: List of tuples of the result name, the metric, the baseline value, the current value, the relative
+             change and whether it is a regression
+    """
+    baseline_results = {result['name']: result for result in baseline['results']}
+    changes = []
+    for result in report['results']:
+        previous = baseline_results.get(result['name'])
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if result.get(metric) is None or not previous.get(metric):
+                continue
+            change = (result[metric] - previous[metric]) / previous[metric]
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            changes.append((result['name'], metric, previous[metric], result[metric], change, worse > tolerance))
+    return changes
+
+
+def print_comparison(changes):
+    """
+    Prints the comparison of a report against a baseline
+    :return: True if there is no regression
+    """
+    print('{:<48} {:<8} {:>12} {:>12} {:>8}'.format('result', 'metric', 'baseline', 'current', 'change'))
+    for name, metric, previous, current, change, regression in changes:
+        print('{:<48} {:<8} {:>12.6g} {:>12.6g} {:>+7.1%}{}'.format(name, metric, previous, current, change,
+                                                                    ' REGRESSION' if regression else ''))
+    return not any(change[-1] for change in changes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('report', help='Report of the current run')
+    parser.add_argument('baseline', help='Stored report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative change in the worse direction that fails the comparison')
+    args = parser.parse_args()
+    with open(args.report) as file:
+        report = json.load(file)
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if not print_comparison(compare(report, baseline, args.tolerance)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,99 @@
 import os
+import click
 from flask import Flask
 from werkzeug.exceptions import HTTPException, BadRequest, InternalServerError, NotFound, NotImplemented, MethodNotAllowed, \
     Unauthorized, Forbidden
 from p2rest.src.api import api
 from p2rest.src.config import config_by_name
+from p2rest.src.database.pool import init_pool
+from p2rest.src.database.catalog import init_catalog
+from p2rest.src.database.results import init_result_cache
+from p2rest.src.database.probe import init_prober
+from p2rest.src.database.governor import init_governor
+from p2rest.src.database.replicas import init_router
+from p2rest.src.database.analytics import init_analytics
+from p2rest.src.metrics import init_metrics, record_error
+from p2rest.src.timing import init_timing
+from p2rest.src.compression import init_compression
+from p2rest.src.encoders import init_encoder
+
+
+def to_bool(value):
+    """
+    Converts the string value of an environment variable into a boolean
+    """
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Configuration variables that can be overwritten with environment variables and the function used to convert them
+ENVIRONMENT_VARIABLES = [
+    ('P2REST_DB_HOST', str),
+    ('P2REST_DB_PORT', str),
+    ('P2REST_DB_NAME', str),
+    ('P2REST_DB_USER', str),
+    ('P2REST_DB_PASSWORD', str),
+    ('P2REST_MAX_RESULTS', int),
+    ('P2REST_DOCS', to_bool),
+    ('P2REST_ADMIN_API_KEY', str),
+    ('P2REST_DB_REPLICAS', str),
+    ('P2REST_DB_REPLICA_POLICY', str),
+    ('P2REST_DB_REPLICA_MAX_LAG', float),
+    ('P2REST_DB_REPLICA_CHECK_INTERVAL', float),
+    ('P2REST_DB_POOL_MIN_SIZE', int),
+    ('P2REST_DB_POOL_MAX_SIZE', int),
+    ('P2REST_DB_POOL_IDLE_TIMEOUT', float),
+    ('P2REST_DB_POOL_MAX_LIFETIME', float),
+    ('P2REST_DB_POOL_CHECK_ON_CHECKOUT', to_bool),
+    ('P2REST_DB_POOL_TIMEOUT', float),
+    ('P2REST_STATEMENT_CACHE_SIZE', int),
+    ('P2REST_PREPARE_THRESHOLD', int),
+    ('P2REST_CATALOG_TTL', float),
+    ('P2REST_CATALOG_LISTEN', to_bool),
+    ('P2REST_CATALOG_CHANNEL', str),
+    ('P2REST_CATALOG_REFRESH_INTERVAL', float),
+    ('P2REST_CATALOG_VALIDATE', to_bool),
+    ('P2REST_RENDER_ENGINE', str),
+    ('P2REST_JSON_ENCODER', str),
+    ('P2REST_STREAM_BATCH_SIZE', int),
+    ('P2REST_PARQUET_ROW_GROUP_SIZE', int),
+    ('P2REST_BATCH_MAX_QUERIES', int),
+    ('P2REST_BATCH_CONCURRENCY', int),
+    ('P2REST_INGEST_CHUNK_SIZE', int),
+    ('P2REST_EXPORT_MAX_ROWS', int),
+    ('P2REST_EXPORT_MAX_CONCURRENT', int),
+    ('P2REST_EXPORT_CHUNK_SIZE', int),
+    ('P2REST_RESULT_CACHE_RELATIONS', str),
+    ('P2REST_RESULT_CACHE_TTL', float),
+    ('P2REST_RESULT_CACHE_MAX_BYTES', int),
+    ('P2REST_RESULT_CACHE_CHECK_INTERVAL', float),
+    ('P2REST_RESULT_CACHE_CHANNEL', str),
+    ('P2REST_HEALTH_PROBE_INTERVAL', float),
+    ('P2REST_HEALTH_PROBE_TIMEOUT', float),
+    ('P2REST_HEALTH_PROBE_BACKGROUND', to_bool),
+    ('P2REST_HEALTH_REPLICATION_LAG', to_bool),
+    ('P2REST_HEALTH_MAX_REPLICATION_LAG', float),
+    ('P2REST_METRICS', to_bool),
+    ('P2REST_METRICS_PATH', str),
+    ('P2REST_SERVER_TIMING', to_bool),
+    ('P2REST_TIMING_ENVELOPE', to_bool),
+    ('P2REST_COMPRESSION', to_bool),
+    ('P2REST_COMPRESSION_MIN_SIZE', int),
+    ('P2REST_COMPRESSION_ENCODINGS', str),
+    ('P2REST_COMPRESSION_GZIP_LEVEL', int),
+    ('P2REST_COMPRESSION_BROTLI_LEVEL', int),
+    ('P2REST_COMPRESSION_ZSTD_LEVEL', int),
+    ('P2REST_STATEMENT_TIMEOUT', int),
+    ('P2REST_LOCK_TIMEOUT', int),
+    ('P2REST_RELATION_TIMEOUTS', str),
+    ('P2REST_GOVERNOR_MAX_COST', float),
+    ('P2REST_GOVERNOR_MAX_ROWS', float),
+    ('P2REST_GOVERNOR_QUEUE_COST', float),
+    ('P2REST_GOVERNOR_QUEUE_SLOTS', int),
+    ('P2REST_GOVERNOR_QUEUE_TIMEOUT', float),
+    ('P2REST_ANALYTICS_SAMPLE_RATE', float),
+    ('P2REST_ANALYTICS_MAX_SHAPES', int),
+    ('P2REST_ANALYTICS_MIN_ROWS', int),
+]
 
 
 def configure_app(app, config_name):
@@ -18,16 +108,9 @@ def configure_app(app, config_name):
     if os.getenv('P2REST_CONFIG') is not None:
         app.config.from_envvar('P2REST_CONFIG')
     # overwrite config variables that are provided as environment variables
-    if os.getenv('P2REST_DB_HOST') is not None:
-        app.config['P2REST_DB_HOST'] = os.getenv('P2REST_DB_HOST')
-    if os.getenv('P2REST_DB_PORT') is not None:
-        app.config['P2REST_DB_PORT'] = os.getenv('P2REST_DB_PORT')
-    if os.getenv('P2REST_DB_NAME') is not None:
-        app.config['P2REST_DB_NAME'] = os.getenv('P2REST_DB_NAME')
-    if os.getenv('P2REST_DB_USER') is not None:
-        app.config['P2REST_DB_USER'] = os.getenv('P2REST_DB_USER')
-    if os.getenv('P2REST_DB_PASSWORD') is not None:
-        app.config['P2REST_DB_PASSWORD'] = os.getenv('P2REST_DB_PASSWORD')
+    for key, convert in ENVIRONMENT_VARIABLES:
+        if os.getenv(key) is not None:
+            app.config[key] = convert(os.getenv(key))
 
 
 def create_app(config_name='prod') -> Flask:
@@ -37,25 +120,55 @@ def create_app(config_name='prod') -> Flask:
     """
     app = Flask('p2rest', instance_relative_config=False)
     configure_app(app, config_name)
+    pool = init_pool(app)
+    catalog = init_catalog(app, pool)
+    results = init_result_cache(app, pool, catalog)
+    init_prober(app, pool)
+    init_router(app, pool)
+    init_governor(app)
+    init_analytics(app, catalog)
+    init_encoder(app)
+    init_metrics(app)
+    # the after request hooks run in reverse order: timing completes the body, compression encodes it and the metrics
+    # see the final response
+    init_compression(app)
+    init_timing(app)
+
+    @app.cli.command('install-event-trigger')
+    def install_event_trigger():
+        """
+        Installs the event trigger that notifies all workers about schema changes (needs superuser privileges)
+        """
+        catalog.install_event_trigger()
+
+    @app.cli.command('install-write-trigger')
+    @click.argument('relation')
+    def install_write_trigger(relation):
+        """
+        Installs a trigger that notifies all workers about writes to a table ("schema.relation") of the result cache
+        """
+        results.install_write_trigger(relation)
 
     # Create app context
     with app.app_context():
-        # Register Blueprints
-        api.init_app(app)
+        # Register Blueprints. The swagger specification is generated on the first request of /swagger.json
+        api.init_app(app, add_specs=app.config['P2REST_DOCS'])
 
         @api.errorhandler(HTTPException)
         @app.errorhandler(HTTPException)
         def handle_bad_request(error, *args, **kwargs):
+            record_error(error)
             temp = {
                        'status_code': error.code,
                        'message': error.name,
                        'description': error.description,
                        'duration': error.duration if hasattr(error, 'duration') else 0,
                        'count': 0,
-                       'data': []
+                       'data': error.details if hasattr(error, 'details') else []
                    }
             temp.update(**kwargs)
-            return temp, error.code
+            headers = {'Retry-After': str(error.retry_after)} if getattr(error, 'retry_after', None) else {}
+            return temp, error.code, headers
 
         # @api.errorhandler(InternalServerError)
         # def internal_error_handler(error, *args, **kwargs):
@@ -1,15 +1,19 @@
 from flask_restplus import Api
+from flask_restplus.representations import output_json
+from p2rest.src import timing
 from .health import health_api
 from .schema import schema_api
 from .query import query_api
+from .bulk import bulk_api
+from .admin import admin_api
 
 authorizations = {
     'apikey': {
         'type': 'apiKey',
         'in': 'header',
         'name': 'Authorization',
-        'description': "Type in the *'Value'* input box below: **'Bearer &lt;JWT&gt;'**, "
-                       "where JWT is the token"
+        'description': "Type in the *'Value'* input box below: **'Bearer &lt;key&gt;'**, "
+                       "where key is the api key of the admin endpoints (P2REST_ADMIN_API_KEY)"
     }
 }
 
@@ -32,3 +36,14 @@ api = Api(
 api.add_namespace(health_api, path='/health')
 api.add_namespace(schema_api, path='/schema')
 api.add_namespace(query_api, path='/query')
+api.add_namespace(bulk_api, path='/bulk')
+api.add_namespace(admin_api, path='/admin')
+
+
+@api.representation('application/json')
+def output_json_timed(data, code, headers=None):
+    """
+    Renders the responses of the resources as json and measures the time needed
+    """
+    with timing.span('serialize'):
+        return output_json(data, code, headers)
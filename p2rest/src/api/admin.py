@@ -0,0 +1,158 @@
+import hmac
+from functools import wraps
+from time import perf_counter_ns
+from flask import request, current_app
+from werkzeug.exceptions import BadRequest, Unauthorized, Forbidden
+from flask_restplus import Namespace, Resource, fields
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.catalog import get_catalog
+from p2rest.src.database.results import get_result_cache
+from p2rest.src.database.probe import get_prober
+from p2rest.src.database.governor import get_governor
+from p2rest.src.database.replicas import get_router, get_read_pool
+from p2rest.src.database.analytics import get_analytics, SHAPE_ORDERS
+from p2rest.src import timing
+
+
+def require_api_key(function):
+    """
+    Decorator of the admin resources. The request has to send the api key of P2REST_ADMIN_API_KEY in the header
+    "Authorization: Bearer <key>". Without a configured key the admin endpoints are disabled
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        api_key = current_app.config['P2REST_ADMIN_API_KEY']
+        if not api_key:
+            raise Forbidden('The admin endpoints are disabled. Set P2REST_ADMIN_API_KEY to enable them.')
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), api_key.encode()):
+            raise Unauthorized('A valid api key has to be sent in the Authorization header.')
+        return function(*args, **kwargs)
+    return wrapper
+
+
+# Blueprint Configuration
+admin_api = Namespace(name='admin',
+                      description='Endpoints for inspecting and resetting the statistics of the service, they '
+                                  'require the api key',
+                      decorators=[require_api_key])
+
+
+statistics_result_model = admin_api.model('statistics_result', {
+    'status_code': fields.Integer(),
+    'message': fields.String(),
+    'description': fields.String(),
+    'duration': fields.String(),
+    'data': fields.Raw(),
+})
+
+
+@admin_api.route('/statistics')
+@admin_api.doc(security='apikey')
+@admin_api.response(401, 'Missing or invalid api key.')
+@admin_api.response(500, 'Internal server error.')
+class StatisticsApi(Resource):
+    """
+    This is the resource that is responsible for returning usage statistics of the caches and the connection pool
+    of this worker process
+    """
+
+    @admin_api.doc('Shows the usage statistics of this worker process')
+    @admin_api.marshal_with(statistics_result_model)
+    def get(self):
+        starttime = perf_counter_ns()
+        pool = get_pool()
+        response = {
+            'status_code': 200,
+            'message': 'Statistics',
+            'description': 'Contains usage statistics of the connection pool and the caches of this worker process',
+            'data': {
+                'pool': pool.stats(),
+                'statements': pool.statements.stats(),
+                'catalog': get_catalog().stats(),
+                'results': get_result_cache().stats(),
+                'prober': get_prober().stats(),
+                'governor': get_governor().stats(),
+                'replicas': get_router().stats(),
+                'analytics': get_analytics().stats()
+            }
+        }
+        response['duration'] = timing.duration(starttime)
+        return response
+
+
+@admin_api.route('/queries')
+@admin_api.doc(security='apikey')
+@admin_api.response(401, 'Missing or invalid api key.')
+@admin_api.response(400, 'Invalid order or limit.')
+class QueriesApi(Resource):
+    """
+    This is the resource that is responsible for returning the query shapes recorded by the query analytics of this
+    worker process
+    """
+
+    @admin_api.doc('Shows the slowest or most frequent query shapes of this worker process',
+                    params={'order': 'slowest (default), frequent or total', 'limit': 'Maximum amount of shapes'})
+    @admin_api.marshal_with(statistics_result_model)
+    def get(self):
+        starttime = perf_counter_ns()
+        order = request.args.get('order', 'slowest')
+        if order not in SHAPE_ORDERS:
+            raise BadRequest('Invalid order provided. Must be one of {}.'.format(', '.join(SHAPE_ORDERS)))
+        try:
+            limit = int(request.args.get('limit', 20))
+        except ValueError:
+            raise BadRequest('Invalid limit provided. Must be an integer.')
+        analytics = get_analytics()
+        shapes = analytics.shapes(order, limit)
+        response = {
+            'status_code': 200,
+            'message': 'Queries',
+            'description': 'Contains the query shapes of the sampled selects of this worker process',
+            'data': {
+                'statistics': analytics.stats(),
+                'shapes': shapes
+            }
+        }
+        response['duration'] = timing.duration(starttime)
+        return response
+
+    @admin_api.doc('Removes the recorded query shapes of this worker process')
+    @admin_api.marshal_with(statistics_result_model)
+    def delete(self):
+        starttime = perf_counter_ns()
+        get_analytics().reset()
+        response = {
+            'status_code': 200,
+            'message': 'Queries',
+            'description': 'The recorded query shapes of this worker process were removed',
+            'data': {}
+        }
+        response['duration'] = timing.duration(starttime)
+        return response
+
+
+@admin_api.route('/indexes')
+@admin_api.doc(security='apikey')
+@admin_api.response(401, 'Missing or invalid api key.')
+@admin_api.response(500, 'Internal server error.')
+class IndexesApi(Resource):
+    """
+    This is the resource that is responsible for suggesting indexes for the query shapes recorded by the query
+    analytics of this worker process
+    """
+
+    @admin_api.doc('Suggests missing indexes for the recorded query shapes of this worker process')
+    @admin_api.marshal_with(statistics_result_model)
+    def get(self):
+        starttime = perf_counter_ns()
+        # the scan counters are read from the server that answers the selects
+        suggestions = get_analytics().advise(get_read_pool())
+        response = {
+            'status_code': 200,
+            'message': 'Indexes',
+            'description': 'Contains indexes that would serve the filters and orders of the recorded query shapes',
+            'data': suggestions
+        }
+        response['duration'] = timing.duration(starttime)
+        return response
@@ -0,0 +1,423 @@
+import re
+import logging
+import threading
+from time import perf_counter_ns
+from urllib.parse import quote
+
+import psycopg2
+from flask import request, current_app, Response, stream_with_context
+from flask_restplus import Namespace, Resource, fields, marshal
+from werkzeug import exceptions
+
+from p2rest.src.database.postgres import Postgres
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.replicas import get_read_pool
+from p2rest.src.database.governor import get_governor
+from p2rest.src.database.catalog import get_catalog, normalize_identifier
+from p2rest.src.database.results import get_result_cache
+from p2rest.src.database.bulk import CsvReader, NdjsonReader, IngestError, parse_csv_line, parse_ndjson_line, \
+    first_line, check_json_value, check_text_value
+from p2rest.src.database import arrow
+from p2rest.src import timing
+from p2rest.src.api.query import NDJSON_MIMETYPE, COLUMNAR_FORMATS, create_filter_model, validate_select
+
+# Kinds of relations rows can be copied into: tables and partitioned tables
+TABLE_KINDS = ('r', 'p')
+# Characters that are replaced in the plain filename of an export: non ascii, control characters, quotes and backslashes
+UNSAFE_FILENAME = re.compile(r'[^\x20-\x7e]|["\\]')
+
+# Blueprint Configuration
+bulk_api = Namespace(name='bulk',
+                     description='Endpoints for loading large amounts of data into the database and reading them '
+                                 'from it')
+
+
+ingest_result_model = bulk_api.model('ingest_result', {
+    'status_code': fields.Integer(),
+    'message': fields.String(),
+    'description': fields.String(),
+    'count': fields.Integer(description='Amount of rows that were loaded'),
+    'duration': fields.String(),
+    'data': fields.Nested(bulk_api.model('ingest_result_data', {
+        'rows': fields.Integer(description='Amount of rows that were loaded'),
+        'bytes': fields.Integer(description='Size of the request body'),
+        'rows_per_second': fields.Float(),
+        'bytes_per_second': fields.Float()
+    }))
+})
+
+ingest_parser = bulk_api.parser()
+ingest_parser.add_argument('format', type=str, location='args', choices=('csv', 'ndjson'),
+                           help='Format of the body. The default is taken from the content type')
+ingest_parser.add_argument('header', type=str, location='args', default='true',
+                           help='For csv: the first line contains the column names')
+ingest_parser.add_argument('columns', type=str, location='args',
+                           help='Comma separated column names of the fields of every line. Defaults to the header of a '
+                                'csv body, the keys of the first line of a ndjson body or all columns of the relation')
+
+
+export_model = bulk_api.model('export', {
+    'schema': fields.String(title='Postgres Schema',
+                            description='Specifies the schema where the relation can be found',
+                            required=True,
+                            example='public'),
+    'relation': fields.String(title='Table or View',
+                              description='This is the relation (table or view) we want to export',
+                              required=True,
+                              example='table_name'),
+    'fields': fields.List(fields.String,
+                          title='Table or view fields',
+                          description='List of fields that shall be exported.',
+                          required=False,
+                          example=['*'],
+                          default=['*']),
+    'filter': fields.Nested(create_filter_model(),
+                            title='Filter query',
+                            description='The same filter as for POST /query/select',
+                            required=False),
+    'order_fields': fields.List(fields.String,
+                                title='Fields to order result',
+                                description='List of fields that shall be used for ordering the rows.',
+                                required=False,
+                                example=['field1'],
+                                default=[]),
+    'order_type': fields.String(title='Order type',
+                                description='Either "asc" or "desc"',
+                                required=False,
+                                example='asc',
+                                default='asc'),
+    'limit': fields.Integer(title='Limit',
+                            description='Maximum amount of rows. P2REST_MAX_RESULTS does not apply to exports, but '
+                                        'the limit is capped by P2REST_EXPORT_MAX_ROWS if it is set',
+                            required=False),
+    'format': fields.String(title='Format',
+                            description='"csv", "binary" (the binary COPY format of postgres), "arrow" (arrow ipc '
+                                        'stream) or "parquet". The columnar formats require pyarrow',
+                            required=False,
+                            enum=['csv', 'binary', 'arrow', 'parquet'],
+                            default='csv'),
+    'header': fields.Boolean(title='Header',
+                             description='For csv: the first line contains the column names',
+                             required=False,
+                             default=True)
+})
+
+# Content types of the export formats
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'binary': 'application/octet-stream',
+    'arrow': arrow.ARROW_MIMETYPE,
+    'parquet': arrow.PARQUET_MIMETYPE
+}
+
+# File extensions of the export formats
+EXPORT_EXTENSIONS = {
+    'csv': 'csv',
+    'binary': 'bin',
+    'arrow': 'arrows',
+    'parquet': 'parquet'
+}
+
+
+def get_export_slots():
+    """
+    Returns the semaphore that limits the concurrent exports of this worker process
+    """
+    slots = current_app.extensions.get('p2rest_export_slots')
+    if slots is None:
+        slots = current_app.extensions.setdefault(
+            'p2rest_export_slots', threading.BoundedSemaphore(current_app.config['P2REST_EXPORT_MAX_CONCURRENT']))
+    return slots
+
+
+def get_ingest_format(args):
+    """
+    Evaluates the format of the request body
+    :param args: The query arguments
+    :return: 'csv' or 'ndjson'
+    """
+    if args.get('format'):
+        return args['format']
+    if request.mimetype == 'text/csv':
+        return 'csv'
+    if request.mimetype == NDJSON_MIMETYPE:
+        return 'ndjson'
+    raise exceptions.BadRequest('Unsupported content type {}. Use text/csv or {}'.format(request.mimetype,
+                                                                                         NDJSON_MIMETYPE))
+
+
+def map_columns(relation, columns):
+    """
+    Maps the column names of an upload to the columns of the relation. Names are taken as they are and, if there is
+    no such column, as identifier (unquoted names are folded to lower case)
+    :param relation: Relation information of the catalog
+    :param columns: The column names of the upload
+    :return: List of the column names as stored in the catalog
+    """
+    names = []
+    for column in columns:
+        name = column if column in relation['columns'] else normalize_identifier(column.strip())
+        if name not in relation['columns']:
+            raise exceptions.BadRequest('Unknown column for relation {}.{}: {}'.format(relation['schema'],
+                                                                                     relation['name'], column))
+        if name in names:
+            raise exceptions.BadRequest('Column {} is provided more than once'.format(column))
+        names.append(name)
+    return names
+
+
+def content_disposition(filename):
+    """
+    Returns the Content-Disposition header of an attachment. The filename is sent as UTF-8 (RFC 5987) and with an
+    ascii fallback for older clients
+    :param filename: The name of the file as stored in the catalog, may contain any character
+    :return: The value of the header
+    """
+    return 'attachment; filename="{}"; filename*=UTF-8\'\'{}'.format(UNSAFE_FILENAME.sub('_', filename),
+                                                                     quote(filename, safe=''))
+
+
+def validate_ingest(relation, names, row=None, fields=None, line=1):
+    """
+    Checks the columns of an upload against the catalog before the copy is started: generated columns can not be
+    loaded and columns without a value must have a default or be nullable. The values of the first line are checked
+    against the column types
+    :param relation: Relation information of the catalog
+    :param names: The column names of the upload as returned by map_columns
+    :param row: The first line of a ndjson upload with the keys in the order of the names
+    :param fields: The fields of the first data line of a csv upload in the order of the names
+    :param line: The number of the first data line, used in error messages
+    """
+    generated = [name for name in names if relation['columns'][name]['generated']]
+    if generated:
+        raise exceptions.BadRequest('Generated columns can not be loaded: {}'.format(', '.join(generated)))
+    missing = [name for name, column in relation['columns'].items()
+               if name not in names and not column['nullable'] and not column['default'] and not column['generated']]
+    if missing:
+        raise exceptions.BadRequest('Columns without a default value have to be provided: {}'.format(
+            ', '.join(missing)))
+    for key, name in zip(row or {}, names):
+        if not check_json_value(row[key], relation['columns'][name]['type']):
+            raise exceptions.BadRequest('Line {}: the value of column {} does not fit its type {}'.format(
+                line, key, relation['columns'][name]['type']))
+    # empty fields are NULL
+    for field, name in zip(fields or [], names):
+        if field and not check_text_value(field, relation['columns'][name]['type']):
+            raise exceptions.BadRequest('Line {}: the value of column {} does not fit its type {}'.format(
+                line, name, relation['columns'][name]['type']))
+
+
+@bulk_api.route('/ingest/<string:schema>/<string:relation>')
+@bulk_api.response(exceptions.BadRequest.code, "BadRequest")
+@bulk_api.response(exceptions.InternalServerError.code, "InternalServerError")
+@bulk_api.response(exceptions.Unauthorized.code, "Unauthorized")
+@bulk_api.response(exceptions.Forbidden.code, "Forbidden")
+@bulk_api.response(exceptions.MethodNotAllowed.code, "MethodNotAllowed")
+class IngestApi(Resource):
+    """
+    This is the resource that is responsible for loading rows into a table
+    """
+
+    @bulk_api.response(200, 'Success', ingest_result_model)
+    @bulk_api.expect(ingest_parser)
+    def post(self, schema, relation):
+        """
+        This endpoint loads the rows of a csv (text/csv) or newline delimited json (application/x-ndjson) body into a
+        table with COPY. The body is passed to the database in chunks while it is received, all rows are committed
+        in one transaction. Columns that are not part of the upload get their default values.
+        :return: Amount of rows loaded and the throughput
+        """
+        start_time = perf_counter_ns()
+        args = ingest_parser.parse_args()
+        response = {
+            'status_code': 200,
+            'message': 'Ingest data',
+            'description': 'Load data into {}.{}'.format(schema, relation),
+            'count': 0
+        }
+
+        reader = None
+        received = 0
+        try:
+            body_format = get_ingest_format(args)
+            relation_info = get_catalog().get_relation(schema, relation)
+            if relation_info is None:
+                raise exceptions.BadRequest('Relation {}.{} does not exist'.format(schema, relation))
+            if relation_info['kind'] not in TABLE_KINDS:
+                raise exceptions.BadRequest('Relation {}.{} is not a table'.format(schema, relation))
+            columns = args['columns'].split(',') if args.get('columns') else None
+
+            stream = request.stream
+            line = first_line(stream)
+            if line is None:
+                raise exceptions.BadRequest('No data provided for loading into the database')
+            if body_format == 'csv':
+                number = 1
+                if args['header'].lower() in ('1', 'true', 'yes', 'on'):
+                    columns = parse_csv_line(line)
+                    received = len(line)
+                    line = first_line(stream)
+                    number = 2
+                names = map_columns(relation_info, columns or [name for name, column in relation_info['columns'].items()
+                                                                if not column['generated']])
+                # a line with an open quote continues in the next one, such rows are left to COPY
+                fields = parse_csv_line(line) if line is not None and line.count(b'"') % 2 == 0 else None
+                validate_ingest(relation_info, names, fields=fields if fields and len(fields) == len(names) else None,
+                                line=number)
+                reader = CsvReader(stream, first=line)
+            else:
+                try:
+                    row = parse_ndjson_line(line, 1)
+                except IngestError as error:
+                    raise exceptions.BadRequest(str(error))
+                if columns is None:
+                    columns = list(row)
+                names = map_columns(relation_info, columns)
+                validate_ingest(relation_info, names, {column: row.get(column) for column in columns})
+                reader = NdjsonReader(stream, columns, [relation_info['columns'][name]['type'] for name in names],
+                                      first=line)
+
+            rows = Postgres.copy_from(pool=get_pool(), schema=relation_info['schema'],
+                                      relation=relation_info['name'], columns=names, file=reader,
+                                      chunk_size=current_app.config['P2REST_INGEST_CHUNK_SIZE'])
+            get_result_cache().invalidate((relation_info['schema'], relation_info['name']))
+        except exceptions.BadRequest as error:
+            logging.warning('Bad request for POST /bulk/ingest: %s', str(error.args))
+            error.duration = timing.duration(start_time)
+            raise error
+        except psycopg2.Error as error:
+            logging.warning('Could not load data during POST /bulk/ingest: %s', str(error.args))
+            if reader is not None and reader.error is not None:
+                exception = exceptions.BadRequest(str(reader.error))
+            elif isinstance(error, (psycopg2.DataError, psycopg2.IntegrityError)):
+                exception = exceptions.BadRequest('Could not load data. Error: {}'.format(str(error.args)))
+            else:
+                exception = exceptions.InternalServerError('Could not load data. Error: {}'.format(str(error.args)))
+            exception.duration = timing.duration(start_time)
+            raise exception
+        except Exception as error:
+            logging.warning('Internal Server Error during POST /bulk/ingest: %s', str(error.args))
+            exception = exceptions.InternalServerError('Could not load data. Error: {}'.format(str(error.args)))
+            exception.duration = timing.duration(start_time)
+            raise exception
+
+        seconds = max((perf_counter_ns() - start_time) / 1e9, 1e-6)
+        received += reader.bytes
+        response['count'] = rows
+        response['data'] = {
+            'rows': rows,
+            'bytes': received,
+            'rows_per_second': rows / seconds,
+            'bytes_per_second': received / seconds
+        }
+        response['duration'] = timing.duration(start_time)
+        return marshal(response, ingest_result_model)
+
+
+@bulk_api.route('/export')
+@bulk_api.response(exceptions.BadRequest.code, "BadRequest")
+@bulk_api.response(exceptions.InternalServerError.code, "InternalServerError")
+@bulk_api.response(exceptions.TooManyRequests.code, "TooManyRequests")
+@bulk_api.response(exceptions.Unauthorized.code, "Unauthorized")
+@bulk_api.response(exceptions.Forbidden.code, "Forbidden")
+@bulk_api.response(exceptions.MethodNotAllowed.code, "MethodNotAllowed")
+class ExportApi(Resource):
+    """
+    This is the resource that is responsible for exporting the rows of a table or view
+    """
+
+    @bulk_api.response(200, 'Success')
+    @bulk_api.expect(export_model)
+    def post(self):
+        """
+        This endpoint exports the rows of a table or view with COPY TO STDOUT as csv or in the binary format of
+        postgres. The data is sent while postgres produces it, so the memory usage does not depend on the size of the
+        relation. The rows can be filtered like with POST /query/select.
+        :return: The exported rows
+        """
+        start_time = perf_counter_ns()
+        args = request.json
+        if not args:
+            exception = exceptions.BadRequest('No arguments provided for exporting data')
+            exception.duration = timing.duration(start_time)
+            raise exception
+
+        slots = get_export_slots()
+        if not slots.acquire(blocking=False):
+            exception = exceptions.TooManyRequests('Too many exports are running, try again later')
+            exception.duration = timing.duration(start_time)
+            raise exception
+
+        try:
+            export_format = args.get('format') or 'csv'
+            if export_format not in EXPORT_MIMETYPES:
+                raise exceptions.BadRequest('Invalid format provided. Must be csv, binary, arrow or parquet.')
+            if export_format in COLUMNAR_FORMATS and arrow.pyarrow is None:
+                raise exceptions.BadRequest('The format {} is not available, pyarrow is not installed.'
+                                            .format(export_format))
+            args.setdefault('fields', ['*'])
+            args.setdefault('filter', '')
+            args.setdefault('order_fields', [])
+            args['order_type'] = args.get('order_type') or 'asc'
+            if args['order_type'].lower() not in ['asc', 'desc']:
+                raise exceptions.BadRequest('Invalid order_type provided. Must be asc or desc.')
+            limit = args.get('limit')
+            max_rows = current_app.config['P2REST_EXPORT_MAX_ROWS']
+            if max_rows and (limit is None or limit > max_rows):
+                limit = max_rows
+            validate_select(args)
+
+            if export_format in COLUMNAR_FORMATS:
+                # the record batches are built from the values of a server side cursor instead of the COPY output
+                batch_size = current_app.config['P2REST_STREAM_BATCH_SIZE']
+                columns, batches = Postgres.query_select_stream(pool=get_read_pool(),
+                                                                governor=get_governor(),
+                                                                schema=args['schema'],
+                                                                relation=args['relation'],
+                                                                fields=args['fields'],
+                                                                filter=args['filter'],
+                                                                order_fields=args['order_fields'],
+                                                                order_type=args['order_type'],
+                                                                limit=limit,
+                                                                batch_size=batch_size,
+                                                                raw=True)
+            else:
+                chunks = Postgres.copy_to(pool=get_read_pool(),
+                                          governor=get_governor(),
+                                          schema=args['schema'],
+                                          relation=args['relation'],
+                                          fields=args['fields'],
+                                          filter=args['filter'],
+                                          order_fields=args['order_fields'],
+                                          order_type=args['order_type'],
+                                          limit=limit,
+                                          format=export_format,
+                                          header=args.get('header', True),
+                                          chunk_size=current_app.config['P2REST_EXPORT_CHUNK_SIZE'])
+        except (exceptions.BadRequest, exceptions.ServiceUnavailable) as error:
+            slots.release()
+            logging.warning('Bad request for POST /bulk/export: %s', str(error.args))
+            error.duration = timing.duration(start_time)
+            raise error
+        except Exception as error:
+            slots.release()
+            logging.warning('Internal Server Error during POST /bulk/export: %s', str(error.args))
+            exception = exceptions.InternalServerError('Could not export data. Error: {}'.format(str(error.args)))
+            exception.duration = timing.duration(start_time)
+            raise exception
+
+        filename = '{}.{}'.format(normalize_identifier(args['relation']) or args['relation'],
+                                  EXPORT_EXTENSIONS[export_format])
+        headers = {'Content-Disposition': content_disposition(filename)}
+        if export_format in COLUMNAR_FORMATS:
+            chunks = arrow.write_batches(columns, batches, export_format,
+                                         current_app.config['P2REST_PARQUET_ROW_GROUP_SIZE'])
+            stream = Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[export_format], headers=headers)
+            stream.call_on_close(batches.close)
+            stream.call_on_close(slots.release)
+            return stream
+        chunks.on_close.append(slots.release)
+        stream = Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[export_format], headers=headers)
+        # stream_with_context only closes the chunks once they were iterated
+        stream.call_on_close(chunks.close)
+        return stream
@@ -1,7 +1,7 @@
-import datetime
-from flask import current_app
+from time import perf_counter_ns
 from flask_restplus import Namespace, Resource, fields
-from p2rest.src.database.helper import PostgresHelper
+from p2rest.src.database.probe import get_prober
+from p2rest.src import timing
 
 # Blueprint Configuration
 health_api = Namespace(name='health',
@@ -29,7 +29,7 @@ class HealthApi(Resource):
     @health_api.doc('Shows the basic service status')
     @health_api.marshal_with(health_result_model)
     def get(self):
-        starttime = datetime.datetime.now()
+        starttime = perf_counter_ns()
         response = {
             'status_code': 200,
             'message': 'Service api',
@@ -41,22 +41,78 @@ class HealthApi(Resource):
         }
 
         try:
-            db_connection = PostgresHelper.CheckConnection(
-                host=current_app.config['P2REST_DB_HOST'],
-                port=current_app.config['P2REST_DB_PORT'],
-                dbname=current_app.config['P2REST_DB_NAME'],
-                user=current_app.config['P2REST_DB_USER'],
-                password=current_app.config['P2REST_DB_PASSWORD']
-            )
+            # the outcome of the last probe, so health checks do not query the database themselves
+            db_connection = get_prober().status()['ok']
         except Exception as error:
             response['status_code'] = 500
             response['message'] = 'Status error'
             response['description'] = 'We could not evaluate the service status. Error: {}'.format(str(error.args))
             response['data']['status'] = 'Error'
             response['data']['db_connection'] = 'NOK'
-            response['duration'] = str(datetime.datetime.now() - starttime)
+            response['duration'] = timing.duration(starttime)
             return response, response['status_code']
 
-        response['data']['db_status'] = 'OK' if db_connection else 'NOK'
-        response['duration'] = str(datetime.datetime.now() - starttime)
+        response['data']['db_connection'] = 'Ok' if db_connection else 'NOK'
+        response['duration'] = timing.duration(starttime)
         return response
+
+
+probe_result_model = health_api.model('probe_result', {
+    'status_code': fields.Integer(),
+    'message': fields.String(),
+    'description': fields.String(),
+    'duration': fields.String(),
+    'data': fields.Raw(),
+})
+
+
+@health_api.route('/live')
+class LivenessApi(Resource):
+    """
+    This is the resource that is responsible for the liveness probe. It does not depend on the database, so a
+    database outage does not restart the service
+    """
+
+    @health_api.doc('Shows that the service process is running')
+    @health_api.marshal_with(probe_result_model)
+    def get(self):
+        starttime = perf_counter_ns()
+        response = {
+            'status_code': 200,
+            'message': 'Live',
+            'description': 'The service is running',
+            'data': {'status': 'Up'}
+        }
+        response['duration'] = timing.duration(starttime)
+        return response
+
+
+@health_api.route('/ready')
+@health_api.response(503, 'The database is not available.')
+class ReadinessApi(Resource):
+    """
+    This is the resource that is responsible for the readiness probe. It reports the cached outcome of the last
+    database probe, the usage of the connection pool and, if enabled, the replication lag
+    """
+
+    @health_api.doc('Shows if the service can handle requests')
+    @health_api.marshal_with(probe_result_model)
+    def get(self):
+        starttime = perf_counter_ns()
+        status = get_prober().status()
+        response = {
+            'status_code': 200 if status['ok'] else 503,
+            'message': 'Ready' if status['ok'] else 'Not ready',
+            'description': 'Outcome of the last database probe of this worker process',
+            'data': {
+                'status': 'Up' if status['ok'] else 'Error',
+                'db_connection': 'Ok' if status['ok'] else 'NOK',
+                'error': status['error'],
+                'latency': status['latency'],
+                'age': status['age'],
+                'replication_lag': status['replication_lag'],
+                'pool': status['pool']
+            }
+        }
+        response['duration'] = timing.duration(starttime)
+        return response, response['status_code']
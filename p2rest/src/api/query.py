@@ -1,11 +1,24 @@
-import datetime
 import logging
+from time import perf_counter_ns
 
-from flask import request, current_app
+from flask import request, current_app, Response, stream_with_context
 from flask_restplus import Namespace, Resource, fields
 from werkzeug import exceptions
 
-from p2rest.src.database.postgres import Postgres
+from p2rest.src.database.helper import PostgresHelper, AGGREGATE_FUNCTIONS
+from p2rest.src.database.postgres import Postgres, COUNT_STRATEGIES
+from p2rest.src.database.replicas import get_read_pool, requires_primary
+from p2rest.src.database.governor import get_governor
+from p2rest.src.database.analytics import get_analytics
+from p2rest.src.database.catalog import get_catalog, CatalogCache, normalize_identifier
+from p2rest.src.database.results import get_result_cache
+from p2rest.src.database.converters import RenderedRows, CountedRows
+from p2rest.src.database import arrow
+from p2rest.src import timing, encoders
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Streamed formats that are written by pyarrow
+COLUMNAR_FORMATS = {'arrow': arrow.ARROW_MIMETYPE, 'parquet': arrow.PARQUET_MIMETYPE}
 
 # Blueprint Configuration
 query_api = Namespace(name='query',
@@ -25,7 +38,13 @@ schema_result_model = query_api.model('schema_result', {
     'duration': fields.String(title='duration',
                               description='The time it took the server to process the request'),
     'data': fields.Raw(title='data',
-                       description='This array contains data if any is returned from the database. ')
+                       description='This array contains data if any is returned from the database. '),
+    'continuation': fields.String(title='continuation',
+                                  description='For keyset pagination: token that has to be sent with the next request '
+                                              'to get the following page. Empty if there are no more rows'),
+    'total': fields.Integer(title='total',
+                            description='If requested: the amount of all rows matching the filter, regardless of '
+                                        'limit and offset')
 })
 
 
@@ -77,21 +96,488 @@ def create_schema_select_model():
                                              'pagination',
                                  required=False,
                                  example=0,
-                                 default=0)
+                                 default=0),
+        'stream': fields.Boolean(title='Stream',
+                                 description='If true the rows are read with a server side cursor and streamed to '
+                                             'the client while they are fetched. The response has the same format. '
+                                             'Send the header "Accept: application/x-ndjson" to get one JSON '
+                                             'document per row instead',
+                                 required=False,
+                                 example=False,
+                                 default=False),
+        'compact': fields.Boolean(title='Compact',
+                                  description='If true data contains the column names ("columns") and the rows as '
+                                              'arrays of values in the order of the columns ("rows") instead of one '
+                                              'object per row',
+                                  required=False,
+                                  example=False,
+                                  default=False),
+        'engine': fields.String(title='Rendering engine',
+                                description='"python" converts the rows in the service. "database" lets postgres '
+                                            'render the rows as json, which is passed to the client without decoding '
+                                            'it. The database engine supports neither the compact form nor keyset '
+                                            'pagination. The default is set by the server configuration',
+                                required=False,
+                                enum=['python', 'database'],
+                                example='python'),
+        'keyset': fields.Boolean(title='Keyset pagination',
+                                 description='If true the result is paginated with a continuation token instead of '
+                                             'an offset. This requires order fields that identify a row uniquely '
+                                             '(e.g. the primary key). The response contains a token that has to be '
+                                             'sent as "continuation" to get the next page',
+                                 required=False,
+                                 example=False,
+                                 default=False),
+        'continuation': fields.String(title='Continuation token',
+                                      description='Token returned with the previous page when using keyset '
+                                                  'pagination. The offset is ignored if it is provided',
+                                      required=False),
+        'total': fields.String(title='Total',
+                               description='Returns the amount of all rows matching the filter in "total". "exact" '
+                                           'counts them, "estimate" uses the statistics of the table or the '
+                                           'estimate of the planner, "inline" counts them with the page in the '
+                                           'same query. Not supported for streamed responses',
+                               required=False,
+                               enum=list(COUNT_STRATEGIES))
     }
     schema_select_model = query_api.model('schema_select', model)
     return schema_select_model
 
 
+def create_batch_select_model():
+    model = {
+        'queries': fields.List(fields.Nested(create_schema_select_model()),
+                               title='Selects',
+                               description='List of selects with the same fields as POST /query/select. Streaming '
+                                           'is not supported',
+                               required=True),
+        'snapshot': fields.Boolean(title='Snapshot',
+                                   description='If true all selects read the same snapshot of the database in a read '
+                                               'only transaction. The result cache is not used in this case',
+                                   required=False,
+                                   example=False,
+                                   default=False),
+        'concurrency': fields.Integer(title='Concurrency',
+                                      description='Maximum amount of database connections used for the selects. It '
+                                                  'is limited by the server configuration',
+                                      required=False,
+                                      example=1,
+                                      default=1)
+    }
+    return query_api.model('batch_select', model)
+
+
+def create_count_model():
+    model = {
+        'schema': fields.String(title='Postgres Schema',
+                                description='Specifies the schema where the relation can be found',
+                                required=True,
+                                example='postgres'),
+        'relation': fields.String(title='Table or View',
+                                  description='This is the relation (table or view) whose rows are counted',
+                                  required=True,
+                                  example='table_name'),
+        'filter': fields.Nested(create_filter_model(),
+                                title='Filter query',
+                                description='Only rows matching this filter are counted, like for POST /query/select',
+                                required=False),
+        'strategy': fields.String(title='Strategy',
+                                  description='"exact" counts the rows, "estimate" uses the statistics of the table '
+                                              'or the row estimate of the planner',
+                                  required=False,
+                                  enum=['exact', 'estimate'],
+                                  default='exact')
+    }
+    return query_api.model('count', model)
+
+
+def create_aggregate_model():
+    function_model = query_api.model('aggregate_function', {
+        'function': fields.String(title='Function',
+                                  description='The aggregate function',
+                                  required=True,
+                                  enum=sorted(AGGREGATE_FUNCTIONS),
+                                  example='count'),
+        'column': fields.String(title='Column',
+                                description='The column the function is applied to. "*" is only allowed for count',
+                                required=False,
+                                example='*',
+                                default='*'),
+        'alias': fields.String(title='Alias',
+                               description='Name of the result column. The default is function_column (or the '
+                                           'function for count(*))',
+                               required=False)
+    })
+    model = {
+        'schema': fields.String(title='Postgres Schema',
+                                description='Specifies the schema where the relation can be found',
+                                required=True,
+                                example='postgres'),
+        'relation': fields.String(title='Table or View',
+                                  description='This is the relation (table or view) that is aggregated',
+                                  required=True,
+                                  example='table_name'),
+        'group_by': fields.List(fields.String,
+                                title='Group by columns',
+                                description='Columns the rows are grouped by. Without them all rows form one group',
+                                required=False,
+                                example=['field1'],
+                                default=[]),
+        'aggregates': fields.List(fields.Nested(function_model),
+                                  title='Aggregates',
+                                  description='Aggregate functions computed per group',
+                                  required=False,
+                                  default=[]),
+        'filter': fields.Nested(create_filter_model(),
+                                title='Filter query',
+                                description='Filter on the rows before they are grouped, like for POST /query/select',
+                                required=False),
+        'having': fields.Nested(create_filter_model(),
+                                title='Having',
+                                description='Filter on the groups. The columns are group by columns or aliases of '
+                                            'the aggregates',
+                                required=False),
+        'order_fields': fields.List(fields.String,
+                                    title='Fields to order result',
+                                    description='Group by columns or aliases the groups are ordered by',
+                                    required=False,
+                                    example=['field1'],
+                                    default=[]),
+        'order_type': fields.String(title='Order type',
+                                    description='Either "asc" or "desc"',
+                                    required=False,
+                                    example='asc',
+                                    default='asc'),
+        'limit': fields.Integer(title='Limit',
+                                description='The maximum amount of groups. It is capped by the server settings',
+                                required=False,
+                                example=1000),
+        'offset': fields.Integer(title='Offset',
+                                 description='The offset from where groups shall be returned',
+                                 required=False,
+                                 example=0,
+                                 default=0)
+    }
+    return query_api.model('aggregate', model)
+
+
+# the nested filter models by depth, they are built once and shared by all request models
+_filter_models = {}
+
+
 def create_filter_model(iteration=5):
-    data_model = {
-        'column': fields.String(),
-        'value': fields.String(),
-        'operator': fields.String()
+    if iteration not in _filter_models:
+        data_model = {
+            'column': fields.String(),
+            'value': fields.Raw(description='The value of the comparison, a list for "in" and "not in" and a list of '
+                                            'the lower and upper bound for "between". Not needed for "is null" and '
+                                            '"is not null"'),
+            'operator': fields.String(description='"and", "or" or "not" for logical nodes, for comparisons one of =, <, '
+                                                  '>, <=, >=, !=, <>, like, ilike, in, not in, between, is null and '
+                                                  'is not null')
+        }
+        if iteration > 0:
+            data_model['childs'] = fields.List(fields.Nested(create_filter_model(iteration-1)))
+        _filter_models[iteration] = query_api.model('Data' + str(iteration), data_model)
+    return _filter_models[iteration]
+
+
+schema_select_model = create_schema_select_model()
+batch_select_model = create_batch_select_model()
+aggregate_model = create_aggregate_model()
+count_model = create_count_model()
+
+
+def validate_select(args):
+    """
+    Checks the relation and all columns used by a select against the catalog, so requests with typos are rejected
+    before the database is queried. The fields may be expressions, the filter columns and order fields have to be
+    column names
+    :param args: The request arguments
+    """
+    if not args.get('schema') or not args.get('relation'):
+        raise exceptions.BadRequest('No schema or relation provided')
+    names = list(args['order_fields']) + PostgresHelper.get_filter_columns(args['filter'])
+    expressions = [str(name) for name in names if normalize_identifier(name) is None]
+    if expressions:
+        raise exceptions.BadRequest('Filter columns and order fields have to be column names: {}'.format(
+            ', '.join(expressions)))
+    if not current_app.config['P2REST_CATALOG_VALIDATE']:
+        return
+    columns = [field for field in args['fields'] if field != '*'] + names
+    relation = get_catalog().get_relation(args['schema'], args['relation'], columns)
+    if relation is None:
+        raise exceptions.BadRequest('Relation {}.{} does not exist'.format(args['schema'], args['relation']))
+    unknown = CatalogCache.find_unknown_columns(relation, columns)
+    if unknown:
+        raise exceptions.BadRequest('Unknown columns for relation {}.{}: {}'.format(args['schema'], args['relation'],
+                                                                                  ', '.join(unknown)))
+
+
+def validate_keyset(args):
+    """
+    Checks that the order fields of a keyset paginated select are selected columns that can not be NULL. The
+    continuation token is read from the selected columns and the seek predicate never matches NULL values
+    :param args: The request arguments
+    """
+    if not args['order_fields']:
+        raise exceptions.BadRequest('Keyset pagination requires order fields')
+    order = [normalize_identifier(field) for field in args['order_fields']]
+    if None in order:
+        raise exceptions.BadRequest('Keyset pagination requires the order fields to be columns')
+    if '*' not in args['fields'] and \
+            any(name not in [normalize_identifier(field) for field in args['fields']] for name in order):
+        raise exceptions.BadRequest('Keyset pagination requires the order fields to be selected')
+    relation = get_catalog().get_relation(args['schema'], args['relation'])
+    if relation is None:
+        return
+    nullable = [field for field, name in zip(args['order_fields'], order)
+                if name in relation['columns'] and relation['columns'][name]['nullable']]
+    if nullable:
+        raise exceptions.BadRequest('Keyset pagination requires order fields that can not be NULL: {}'.format(
+            ', '.join(nullable)))
+
+
+def prepare_aggregate(args):
+    """
+    Adds the default values to the arguments of an aggregation request, validates the columns against the catalog
+    and builds the arguments of Postgres.query_aggregate
+    :param args: The request arguments
+    :return: The arguments for Postgres.query_aggregate
+    """
+    aggregate_args = {
+        'pool': get_read_pool(),
+        'governor': get_governor(),
+        'schema': args.get('schema'),
+        'relation': args.get('relation'),
+        'group_by': list(args.get('group_by') or []),
+        'aggregates': list(args.get('aggregates') or []),
+        'filter': args.get('filter') or '',
+        'having': args.get('having') or '',
+        'order_fields': list(args.get('order_fields') or []),
+        'order_type': args.get('order_type') or 'asc',
+        'limit': min(args.get('limit') or 100, current_app.config['P2REST_MAX_RESULTS']),
+        'offset': args.get('offset') or 0
+    }
+    if not aggregate_args['group_by'] and not aggregate_args['aggregates']:
+        raise exceptions.BadRequest('At least one group by column or aggregate has to be provided')
+    if any(not isinstance(aggregate, dict) for aggregate in aggregate_args['aggregates']):
+        raise exceptions.BadRequest('Every aggregate has to be an object with function and column')
+    validate_select({
+        'schema': aggregate_args['schema'],
+        'relation': aggregate_args['relation'],
+        'fields': aggregate_args['group_by'] + [aggregate.get('column') or '*'
+                                                for aggregate in aggregate_args['aggregates']],
+        'order_fields': [],
+        'filter': aggregate_args['filter']
+    })
+    return aggregate_args
+
+
+def get_stream_format(args):
+    """
+    Evaluates if the client requested a streamed response
+    :param args: The request arguments
+    :return: 'ndjson', 'arrow', 'parquet' or 'json' for a streamed response, None otherwise
+    """
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE, arrow.ARROW_MIMETYPE,
+                                                arrow.PARQUET_MIMETYPE])
+    if best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    if best in (arrow.ARROW_MIMETYPE, arrow.PARQUET_MIMETYPE):
+        if arrow.pyarrow is None:
+            raise exceptions.NotAcceptable('The columnar formats are not available, pyarrow is not installed.')
+        return 'arrow' if best == arrow.ARROW_MIMETYPE else 'parquet'
+    if args.get('stream'):
+        return 'json'
+    return None
+
+
+def stream_ndjson(columns, batches, args):
+    """
+    Renders the row batches as newline delimited json, one row per line. In compact form the first line contains
+    the column names
+    :param columns: The column names of the result
+    :param batches: Generator yielding lists of rows
+    :param args: The request arguments
+    :return: Generator yielding the response body
+    """
+    encode = encoders.get_encoder()
+    if args.get('compact'):
+        yield encode(columns) + b'\n'
+    for batch in batches:
+        if args['engine'] == 'database':
+            yield b'\n'.join(batch) + b'\n'
+        else:
+            with timing.span('serialize'):
+                lines = b'\n'.join(map(encode, batch)) + b'\n'
+            yield lines
+
+
+def render_envelope(response, data):
+    """
+    Writes the response envelope around rows that were already rendered as json by the database
+    :param response: The response envelope without data
+    :param data: The json array of the rows as bytes
+    :return: The response body as bytes
+    """
+    with timing.span('serialize'):
+        header = encoders.dumps({k: v for k, v in response.items() if k != 'data'})
+        return header[:-1] + b', "data": ' + data + b'}'
+
+
+def get_continuation(args, count, last_row, columns):
+    """
+    Creates the continuation token for keyset pagination
+    :param args: The request arguments
+    :param count: Amount of rows of the current page
+    :param last_row: The last row of the current page
+    :param columns: The column names of the result, used for rows in compact form
+    :return: The token for the next page or None if there are no more rows or keyset pagination is not used
+    """
+    if not args.get('keyset') or count == 0 or count < args['limit']:
+        return None
+    if isinstance(last_row, list):
+        last_row = dict(zip(columns, last_row))
+    return PostgresHelper.encode_continuation(args['order_fields'], args['order_type'], last_row)
+
+
+def stream_json(columns, batches, response, start_time, args):
+    """
+    Renders the row batches into the usual response envelope. The data array is written first, so count, duration
+    and the continuation token can be appended once all rows are sent
+    :param columns: The column names of the result
+    :param batches: Generator yielding lists of rows
+    :param response: The response envelope without data, count and duration
+    :param start_time: Start of the request for calculating the duration
+    :param args: The request arguments
+    :return: Generator yielding the response body
+    """
+    encode = encoders.get_encoder()
+    header = encode({k: v for k, v in response.items() if k not in ('data', 'count', 'duration')})
+    if args.get('compact'):
+        yield header[:-1] + b', "data": {"columns": ' + encode(columns) + b', "rows": ['
+    else:
+        yield header[:-1] + b', "data": ['
+    count = 0
+    last_row = None
+    for batch in batches:
+        if batch:
+            if args['engine'] == 'database':
+                yield (b',' if count else b'') + b','.join(batch)
+            else:
+                with timing.span('serialize'):
+                    # the batch is encoded as one array, its brackets are cut off
+                    rows = encode(batch)[1:-1]
+                yield (b',' if count else b'') + rows
+            count += len(batch)
+            last_row = batch[-1]
+    continuation = get_continuation(args, count, last_row, columns)
+    timings = ''
+    if current_app.config['P2REST_TIMING_ENVELOPE']:
+        timings = ', "timings": ' + encode(timing.get_timings()).decode()
+    yield '{end}, "count": {count}, "duration": {duration}, "continuation": {continuation}{timings}}}'.format(
+        end=']}' if args.get('compact') else ']', count=count,
+        duration=encode(timing.duration(start_time)).decode(),
+        continuation=encode(continuation).decode(), timings=timings)
+
+
+def prepare_select(args):
+    """
+    Adds the default values to the arguments of a select request, validates them and builds the arguments of
+    Postgres.query_select
+    :param args: The request arguments, the default values are added to them
+    :return: The arguments for Postgres.query_select
+    """
+    if 'fields' not in args.keys():
+        args['fields'] = '*'
+    if 'filter' not in args.keys():
+        args['filter'] = ''
+    if 'limit' not in args.keys():
+        args['limit'] = 100
+    if 'offset' not in args.keys():
+        args['offset'] = 0
+    if args['limit'] > current_app.config['P2REST_MAX_RESULTS']:
+        args['limit'] = current_app.config['P2REST_MAX_RESULTS']
+    if 'order_type' in args.keys():
+        if args['order_type'].lower() not in ['asc', 'desc']:
+            raise exceptions.BadRequest('Invalid order_type provided. Must be asc or desc.')
+    else:
+        args['order_type'] = 'asc'
+    if 'order_fields' not in args.keys():
+        args['order_fields'] = ''
+    if not args.get('engine'):
+        args['engine'] = current_app.config['P2REST_RENDER_ENGINE']
+    if args['engine'] not in ('python', 'database'):
+        raise exceptions.BadRequest('Invalid engine provided. Must be python or database.')
+    if args['engine'] == 'database' and (args.get('compact') or args.get('keyset')):
+        raise exceptions.BadRequest('The database engine supports neither compact nor keyset.')
+    if args.get('total') and args['total'] not in COUNT_STRATEGIES:
+        raise exceptions.BadRequest('Invalid total provided. Must be exact, estimate or inline.')
+    if args['engine'] == 'database' and args.get('total') == 'inline':
+        raise exceptions.BadRequest('The database engine does not support the inline total.')
+
+    validate_select(args)
+    select_args = {
+        'pool': get_read_pool(),
+        'governor': get_governor(),
+        'analytics': get_analytics(),
+        'schema': args['schema'],
+        'relation': args['relation'],
+        'filter': args['filter'],
+        'fields': args['fields'],
+        'order_fields': args['order_fields'],
+        'order_type': args['order_type'],
+        'limit': args['limit'],
+        'offset': args['offset'],
+        'compact': bool(args.get('compact')),
+        'engine': args['engine']
     }
-    if iteration > 0:
-        data_model['childs'] = fields.List(fields.Nested(create_filter_model(iteration-1)))
-    return query_api.model('Data' + str(iteration), data_model)
+    if args.get('total'):
+        select_args['total'] = args['total']
+    if args.get('keyset'):
+        validate_keyset(args)
+        if args.get('continuation'):
+            select_args['keyset'] = PostgresHelper.decode_continuation(args['continuation'],
+                                                                       args['order_fields'],
+                                                                       args['order_type'])
+    return select_args
+
+
+def complete_select_response(response, args, data):
+    """
+    Adds the data, count and continuation token of a select to its response envelope
+    :param response: The response envelope
+    :param args: The request arguments
+    :param data: The result of Postgres.query_select
+    :return: The response envelope
+    """
+    response['total'] = None
+    if isinstance(data, CountedRows):
+        response['total'] = data.total
+        data = data.data
+    response['data'] = data
+    if args['engine'] == 'database':
+        response['count'] = data.count
+        response['continuation'] = None
+        return response
+    rows = data['rows'] if args.get('compact') else data
+    response['count'] = len(rows)
+    response['continuation'] = get_continuation(args, response['count'], rows[-1] if rows else None,
+                                                data['columns'] if args.get('compact') else None)
+    return response
+
+
+def render_select_response(response):
+    """
+    Renders a completed response envelope of a select as json
+    :param response: The response envelope as returned by complete_select_response
+    :return: The json document as bytes
+    """
+    if isinstance(response['data'], RenderedRows):
+        return render_envelope(response, response['data'].data)
+    with timing.span('serialize'):
+        return encoders.dumps(encoders.envelope(response, schema_result_model))
 
 
 @query_api.route('/select')
@@ -100,20 +586,21 @@ def create_filter_model(iteration=5):
 @query_api.response(exceptions.Unauthorized.code, "Unauthorized")
 @query_api.response(exceptions.Forbidden.code, "Forbidden")
 @query_api.response(exceptions.MethodNotAllowed.code, "MethodNotAllowed")
+@query_api.response(exceptions.NotAcceptable.code, "NotAcceptable")
 class SelectListApi(Resource):
     """
     This is the resource that is responsible for returning information about schemata within the database
     """
 
-    @query_api.marshal_with(schema_result_model)
-    @query_api.expect(create_schema_select_model())
+    @query_api.response(200, 'Success', schema_result_model)
+    @query_api.expect(schema_select_model)
     def post(self):
         """
         This endpoint returns data from a table of view. You can specify a filter expression, the columns that shall
         be returned and the sorting information for this request.
         :return: Row data for the given request
         """
-        start_time = datetime.datetime.now()
+        start_time = perf_counter_ns()
         args = request.json
         response = {
             'status_code': 200,
@@ -125,51 +612,291 @@ class SelectListApi(Resource):
 
         if not args:
             exception = exceptions.BadRequest('No arguments provided for querying the database')
-            exception.duration = str(datetime.datetime.now() - start_time)
+            exception.duration = timing.duration(start_time)
             raise exception
-        if 'fields' not in args.keys():
-            args['fields'] = '*'
-        if 'filter' not in args.keys():
-            args['filter'] = ''
-        if 'limit' not in args.keys():
-            args['limit'] = 100
-        if 'offset' not in args.keys():
-            args['offset'] = 0
-        if args['limit'] > current_app.config['P2REST_MAX_RESULTS']:
-            args['limit'] = current_app.config['P2REST_MAX_RESULTS']
-        if 'order_type' in args.keys():
-            if args['order_type'].lower() not in ['asc', 'desc']:
-                exception = exceptions.BadRequest('Invalid order_type provided. Must be asc or desc.')
-                exception.duration = str(datetime.datetime.now() - start_time)
-                raise exception
-        else:
-            args['order_type'] = 'asc'
-        if 'order_fields' not in args.keys():
-            args['order_fields'] = ''
 
         try:
-            response['data'] = Postgres\
-                .query_select(host=current_app.config['P2REST_DB_HOST'],
-                              port=current_app.config['P2REST_DB_PORT'],
-                              dbname=current_app.config['P2REST_DB_NAME'],
-                              user=current_app.config['P2REST_DB_USER'],
-                              password=current_app.config['P2REST_DB_PASSWORD'],
-                              schema=args['schema'],
-                              relation=args['relation'],
-                              filter=args['filter'],
-                              fields=args['fields'],
-                              order_fields=args['order_fields'],
-                              order_type=args['order_type'],
-                              limit=args['limit'],
-                              offset=args['offset'])
-        except exceptions.BadRequest as error:
+            stream_format = get_stream_format(args)
+            if stream_format and args.get('total'):
+                raise exceptions.BadRequest('The total is not supported for streamed responses.')
+            if stream_format in COLUMNAR_FORMATS:
+                if args.get('keyset'):
+                    raise exceptions.BadRequest('Keyset pagination is not supported for {}.'.format(stream_format))
+                # the record batches are built from the values of the cursor
+                args['engine'] = 'python'
+            select_args = prepare_select(args)
+            if stream_format:
+                batch_size = current_app.config['P2REST_STREAM_BATCH_SIZE']
+                columns, batches = Postgres.query_select_stream(batch_size=batch_size,
+                                                                raw=stream_format in COLUMNAR_FORMATS,
+                                                                **select_args)
+            else:
+                results = get_result_cache()
+                response['data'], token = results.get(select_args, primary=requires_primary())
+                if response['data'] is None:
+                    response['data'] = Postgres.query_select(**select_args)
+                    results.put(token, response['data'])
+        except (exceptions.BadRequest, exceptions.NotAcceptable, exceptions.ServiceUnavailable) as error:
             logging.warning('Bad request for POST /query/select: %s', str(error.args))
+            error.duration = timing.duration(start_time)
+            raise error
         except Exception as error:
             logging.warning('Internal Server Error during POST /query/select: %s', str(error.args))
             exception = exceptions.InternalServerError('Could not query data. Error: {}'.format(str(error.args)))
-            exception.duration = str(datetime.datetime.now() - start_time)
+            exception.duration = timing.duration(start_time)
+            raise exception
+
+        if stream_format:
+            if stream_format == 'ndjson':
+                stream = Response(stream_with_context(stream_ndjson(columns, batches, args)), mimetype=NDJSON_MIMETYPE)
+            elif stream_format == 'json':
+                stream = Response(stream_with_context(stream_json(columns, batches, response, start_time, args)),
+                                  mimetype='application/json')
+            else:
+                chunks = arrow.write_batches(columns, batches, stream_format,
+                                             current_app.config['P2REST_PARQUET_ROW_GROUP_SIZE'])
+                stream = Response(stream_with_context(chunks), mimetype=COLUMNAR_FORMATS[stream_format])
+            # the generators do not run if the client disconnects before the first chunk, the batches are closed here
+            stream.call_on_close(batches.close)
+            return stream
+
+        complete_select_response(response, args, response['data'])
+        response['duration'] = timing.duration(start_time)
+        if args['engine'] == 'database':
+            return Response(render_select_response(response), mimetype='application/json')
+        return encoders.render(response, schema_result_model)
+
+
+@query_api.route('/batch')
+@query_api.response(exceptions.BadRequest.code, "BadRequest")
+@query_api.response(exceptions.InternalServerError.code, "InternalServerError")
+@query_api.response(exceptions.Unauthorized.code, "Unauthorized")
+@query_api.response(exceptions.Forbidden.code, "Forbidden")
+@query_api.response(exceptions.MethodNotAllowed.code, "MethodNotAllowed")
+class BatchApi(Resource):
+    """
+    This is the resource that is responsible for executing several selects with one request
+    """
+
+    @query_api.response(200, 'Success', schema_result_model)
+    @query_api.expect(batch_select_model)
+    def post(self):
+        """
+        This endpoint executes several selects on as few database connections as possible. All selects are validated
+        before the first one is executed. The data contains one response per select in the order of the request,
+        failed selects have their own status code and do not affect the other ones.
+        :return: The responses of all selects
+        """
+        start_time = perf_counter_ns()
+        args = request.json
+        response = {
+            'status_code': 200,
+            'message': 'Get data',
+            'description': 'Get data of several selects',
+            'count': 0
+        }
+
+        try:
+            if not args or not args.get('queries'):
+                raise exceptions.BadRequest('No selects provided for querying the database')
+            queries = args['queries']
+            if len(queries) > current_app.config['P2REST_BATCH_MAX_QUERIES']:
+                raise exceptions.BadRequest('Too many selects, the maximum is {}'
+                                            .format(current_app.config['P2REST_BATCH_MAX_QUERIES']))
+            concurrency = max(1, min(args.get('concurrency') or 1, current_app.config['P2REST_BATCH_CONCURRENCY']))
+            snapshot = bool(args.get('snapshot'))
+
+            selects = []
+            for index, query in enumerate(queries):
+                if not isinstance(query, dict) or not query:
+                    raise exceptions.BadRequest('Select {}: No arguments provided'.format(index))
+                if query.get('stream'):
+                    raise exceptions.BadRequest('Select {}: Streaming is not supported for batches'.format(index))
+                try:
+                    selects.append(prepare_select(query))
+                except exceptions.BadRequest as error:
+                    raise exceptions.BadRequest('Select {}: {}'.format(index, error.description))
+
+            # results of the selects as tuples of data and error, cached results are not queried again
+            results = get_result_cache()
+            items = [None] * len(selects)
+            tokens = [None] * len(selects)
+            # all selects are read from the same pool
+            pool = get_read_pool()
+            for select_args in selects:
+                select_args['pool'] = pool
+            if not snapshot:
+                for index, select_args in enumerate(selects):
+                    cached, tokens[index] = results.get(select_args, primary=requires_primary())
+                    if cached is not None:
+                        items[index] = (cached, None)
+            missing = [index for index, item in enumerate(items) if item is None]
+            # misses of cached relations are read from the primary, so their results can be stored
+            if any(tokens[index] is not None for index in missing):
+                pool = results.pool
+            if missing:
+                queried = Postgres.query_batch(pool,
+                                               [{k: v for k, v in selects[index].items() if k != 'pool'}
+                                                for index in missing],
+                                               snapshot=snapshot, concurrency=concurrency)
+                for index, item in zip(missing, queried):
+                    items[index] = item
+                    if item[1] is None:
+                        results.put(tokens[index], item[0])
+        except (exceptions.BadRequest, exceptions.ServiceUnavailable) as error:
+            logging.warning('Bad request for POST /query/batch: %s', str(error.args))
+            error.duration = timing.duration(start_time)
+            raise error
+        except Exception as error:
+            logging.warning('Internal Server Error during POST /query/batch: %s', str(error.args))
+            exception = exceptions.InternalServerError('Could not query data. Error: {}'.format(str(error.args)))
+            exception.duration = timing.duration(start_time)
+            raise exception
+
+        rendered = []
+        for query, (result, error) in zip(queries, items):
+            if isinstance(error, exceptions.HTTPException):
+                # rejected by the query governor or cancelled by its timeouts
+                rendered.append(encoders.dumps(encoders.envelope({
+                    'status_code': error.code,
+                    'message': error.name,
+                    'description': error.description,
+                    'count': 0,
+                    'data': []
+                }, schema_result_model)))
+                continue
+            if error is not None:
+                rendered.append(encoders.dumps(encoders.envelope({
+                    'status_code': 500,
+                    'message': 'Error',
+                    'description': 'Could not query data. Error: {}'.format(str(error.args)),
+                    'count': 0,
+                    'data': []
+                }, schema_result_model)))
+                continue
+            item_response = complete_select_response({
+                'status_code': 200,
+                'message': 'Get data',
+                'description': 'Get data from from table or view',
+            }, query, result)
+            rendered.append(render_select_response(item_response))
+
+        response['count'] = len(rendered)
+        response['duration'] = timing.duration(start_time)
+        return Response(render_envelope(response, b'[' + b','.join(rendered) + b']'), mimetype='application/json')
+
+
+@query_api.route('/count')
+@query_api.response(exceptions.BadRequest.code, "BadRequest")
+@query_api.response(exceptions.InternalServerError.code, "InternalServerError")
+@query_api.response(exceptions.Unauthorized.code, "Unauthorized")
+@query_api.response(exceptions.Forbidden.code, "Forbidden")
+@query_api.response(exceptions.MethodNotAllowed.code, "MethodNotAllowed")
+class CountApi(Resource):
+    """
+    This is the resource that is responsible for counting the rows of a table or view
+    """
+
+    @query_api.response(200, 'Success', schema_result_model)
+    @query_api.expect(count_model)
+    def post(self):
+        """
+        This endpoint returns the amount of rows of a table or view that match a filter. "exact" counts them,
+        "estimate" reads the statistics of the table (without filter) or the row estimate of the planner, so no rows
+        are read.
+        :return: The amount of rows in count and data
+        """
+        start_time = perf_counter_ns()
+        args = request.json
+        response = {
+            'status_code': 200,
+            'message': 'Count rows',
+            'description': 'Count the rows of a table or view',
+            'count': 0,
+            'data': {}
+        }
+
+        try:
+            if not args:
+                raise exceptions.BadRequest('No arguments provided for counting rows')
+            strategy = args.get('strategy') or 'exact'
+            if strategy not in ('exact', 'estimate'):
+                raise exceptions.BadRequest('Invalid strategy provided. Must be exact or estimate.')
+            args['filter'] = args.get('filter') or ''
+            validate_select({'schema': args.get('schema'), 'relation': args.get('relation'), 'fields': [],
+                             'order_fields': [], 'filter': args['filter']})
+            total = Postgres.query_count(pool=get_read_pool(),
+                                         governor=get_governor(),
+                                         schema=args['schema'],
+                                         relation=args['relation'],
+                                         filter=args['filter'],
+                                         strategy=strategy)
+        except (exceptions.BadRequest, exceptions.ServiceUnavailable) as error:
+            logging.warning('Bad request for POST /query/count: %s', str(error.args))
+            error.duration = timing.duration(start_time)
+            raise error
+        except Exception as error:
+            logging.warning('Internal Server Error during POST /query/count: %s', str(error.args))
+            exception = exceptions.InternalServerError('Could not count rows. Error: {}'.format(str(error.args)))
+            exception.duration = timing.duration(start_time)
+            raise exception
+
+        response['count'] = total
+        response['total'] = total
+        response['data'] = {'total': total, 'strategy': strategy}
+        response['duration'] = timing.duration(start_time)
+        return encoders.render(response, schema_result_model)
+
+
+@query_api.route('/aggregate')
+@query_api.response(exceptions.BadRequest.code, "BadRequest")
+@query_api.response(exceptions.InternalServerError.code, "InternalServerError")
+@query_api.response(exceptions.Unauthorized.code, "Unauthorized")
+@query_api.response(exceptions.Forbidden.code, "Forbidden")
+@query_api.response(exceptions.MethodNotAllowed.code, "MethodNotAllowed")
+class AggregateApi(Resource):
+    """
+    This is the resource that is responsible for aggregating data in the database
+    """
+
+    @query_api.response(200, 'Success', schema_result_model)
+    @query_api.expect(aggregate_model)
+    def post(self):
+        """
+        This endpoint groups the rows of a table or view and computes count, sum, min, max or avg per group in the
+        database, so only the groups are transferred. Column and function names are validated and quoted, the
+        values of filter and having are sent as query parameters.
+        :return: One row per group
+        """
+        start_time = perf_counter_ns()
+        args = request.json
+        response = {
+            'status_code': 200,
+            'message': 'Get data',
+            'description': 'Get aggregated data from table or view',
+            'count': 0,
+            'data': []
+        }
+
+        try:
+            if not args:
+                raise exceptions.BadRequest('No arguments provided for aggregating data')
+            aggregate_args = prepare_aggregate(args)
+            results = get_result_cache()
+            response['data'], token = results.get(aggregate_args, primary=requires_primary())
+            if response['data'] is None:
+                response['data'] = Postgres.query_aggregate(**aggregate_args)
+                results.put(token, response['data'])
+        except (exceptions.BadRequest, exceptions.ServiceUnavailable) as error:
+            logging.warning('Bad request for POST /query/aggregate: %s', str(error.args))
+            error.duration = timing.duration(start_time)
+            raise error
+        except Exception as error:
+            logging.warning('Internal Server Error during POST /query/aggregate: %s', str(error.args))
+            exception = exceptions.InternalServerError('Could not aggregate data. Error: {}'.format(str(error.args)))
+            exception.duration = timing.duration(start_time)
             raise exception
 
         response['count'] = len(response['data'])
-        response['duration'] = str(datetime.datetime.now() - start_time)
-        return response
+        response['duration'] = timing.duration(start_time)
+        return encoders.render(response, schema_result_model)
@@ -1,7 +1,11 @@
-import datetime
+from time import perf_counter_ns
 from flask import request, current_app
 from flask_restplus import Namespace, Resource, fields
+from werkzeug import exceptions
 from p2rest.src.database.postgres import Postgres
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.catalog import get_catalog
+from p2rest.src import timing
 
 # Blueprint Configuration
 schema_api = Namespace(name='schema',
@@ -19,7 +23,8 @@ schema_result_model = schema_api.model('schema_result', {
 schema_request_model = schema_api.model('schema_select', {
     'schema': fields.String(title='Postgres Schema',
                             description='Specifies the schema where the relation can be found. This is required '
-                                        'because otherwise we can not find the correct relation',
+                                        'because otherwise we can not find the correct relation. Unquoted names are '
+                                        'folded to lower case. The key name is accepted as well',
                             required=True,
                             example='postgres',
                             default='postgres')
@@ -41,7 +46,7 @@ class SchemaListApi(Resource):
         Returns the api information for this service
         :return:
         """
-        starttime = datetime.datetime.now()
+        starttime = perf_counter_ns()
         response = {
             'status_code': 200,
             'message': 'DB schema',
@@ -51,24 +56,18 @@ class SchemaListApi(Resource):
         }
 
         try:
-            response['data'] = Postgres.get_schemata(
-                host=current_app.config['P2REST_DB_HOST'],
-                port=current_app.config['P2REST_DB_PORT'],
-                dbname=current_app.config['P2REST_DB_NAME'],
-                user=current_app.config['P2REST_DB_USER'],
-                password=current_app.config['P2REST_DB_PASSWORD'],
-                limit=current_app.config['P2REST_MAX_RESULTS'],
-            )
+            schemata = get_catalog().get_schemata()[:current_app.config['P2REST_MAX_RESULTS']]
+            response['data'] = [{'schema_name': schema['schema_name']} for schema in schemata]
             response['count'] = len(response['data'])
         except Exception as error:
             response['status_code'] = 500
             response['message'] = 'Error connecting to the database'
             response['description'] = 'We could not connect to the database. Perhaps the connection is wrong or the' \
                                       'database is not reachable at the moment. Error {}'.format(str(error.args))
-            response['duration'] = str(datetime.datetime.now() - starttime)
+            response['duration'] = timing.duration(starttime)
             return response, response['status_code']
 
-        response['duration'] = str(datetime.datetime.now() - starttime)
+        response['duration'] = timing.duration(starttime)
         return response
 
     @schema_api.doc('Create a new schema in the database')
@@ -80,7 +79,7 @@ class SchemaListApi(Resource):
         :return:
         """
         # handle arguments
-        starttime = datetime.datetime.now()
+        starttime = perf_counter_ns()
         args = request.json
 
         response = {
@@ -91,29 +90,34 @@ class SchemaListApi(Resource):
             'data': []
         }
 
-        if not args['name'] or args['name'] == '':
+        # the name was read from the key 'name' before it was read from the key of the model
+        schema = args and (args.get('schema') or args.get('name'))
+        if not schema:
             response['status_code'] = 400
             response['message'] = 'Missing schema name'
             response['description'] = 'You need to provide a name for the schema'
-            response['duration'] = str(datetime.datetime.now() - starttime)
+            response['duration'] = timing.duration(starttime)
             return response, response['status_code']
 
         try:
-            Postgres.create_schema(host=current_app.config['P2REST_DB_HOST'],
-                                   port=current_app.config['P2REST_DB_PORT'],
-                                   dbname=current_app.config['P2REST_DB_NAME'],
-                                   user=current_app.config['P2REST_DB_USER'],
-                                   password=current_app.config['P2REST_DB_PASSWORD'],
-                                   schema_name=args['schema'])
+            Postgres.create_schema(pool=get_pool(),
+                                   schema_name=schema)
+            get_catalog().invalidate()
+        except exceptions.BadRequest as error:
+            response['status_code'] = 400
+            response['message'] = 'Invalid schema name'
+            response['description'] = error.description
+            response['duration'] = timing.duration(starttime)
+            return response, response['status_code']
         except Exception as error:
             response['status_code'] = 500
             response['message'] = 'Could not create schema'
             response['description'] = 'There was an error while creating the new schema. Error: {}'\
                 .format(str(error.args))
-            response['duration'] = str(datetime.datetime.now() - starttime)
+            response['duration'] = timing.duration(starttime)
             return response, response['status_code']
 
-        response['duration'] = str(datetime.datetime.now() - starttime)
+        response['duration'] = timing.duration(starttime)
         return response
 
 
@@ -132,7 +136,7 @@ class SchemaApi(Resource):
         Returns the information about a given schema
         :return:
         """
-        starttime = datetime.datetime.now()
+        starttime = perf_counter_ns()
         response = {
             'status_code': 200,
             'message': 'DB schema',
@@ -142,23 +146,17 @@ class SchemaApi(Resource):
         }
 
         try:
-            response['data'] = Postgres.get_schema(
-                host=current_app.config['P2REST_DB_HOST'],
-                port=current_app.config['P2REST_DB_PORT'],
-                dbname=current_app.config['P2REST_DB_NAME'],
-                user=current_app.config['P2REST_DB_USER'],
-                password=current_app.config['P2REST_DB_PASSWORD'],
-                schema_name=schema
-            )
+            schema_info = get_catalog().get_schema(schema)
+            response['data'] = [schema_info] if schema_info else []
         except Exception as error:
             response['status_code'] = 500
             response['message'] = 'Error connecting to the database'
             response['description'] = 'We could not connect to the database. Perhaps the connection is wrong or the' \
                                       'database is not reachable at the moment. Error: {}'.format(str(error.args))
-            response['duration'] = str(datetime.datetime.now() - starttime)
+            response['duration'] = timing.duration(starttime)
             return response, response['status_code']
 
-        response['duration'] = str(datetime.datetime.now() - starttime)
+        response['duration'] = timing.duration(starttime)
         return response
 
     @schema_api.doc('Delete a schema in the databae')
@@ -168,7 +166,7 @@ class SchemaApi(Resource):
         Deletes a schema in the database
         :return:
         """
-        starttime = datetime.datetime.now()
+        starttime = perf_counter_ns()
         response = {
             'status_code': 200,
             'message': 'Schema deleted',
@@ -181,23 +179,26 @@ class SchemaApi(Resource):
             response['status_code'] = 400
             response['message'] = 'Missing schema name'
             response['description'] = 'You need to provide a name for the schema'
-            response['duration'] = str(datetime.datetime.now() - starttime)
+            response['duration'] = timing.duration(starttime)
             return response, response['status_code']
 
         try:
-            Postgres.create_schema(host=current_app.config['P2REST_DB_HOST'],
-                                   port=current_app.config['P2REST_DB_PORT'],
-                                   dbname=current_app.config['P2REST_DB_NAME'],
-                                   user=current_app.config['P2REST_DB_USER'],
-                                   password=current_app.config['P2REST_DB_PASSWORD'],
+            Postgres.delete_schema(pool=get_pool(),
                                    schema_name=schema)
+            get_catalog().invalidate()
+        except exceptions.BadRequest as error:
+            response['status_code'] = 400
+            response['message'] = 'Invalid schema name'
+            response['description'] = error.description
+            response['duration'] = timing.duration(starttime)
+            return response, response['status_code']
         except Exception as error:
             response['status_code'] = 500
             response['message'] = 'Could not delete schema'
             response['description'] = 'There was an error while deleting the schema. Error: {}'\
                 .format(str(error.args))
-            response['duration'] = str(datetime.datetime.now() - starttime)
+            response['duration'] = timing.duration(starttime)
             return response, response['status_code']
 
-        response['duration'] = str(datetime.datetime.now() - starttime)
+        response['duration'] = timing.duration(starttime)
         return response
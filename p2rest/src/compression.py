@@ -0,0 +1,154 @@
+import zlib
+from flask import request, current_app
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, without it the encoding is not offered
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    # zstandard is optional, without it the encoding is not offered
+    zstandard = None
+
+# already compressed formats that are sent as they are
+INCOMPRESSIBLE_MIMETYPES = ('application/vnd.apache.parquet', 'application/gzip', 'application/zip')
+
+
+class GzipCompressor(object):
+    """
+    Incremental gzip compressor, every flush ends a deflate block so the client can decode the data sent so far
+    """
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(object):
+    """
+    Incremental brotli compressor
+    """
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdCompressor(object):
+    """
+    Incremental zstandard compressor
+    """
+
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def get_compressors():
+    """
+    Returns the compressor class and the name of the level setting of every available encoding
+    """
+    compressors = {'gzip': (GzipCompressor, 'P2REST_COMPRESSION_GZIP_LEVEL')}
+    if brotli is not None:
+        compressors['br'] = (BrotliCompressor, 'P2REST_COMPRESSION_BROTLI_LEVEL')
+    if zstandard is not None:
+        compressors['zstd'] = (ZstdCompressor, 'P2REST_COMPRESSION_ZSTD_LEVEL')
+    return compressors
+
+
+class CompressingIterable(object):
+    """
+    Compresses the body of a streamed response chunk by chunk. Every chunk is flushed, so the client receives the
+    rows as soon as they are sent instead of after the compressor's buffer is full
+    """
+
+    def __init__(self, iterable, compressor):
+        self.iterable = iterable
+        self.compressor = compressor
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            if not chunk:
+                continue
+            data = self.compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            data += self.compressor.flush()
+            if data:
+                yield data
+        yield self.compressor.finish()
+
+    def close(self):
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+
+
+def negotiate(encodings):
+    """
+    Selects the encoding of the response from the Accept-Encoding header of the current request
+    :param encodings: The encodings the service offers in the order of preference
+    :return: The name of the encoding or None if the response is sent uncompressed
+    """
+    return request.accept_encodings.best_match(encodings)
+
+
+def _after_request(response):
+    config = current_app.config
+    if not config['P2REST_COMPRESSION'] or request.method == 'HEAD' or response.status_code in (204, 304) or \
+            response.direct_passthrough or 'Content-Encoding' in response.headers or \
+            response.mimetype in INCOMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not response.is_streamed and (response.content_length or 0) < config['P2REST_COMPRESSION_MIN_SIZE']:
+        return response
+
+    compressors = get_compressors()
+    encoding = negotiate([name for name in config['P2REST_COMPRESSION_ENCODINGS'].split(',')
+                          if name.strip() in compressors])
+    if encoding is None:
+        return response
+    compressor_class, level = compressors[encoding.strip()]
+    compressor = compressor_class(config[level])
+
+    if response.is_streamed:
+        # the body is compressed while it is sent, its size is not known beforehand
+        response.response = CompressingIterable(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compressor.compress(response.get_data()) + compressor.finish())
+    response.headers['Content-Encoding'] = encoding.strip()
+    return response
+
+
+def init_compression(app):
+    """
+    Registers the request hook that compresses the responses with gzip, brotli or zstd as negotiated with the
+    Accept-Encoding header of the request. brotli and zstd need the optional packages brotli and zstandard
+    :param app: The flask application
+    """
+    app.after_request(_after_request)
@@ -13,6 +13,128 @@ class Config:
     P2REST_DB_PASSWORD = 'postgres'
     P2REST_MAX_RESULTS = 10000
 
+    # serve the swagger ui and /swagger.json, can be disabled in production
+    P2REST_DOCS = True
+
+    # api key of the admin endpoints (statistics, query shapes and index suggestions), sent in the header
+    # "Authorization: Bearer <key>". The admin endpoints are disabled without a key
+    P2REST_ADMIN_API_KEY = ''
+
+    # read replicas: comma separated dsns ("host[:port]", "host=... port=..." or "postgresql://...", missing
+    # parameters are taken from the primary). Reads are distributed 'round_robin' or to the replica with the
+    # 'least_outstanding' connections. Replicas lagging behind more than the maximum lag in seconds (0 = no limit) or
+    # not reachable are not used until the next successful check, which runs every check interval seconds
+    P2REST_DB_REPLICAS = ''
+    P2REST_DB_REPLICA_POLICY = 'round_robin'
+    P2REST_DB_REPLICA_MAX_LAG = 30
+    P2REST_DB_REPLICA_CHECK_INTERVAL = 5
+
+    # connection pool settings (per worker process), timeouts and lifetimes are in seconds
+    P2REST_DB_POOL_MIN_SIZE = 1
+    P2REST_DB_POOL_MAX_SIZE = 10
+    P2REST_DB_POOL_IDLE_TIMEOUT = 300
+    P2REST_DB_POOL_MAX_LIFETIME = 3600
+    P2REST_DB_POOL_CHECK_ON_CHECKOUT = True
+    P2REST_DB_POOL_TIMEOUT = 30
+
+    # statement cache: number of cached query shapes and uses after which a shape is prepared on the server (0 = never)
+    P2REST_STATEMENT_CACHE_SIZE = 256
+    P2REST_PREPARE_THRESHOLD = 5
+
+    # catalog cache: seconds until the catalog is loaded again (0 = never), listener for the notifications of the
+    # event trigger, and minimum seconds between loads caused by unknown relations or columns
+    P2REST_CATALOG_TTL = 300
+    P2REST_CATALOG_LISTEN = True
+    P2REST_CATALOG_CHANNEL = 'p2rest_catalog'
+    P2REST_CATALOG_REFRESH_INTERVAL = 1
+    # check schema, relation and column names of selects against the catalog before querying the database
+    P2REST_CATALOG_VALIDATE = True
+
+    # default rendering engine for selects: 'python' converts rows in the service, 'database' lets postgres
+    # render the json
+    P2REST_RENDER_ENGINE = 'python'
+
+    # json encoder of the query responses: 'orjson' (needs the package orjson), 'json' of the standard library or
+    # 'auto' for orjson if it is installed
+    P2REST_JSON_ENCODER = 'auto'
+
+    # amount of rows fetched per round trip from the server side cursor of streamed selects
+    P2REST_STREAM_BATCH_SIZE = 1000
+    # minimum amount of rows per row group of parquet responses, the batches of the cursor are collected until then
+    P2REST_PARQUET_ROW_GROUP_SIZE = 100000
+
+    # batch selects: maximum amount of selects per request and of connections used for one request
+    P2REST_BATCH_MAX_QUERIES = 50
+    P2REST_BATCH_CONCURRENCY = 4
+
+    # bytes of the request body that are read and sent to the database per call when loading data with COPY
+    P2REST_INGEST_CHUNK_SIZE = 65536
+
+    # exports with COPY TO: maximum amount of rows per export (0 = no limit, P2REST_MAX_RESULTS does not apply),
+    # concurrent exports per worker process and minimum bytes per chunk of the response
+    P2REST_EXPORT_MAX_ROWS = 0
+    P2REST_EXPORT_MAX_CONCURRENT = 2
+    P2REST_EXPORT_CHUNK_SIZE = 65536
+
+    # result cache for selects, enabled per relation: comma separated "schema.relation" or "schema.relation=ttl" (or
+    # a dictionary of names to ttls in a config file). Entries expire after the ttl in seconds and are invalidated
+    # when the write counters of the table change (checked at most once per check interval, 0 = never) or when a
+    # notification of the write trigger arrives
+    P2REST_RESULT_CACHE_RELATIONS = ''
+    P2REST_RESULT_CACHE_TTL = 60
+    P2REST_RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    P2REST_RESULT_CACHE_CHECK_INTERVAL = 1
+    P2REST_RESULT_CACHE_CHANNEL = 'p2rest_results'
+
+    # health probes: seconds between two database probes of the background prober, seconds a probe may wait for a
+    # connection and run, replication lag reporting and the lag in seconds after which the service is not ready
+    # (0 = no limit)
+    P2REST_HEALTH_PROBE_INTERVAL = 5
+    P2REST_HEALTH_PROBE_TIMEOUT = 2
+    P2REST_HEALTH_PROBE_BACKGROUND = True
+    P2REST_HEALTH_REPLICATION_LAG = False
+    P2REST_HEALTH_MAX_REPLICATION_LAG = 0
+
+    # prometheus metrics: enables the metrics endpoint and the request measurements, path of the endpoint
+    P2REST_METRICS = True
+    P2REST_METRICS_PATH = '/metrics'
+
+    # request timings: report the phases of every request (connect, compile, execute, fetch, convert, serialize) in
+    # the Server-Timing header and append them as timings object to the json responses
+    P2REST_SERVER_TIMING = True
+    P2REST_TIMING_ENVELOPE = False
+
+    # response compression: encodings offered in the order of preference (br and zstd need the packages brotli and
+    # zstandard), minimum size in bytes of compressed responses (streamed responses are always compressed) and the
+    # level of every encoding
+    P2REST_COMPRESSION = True
+    P2REST_COMPRESSION_MIN_SIZE = 1024
+    P2REST_COMPRESSION_ENCODINGS = 'zstd,br,gzip'
+    P2REST_COMPRESSION_GZIP_LEVEL = 6
+    P2REST_COMPRESSION_BROTLI_LEVEL = 4
+    P2REST_COMPRESSION_ZSTD_LEVEL = 3
+
+    # query governor: milliseconds after which a statement is cancelled and a statement waits for locks (0 = server
+    # setting), overrides per relation as comma separated "schema.relation=statement_timeout[:lock_timeout]" (or a
+    # dictionary in a config file). With a maximum cost or rows every statement is checked with EXPLAIN first and
+    # rejected if the estimate exceeds them (0 = no limit). Statements above the queue cost wait up to the queue
+    # timeout in seconds for one of the queue slots of the worker process (0 = no queue)
+    P2REST_STATEMENT_TIMEOUT = 0
+    P2REST_LOCK_TIMEOUT = 0
+    P2REST_RELATION_TIMEOUTS = ''
+    P2REST_GOVERNOR_MAX_COST = 0
+    P2REST_GOVERNOR_MAX_ROWS = 0
+    P2REST_GOVERNOR_QUEUE_COST = 0
+    P2REST_GOVERNOR_QUEUE_SLOTS = 2
+    P2REST_GOVERNOR_QUEUE_TIMEOUT = 10
+
+    # query analytics: share of the selects whose shape (the statement without its values), latency and rows are
+    # recorded (0 = off, 1 = every select), maximum amount of shapes kept per worker process and the live rows a table
+    # needs before indexes are suggested for it
+    P2REST_ANALYTICS_SAMPLE_RATE = 0.1
+    P2REST_ANALYTICS_MAX_SHAPES = 500
+    P2REST_ANALYTICS_MIN_ROWS = 10000
+
 
 class ProdConfig(Config):
     FLASK_ENV = 'production'
@@ -33,6 +155,11 @@ class TestConfig(Config):
     DEBUG = True
     TESTING = True
     ENV = 'testing'
+    # every test creates its own app, a listener thread per app would keep too many connections open
+    P2REST_CATALOG_LISTEN = False
+    # the probes run within the requests instead of a thread per app
+    P2REST_HEALTH_PROBE_BACKGROUND = False
+    P2REST_ADMIN_API_KEY = 'test'
 
 
 config_by_name = dict(
@@ -0,0 +1,295 @@
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+import psycopg2
+
+from p2rest.src.database.catalog import normalize_identifier
+from p2rest.src.database.converters import RenderedRows, CountedRows
+from p2rest.src.database.filters import optimize_filter, filter_columns
+from p2rest.src.database.helper import PostgresHelper
+
+# operators of filter leaves a btree index can be searched with
+EQUALITY_OPERATORS = ('=', 'in', 'is null')
+RANGE_OPERATORS = ('<', '>', '<=', '>=', 'between')
+
+# kinds of relations that can be indexed: tables, materialized views and partitioned tables
+INDEXABLE_KINDS = ('r', 'm', 'p')
+
+# orders of the recorded shapes: by mean latency, by amount of samples and by the sum of the sampled latencies
+SHAPE_ORDERS = ('slowest', 'frequent', 'total')
+
+# scans of the tables an index is suggested for. The counters are kept by the server the statement runs on
+QUERY_TABLE_STATISTICS = """
+    SELECT schemaname::text, relname::text, seq_scan, seq_tup_read, idx_scan, n_live_tup
+    FROM pg_stat_user_tables
+    WHERE schemaname = ANY(%s) AND relname = ANY(%s)
+"""
+
+
+def count_result(result):
+    """
+    Returns the amount of rows of a result of Postgres.query_select
+    """
+    if isinstance(result, CountedRows):
+        result = result.data
+    if isinstance(result, RenderedRows):
+        return result.count
+    if isinstance(result, dict):
+        return len(result['rows'])
+    return len(result)
+
+
+class QueryAnalytics(object):
+    """
+    Sampled recorder of the selects of a worker process. Selects are grouped by their shape, the compiled statement
+    without its values, and the latency and rows of every sampled select are added to its shape. The filter columns
+    and order fields of the shapes are checked against the indexes of the catalog to suggest missing indexes.
+    """
+
+    def __init__(self, catalog, sample_rate=0.0, max_shapes=500, min_rows=10000):
+        """
+        Create a new recorder
+        :param catalog: The catalog cache, its indexes are used by the advisor
+        :param sample_rate: Share of the selects that are recorded, 0 disables the recording
+        :param max_shapes: Maximum amount of shapes kept, the least recently recorded ones are evicted
+        :param min_rows: Live rows a table needs before indexes are suggested for it
+        """
+        self.catalog = catalog
+        self.sample_rate = sample_rate
+        self.max_shapes = max_shapes
+        self.min_rows = min_rows
+
+        self._lock = threading.Lock()
+        self._shapes = OrderedDict()
+        self.samples = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, catalog, config):
+        """
+        Creates a recorder from the flask configuration
+        """
+        return cls(catalog,
+                   sample_rate=config['P2REST_ANALYTICS_SAMPLE_RATE'],
+                   max_shapes=config['P2REST_ANALYTICS_MAX_SHAPES'],
+                   min_rows=config['P2REST_ANALYTICS_MIN_ROWS'])
+
+    def sample(self):
+        """
+        Decides if the next select is recorded
+        """
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    @classmethod
+    def _create_shape(cls, query, args):
+        """
+        Creates the entry of a shape. The filter columns are taken from the optimized filter, like the statement
+        """
+        json_filter = optimize_filter(args.get('filter'))
+        return {'schema': normalize_identifier(args['schema']) or args['schema'],
+                'relation': normalize_identifier(args['relation']) or args['relation'],
+                'query': query,
+                'filter': [{'column': column, 'operator': operator}
+                           for column, operator in filter_columns(json_filter)],
+                'conjuncts': filter_columns(json_filter, conjunctive=True),
+                'order_fields': list(args.get('order_fields') or []),
+                'samples': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'last_seen': None}
+
+    def record(self, args, query, seconds, rows):
+        """
+        Adds a sampled select to its shape
+        :param args: The arguments of the select, see Postgres.query_select
+        :param query: The statement with placeholders
+        :param seconds: Seconds the select took, from the execution until the result was converted
+        :param rows: Amount of rows returned
+        """
+        query = ' '.join(query.split())
+        with self._lock:
+            shape = self._shapes.get(query)
+        created = self._create_shape(query, args) if shape is None else None
+        with self._lock:
+            shape = self._shapes.get(query)
+            if shape is None:
+                shape = created or self._create_shape(query, args)
+                self._shapes[query] = shape
+                while len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._shapes.move_to_end(query)
+            shape['samples'] += 1
+            shape['seconds'] += seconds
+            shape['max_seconds'] = max(shape['max_seconds'], seconds)
+            shape['rows'] += rows
+            shape['last_seen'] = time.monotonic()
+            self.samples += 1
+
+    def _describe(self, shape):
+        """
+        Returns the public fields of a shape with the latencies in milliseconds
+        """
+        return {'schema': shape['schema'],
+                'relation': shape['relation'],
+                'query': shape['query'],
+                'filter': shape['filter'],
+                'order_fields': shape['order_fields'],
+                'samples': shape['samples'],
+                'calls': round(shape['samples'] / self.sample_rate) if self.sample_rate else shape['samples'],
+                'mean_ms': shape['seconds'] / shape['samples'] * 1000,
+                'max_ms': shape['max_seconds'] * 1000,
+                'total_ms': shape['seconds'] * 1000,
+                'mean_rows': shape['rows'] / shape['samples'],
+                'age': time.monotonic() - shape['last_seen']}
+
+    def shapes(self, order='slowest', limit=20):
+        """
+        Returns the recorded shapes
+        :param order: 'slowest' (highest mean latency first), 'frequent' (most samples first) or 'total' (highest sum
+                      of the sampled latencies first)
+        :param limit: Maximum amount of shapes returned
+        :return: List of shapes, calls is the amount of selects estimated from the samples and the sample rate
+        """
+        if order not in SHAPE_ORDERS:
+            raise ValueError('Unknown order {}'.format(order))
+        with self._lock:
+            shapes = [self._describe(shape) for shape in self._shapes.values()]
+        key = {'slowest': 'mean_ms', 'frequent': 'samples', 'total': 'total_ms'}[order]
+        return sorted(shapes, key=lambda shape: shape[key], reverse=True)[:limit]
+
+    @classmethod
+    def index_columns(cls, shape, relation):
+        """
+        Returns the columns of an index that serves a shape: the columns compared for equality, followed by one
+        column compared with a range or, without a range, by the order fields
+        :param shape: The recorded shape
+        :param relation: Relation information of the catalog
+        :return: Tuple of the index columns and the searched columns, i.e. the columns compared for equality or, without
+                 equalities, the ones compared with a range. Both are empty if no index would help
+        """
+        equalities = []
+        ranges = []
+        for column, operator in shape['conjuncts']:
+            name = normalize_identifier(column)
+            if name is None or name not in relation['columns'] or name in equalities:
+                continue
+            if operator in EQUALITY_OPERATORS:
+                equalities.append(name)
+                if name in ranges:
+                    ranges.remove(name)
+            elif operator in RANGE_OPERATORS and name not in ranges:
+                ranges.append(name)
+        order = [normalize_identifier(field) for field in shape['order_fields']]
+        if any(name not in relation['columns'] for name in order):
+            order = []
+        searched = equalities or ranges
+        if ranges:
+            return equalities + ranges[:1], searched
+        return equalities + [name for name in order if name not in equalities], searched
+
+    def advise(self, pool):
+        """
+        Suggests indexes for the recorded shapes. A shape needs an index if no index of its relation starts with
+        one of its searched columns (see index_columns) or, for shapes that are only ordered, with its order fields.
+        Tables with less than min_rows live rows and tables that were never read sequentially are skipped
+        :param pool: The connection pool used for reading the scan counters of the tables, i.e. the one that serves
+                     the selects
+        :return: List of suggestions, the ones with the highest sum of sampled latencies first
+        """
+        with self._lock:
+            shapes = [dict(shape) for shape in self._shapes.values()]
+        relations = self.catalog.get().relations
+
+        suggestions = OrderedDict()
+        for shape in shapes:
+            relation = relations.get((shape['schema'], shape['relation']))
+            if relation is None or relation['kind'] not in INDEXABLE_KINDS:
+                continue
+            columns, searched = self.index_columns(shape, relation)
+            if not columns:
+                continue
+            leading = [index['columns'] for index in relation['indexes'] if index['columns']]
+            if searched and any(index[0] in searched for index in leading):
+                continue
+            if not searched and any(index[:len(columns)] == columns for index in leading):
+                continue
+            suggestion = suggestions.setdefault((shape['schema'], shape['relation'], tuple(columns)), {
+                'schema': shape['schema'],
+                'relation': shape['relation'],
+                'columns': columns,
+                'statement': 'CREATE INDEX ON {}.{} ({})'.format(
+                    PostgresHelper.quote_identifier(shape['schema']),
+                    PostgresHelper.quote_identifier(shape['relation']),
+                    ', '.join(PostgresHelper.quote_identifier(column) for column in columns)),
+                'shapes': 0, 'samples': 0, 'calls': 0, 'total_ms': 0.0})
+            described = self._describe(shape)
+            suggestion['shapes'] += 1
+            suggestion['samples'] += described['samples']
+            suggestion['calls'] += described['calls']
+            suggestion['total_ms'] += described['total_ms']
+        if not suggestions:
+            return []
+
+        statistics = {}
+        try:
+            with pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(QUERY_TABLE_STATISTICS, [[key[0] for key in suggestions],
+                                                        [key[1] for key in suggestions]])
+                for schema, name, seq_scan, seq_tup_read, idx_scan, live_rows in cursor.fetchall():
+                    statistics[(schema, name)] = {'seq_scan': seq_scan, 'seq_tup_read': seq_tup_read,
+                                                  'idx_scan': idx_scan, 'live_rows': live_rows}
+                cursor.close()
+        except psycopg2.Error as error:
+            logging.error('We could not read the table statistics: %s', str(error.args))
+            raise error
+
+        result = []
+        for (schema, name, _), suggestion in suggestions.items():
+            # partitioned tables have no statistics of their own, they are suggested without them
+            counters = statistics.get((schema, name), {'seq_scan': None, 'seq_tup_read': None, 'idx_scan': None,
+                                                       'live_rows': None})
+            if counters['live_rows'] is not None and (counters['live_rows'] < self.min_rows or
+                                                      not counters['seq_scan']):
+                continue
+            suggestion.update(counters)
+            suggestion['mean_ms'] = suggestion['total_ms'] / suggestion['samples']
+            result.append(suggestion)
+        return sorted(result, key=lambda suggestion: suggestion['total_ms'], reverse=True)
+
+    def reset(self):
+        """
+        Removes all recorded shapes
+        """
+        with self._lock:
+            self._shapes.clear()
+
+    def stats(self):
+        """
+        Returns the amount of recorded shapes and samples
+        """
+        return {'sample_rate': self.sample_rate, 'shapes': len(self._shapes), 'max_shapes': self.max_shapes,
+                'samples': self.samples, 'evictions': self.evictions}
+
+
+def init_analytics(app, catalog):
+    """
+    Creates the query analytics of the application. They can be retrieved later with get_analytics
+    :param app: The flask application
+    :param catalog: The catalog cache of the application
+    :return: The new query analytics
+    """
+    analytics = QueryAnalytics.from_config(catalog, app.config)
+    app.extensions['p2rest_analytics'] = analytics
+    return analytics
+
+
+def get_analytics(app=None):
+    """
+    Returns the query analytics of the given or current flask application
+    """
+    if app is None:
+        app = current_app
+    return app.extensions['p2rest_analytics']
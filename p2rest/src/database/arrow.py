@@ -0,0 +1,206 @@
+import json
+
+from p2rest.src import metrics, timing
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    # pyarrow is optional, without it the columnar formats are not available
+    pyarrow = None
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+
+# Type oid of numeric and the maximum precision of arrow's decimal128
+NUMERIC_OID = 1700
+MAX_DECIMAL_PRECISION = 38
+
+
+def convert_json(value):
+    return json.dumps(value)
+
+
+def convert_bytes(value):
+    return bytes(value)
+
+
+def convert_decimal(value):
+    """
+    Converter for constrained numeric columns, NaN has no decimal counterpart and is written as null
+    """
+    return None if value.is_nan() else value
+
+
+def convert_unknown(value):
+    """
+    Converter for columns of a type without an arrow counterpart, the values are written as text
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    if isinstance(value, (memoryview, bytes)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def get_arrow_types():
+    """
+    Returns the arrow type of the columns of every known type oid and the converter needed for their values (None if
+    the values can be passed to arrow as they are)
+    """
+    timestamp = pyarrow.timestamp('us')
+    timestamptz = pyarrow.timestamp('us', tz='UTC')
+    types = {
+        16: (pyarrow.bool_(), None),
+        17: (pyarrow.binary(), convert_bytes),
+        18: (pyarrow.string(), None),  # char
+        19: (pyarrow.string(), None),  # name
+        20: (pyarrow.int64(), None),
+        21: (pyarrow.int16(), None),
+        23: (pyarrow.int32(), None),
+        25: (pyarrow.string(), None),
+        26: (pyarrow.int64(), None),  # oid
+        114: (pyarrow.string(), convert_json),
+        700: (pyarrow.float32(), None),
+        701: (pyarrow.float64(), None),
+        1042: (pyarrow.string(), None),
+        1043: (pyarrow.string(), None),
+        1082: (pyarrow.date32(), None),
+        1083: (pyarrow.time64('us'), None),
+        1114: (timestamp, None),
+        1184: (timestamptz, None),
+        1186: (pyarrow.duration('us'), None),
+        1700: (pyarrow.string(), str),  # unconstrained numeric, see get_numeric_type
+        2950: (pyarrow.string(), str),
+        3802: (pyarrow.string(), convert_json),
+    }
+    # arrays of the types above whose values need no conversion
+    arrays = {1000: 16, 1005: 21, 1007: 23, 1016: 20, 1009: 25, 1015: 1043, 1021: 700, 1022: 701, 1182: 1082,
+              1115: 1114, 1185: 1184}
+    for oid, element in arrays.items():
+        types[oid] = (pyarrow.list_(types[element][0]), None)
+    return types
+
+
+def get_numeric_type(column):
+    """
+    Returns the arrow type and converter of a numeric column. Numerics with a precision that fits decimal128 keep all
+    their digits as decimals, unconstrained ones (and the ones with a larger precision) are written as text like in
+    the json responses
+    :param column: The column of the cursor description
+    """
+    if column.precision is not None and 0 < column.precision <= MAX_DECIMAL_PRECISION:
+        return pyarrow.decimal128(column.precision, column.scale or 0), convert_decimal
+    return pyarrow.string(), str
+
+
+class ArrowBatchBuilder(object):
+    """
+    Builds arrow record batches from the rows of a cursor. The schema and the converters are derived once from the
+    type oids in the cursor description; the values are transposed into columns and passed to arrow without
+    converting them to json first.
+    """
+
+    def __init__(self, columns):
+        """
+        :param columns: The cursor description of the result
+        """
+        if pyarrow is None:
+            raise RuntimeError('pyarrow is not installed')
+        types = get_arrow_types()
+        fields = []
+        self.converters = []
+        for index, column in enumerate(columns):
+            if column.type_code == NUMERIC_OID:
+                arrow_type, converter = get_numeric_type(column)
+            else:
+                arrow_type, converter = types.get(column.type_code, (pyarrow.string(), convert_unknown))
+            fields.append(pyarrow.field(column.name, arrow_type))
+            if converter is not None:
+                self.converters.append((index, converter))
+        self.schema = pyarrow.schema(fields)
+
+    def batch(self, rows):
+        """
+        Converts rows into a record batch
+        :param rows: List of tuples returned by the cursor
+        :return: pyarrow.RecordBatch
+        """
+        metrics.count_rows(len(rows))
+        with timing.span('convert'):
+            columns = [list(column) for column in zip(*rows)]
+            for index, converter in self.converters:
+                columns[index] = [None if value is None else converter(value) for value in columns[index]]
+            return pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+                schema=self.schema)
+
+
+class ChunkSink(object):
+    """
+    File like object the arrow writers write into. The written bytes are collected until they are taken
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def write_batches(columns, batches, output_format, row_group_size=100000):
+    """
+    Writes the batches of a streamed select as arrow ipc stream or parquet file. Every batch of rows becomes a
+    record batch that is yielded as soon as it is written. For parquet the batches are collected until they fill a
+    row group, small row groups would compress worse and slow down the readers
+    :param columns: The cursor description of the result
+    :param batches: Iterable yielding lists of rows as returned by the cursor
+    :param output_format: 'arrow' or 'parquet'
+    :param row_group_size: Minimum amount of rows of a parquet row group, the last one may be smaller
+    :return: Generator yielding the data as bytes
+    """
+    builder = ArrowBatchBuilder(columns)
+    sink = ChunkSink()
+    pending = []
+    pending_rows = 0
+    if output_format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, builder.schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, builder.schema)
+    try:
+        for rows in batches:
+            if not rows:
+                continue
+            batch = builder.batch(rows)
+            if output_format != 'parquet':
+                writer.write_batch(batch)
+            else:
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                if pending_rows < row_group_size:
+                    continue
+                writer.write_table(pyarrow.Table.from_batches(pending), row_group_size=pending_rows)
+                pending = []
+                pending_rows = 0
+            data = sink.take()
+            if data:
+                yield data
+        if pending:
+            writer.write_table(pyarrow.Table.from_batches(pending), row_group_size=pending_rows)
+    finally:
+        writer.close()
+    yield sink.take()
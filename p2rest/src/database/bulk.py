@@ -0,0 +1,419 @@
+import re
+import csv
+import json
+import queue
+import datetime
+import threading
+import psycopg2
+
+# Type names of the catalog whose values are written as json text
+JSON_TYPES = ('json', 'jsonb')
+
+# Types whose values are checked before they are passed to COPY, by type name without modifiers: the bounds of the
+# integer types, the floating point and numeric types, and the date and time types
+INTEGER_RANGES = {'smallint': 2 ** 15, 'integer': 2 ** 31, 'bigint': 2 ** 63}
+DECIMAL_TYPES = ('numeric', 'real', 'double precision')
+TIMESTAMP_TYPES = ('timestamp without time zone', 'timestamp with time zone')
+TIME_TYPES = ('time without time zone', 'time with time zone')
+
+# Input values of booleans and the special values of dates and timestamps postgres accepts
+BOOLEAN_LITERALS = ('t', 'true', 'y', 'yes', 'on', '1', 'f', 'false', 'n', 'no', 'off', '0')
+DATETIME_SPECIALS = ('infinity', '-infinity', 'epoch', 'now', 'today', 'tomorrow', 'yesterday')
+
+TYPE_MODIFIER = re.compile(r'\([^)]*\)')
+DATE_PATTERN = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})')
+TIME_PATTERN = re.compile(r'^\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?\s*(Z|[+-]\d{1,2}(:?\d{2})?|[A-Za-z][A-Za-z/_+-]*)?$')
+
+
+class IngestError(ValueError):
+    """
+    Raised while reading the body of a bulk ingest if it does not match the relation
+    """
+    pass
+
+
+def parse_csv_line(line):
+    """
+    Parses a line of a csv upload, e.g. the header line
+    :param line: The line as bytes
+    :return: List of the fields
+    """
+    return next(csv.reader([line.decode('utf-8')]))
+
+
+def check_date(text):
+    """
+    Checks the date at the start of a value in ISO format (YYYY-MM-DD)
+    :return: The rest of the value after the date or None if it does not start with a valid date
+    """
+    match = DATE_PATTERN.match(text)
+    if match is None:
+        return None
+    try:
+        datetime.date(*(int(part) for part in match.groups()))
+    except ValueError:
+        return None
+    return text[match.end():]
+
+
+def check_text_value(text, type_name):
+    """
+    Checks that the text of a value can be loaded into a column. Integers, decimals and booleans are parsed, dates,
+    timestamps and times have to be in ISO format. Values of other types are left to postgres
+    :param text: The value as it is passed to COPY, without quotes
+    :param type_name: The type of the column as returned by format_type
+    :return: True if the value fits the column
+    """
+    base_type = TYPE_MODIFIER.sub('', type_name)
+    text = text.strip()
+    if base_type in INTEGER_RANGES:
+        try:
+            return -INTEGER_RANGES[base_type] <= int(text) < INTEGER_RANGES[base_type]
+        except ValueError:
+            return False
+    if base_type in DECIMAL_TYPES:
+        try:
+            float(text)
+        except ValueError:
+            return False
+        return True
+    if base_type == 'boolean':
+        return text.lower() in BOOLEAN_LITERALS
+    if base_type in TIME_TYPES:
+        return text.lower() in ('now', 'allballs') or TIME_PATTERN.match(text) is not None
+    if base_type == 'date' or base_type in TIMESTAMP_TYPES:
+        if text.lower() in DATETIME_SPECIALS:
+            return True
+        rest = check_date(text)
+        if rest is None:
+            return False
+        if rest.endswith(' BC'):
+            rest = rest[:-3]
+        if base_type == 'date' or not rest:
+            return not rest
+        return rest[0] in 'T ' and TIME_PATTERN.match(rest[1:].strip()) is not None
+    return True
+
+
+def check_json_value(value, type_name):
+    """
+    Checks that a json value can be loaded into a column. Objects only fit json columns, lists json and array columns,
+    the other values are checked like the text they are passed to COPY as (see check_text_value)
+    :param value: The json value
+    :param type_name: The type of the column as returned by format_type
+    :return: True if the value fits the column
+    """
+    if value is None:
+        return True
+    if isinstance(value, dict):
+        return type_name in JSON_TYPES
+    if isinstance(value, list):
+        return type_name in JSON_TYPES or type_name.endswith('[]')
+    if isinstance(value, bool):
+        return check_text_value('true' if value else 'false', type_name)
+    if isinstance(value, (int, float)):
+        return check_text_value(repr(value), type_name)
+    return check_text_value(value, type_name)
+
+
+def render_csv_value(value, type_name):
+    """
+    Renders a json value as field of a csv line in the format of postgres' COPY. None becomes an unquoted empty
+    field (NULL), strings are always quoted, so empty strings are kept
+    :param value: The json value
+    :param type_name: The type of the column as returned by format_type
+    :return: The csv field
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, list) and type_name.endswith('[]') and type_name[:-2] not in JSON_TYPES:
+        value = render_array(value)
+    elif not isinstance(value, str):
+        value = json.dumps(value)
+    return '"' + value.replace('"', '""') + '"'
+
+
+def render_array(values):
+    """
+    Renders a (nested) list as postgres array literal
+    :param values: The list
+    :return: The array literal
+    """
+    items = []
+    for value in values:
+        if value is None:
+            items.append('NULL')
+        elif isinstance(value, list):
+            items.append(render_array(value))
+        elif isinstance(value, bool):
+            items.append('true' if value else 'false')
+        elif isinstance(value, (int, float)):
+            items.append(repr(value))
+        else:
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            items.append('"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(items) + '}'
+
+
+class CsvReader(object):
+    """
+    File like object that passes the body of a csv upload to COPY. The header line has to be read by the caller, it
+    must not be passed on
+    """
+
+    def __init__(self, stream, first=None):
+        """
+        :param stream: The request body stream
+        :param first: A line that was already read from the stream and has to be passed on first
+        """
+        self.stream = stream
+        self.bytes = 0
+        self.error = None
+        self._first = first
+
+    def read(self, size=-1):
+        if self._first is not None:
+            data, self._first = self._first, None
+        else:
+            data = self.stream.read(size)
+        self.bytes += len(data)
+        return data
+
+
+def parse_ndjson_line(line, number):
+    """
+    Parses one line of a newline delimited json upload
+    :param line: The line as bytes
+    :param number: The line number used in error messages
+    :return: The json object as dictionary
+    """
+    try:
+        row = json.loads(line)
+    except ValueError as error:
+        raise IngestError('Line {}: invalid json ({})'.format(number, error))
+    if not isinstance(row, dict):
+        raise IngestError('Line {}: every line has to be a json object'.format(number))
+    return row
+
+
+class NdjsonReader(object):
+    """
+    File like object that converts the lines of a newline delimited json upload into csv lines for COPY. Only the
+    lines needed for the requested size are read from the body, so the memory usage does not depend on the size of
+    the upload
+    """
+
+    def __init__(self, stream, keys, types, first=None):
+        """
+        :param stream: The request body stream
+        :param keys: Keys of the json objects in the order of the columns of the COPY statement
+        :param types: Type names of these columns
+        :param first: A line that was already read from the stream (e.g. for finding the keys)
+        """
+        self.stream = stream
+        self.keys = keys
+        self.types = types
+        self.known = set(keys)
+        self.buffer = b''
+        self.line = 0
+        self.bytes = 0
+        self.error = None
+        self._first = first
+
+    def _readline(self):
+        if self._first is not None:
+            line, self._first = self._first, None
+            return line
+        return self.stream.readline()
+
+    def convert(self, line):
+        """
+        Converts one json line into a csv line
+        :param line: The json document as bytes
+        :return: The csv line as bytes
+        """
+        row = parse_ndjson_line(line, self.line)
+        unknown = [key for key in row if key not in self.known]
+        if unknown:
+            raise IngestError('Line {}: unknown columns {}'.format(self.line, ', '.join(unknown)))
+        for key, type_name in zip(self.keys, self.types):
+            if not check_json_value(row.get(key), type_name):
+                raise IngestError('Line {}: the value of column {} does not fit its type {}'.format(
+                    self.line, key, type_name))
+        return (','.join(render_csv_value(row.get(key), type_name)
+                         for key, type_name in zip(self.keys, self.types)) + '\n').encode('utf-8')
+
+    def read(self, size=-1):
+        parts = [self.buffer]
+        length = len(self.buffer)
+        try:
+            while size < 0 or length < size:
+                line = self._readline()
+                if not line:
+                    break
+                self.line += 1
+                self.bytes += len(line)
+                if line.strip():
+                    parts.append(self.convert(line))
+                    length += len(parts[-1])
+        except IngestError as error:
+            # COPY only reports that the read failed, the caller takes the details from here
+            self.error = error
+            raise
+        self.buffer = b''.join(parts)
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def first_line(stream):
+    """
+    Reads the first line of a stream that is not empty
+    :param stream: The request body stream
+    :return: The line as bytes or None if the stream is empty
+    """
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        if line.strip():
+            return line
+
+
+class ExportCancelled(Exception):
+    """
+    Raised in the copy thread of an export when the client stopped reading the response
+    """
+    pass
+
+
+class CopyWriter(object):
+    """
+    File like object COPY TO STDOUT writes into. Postgres sends one row per message, the rows are collected into
+    chunks and passed on through a bounded queue, so the copy waits for the client if it reads slower than the
+    database sends
+    """
+
+    END = object()
+
+    def __init__(self, chunk_size=65536, queue_size=8):
+        """
+        :param chunk_size: Minimum amount of bytes per chunk
+        :param queue_size: Maximum amount of chunks waiting to be sent
+        """
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(queue_size)
+        self.cancelled = threading.Event()
+        self.error = None
+        self.bytes = 0
+        self._parts = []
+        self._size = 0
+
+    def write(self, data):
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            chunk = b''.join(self._parts)
+            self._parts = []
+            self._size = 0
+            self.bytes += len(chunk)
+            self._put(chunk)
+
+    def close(self, error=None):
+        """
+        Marks the end of the data, after an error or after all rows were written
+        """
+        self.error = error
+        if error is None:
+            self.flush()
+        try:
+            self._put(self.END)
+        except ExportCancelled:
+            pass
+
+    def _put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelled('The client stopped reading the export')
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def chunks(self):
+        """
+        Generator yielding the chunks until the end of the data. Errors of the copy are raised
+        """
+        while True:
+            item = self.queue.get()
+            if item is self.END:
+                break
+            yield item
+        if self.error is not None:
+            raise self.error
+
+
+class CopyStream(object):
+    """
+    Iterator over the chunks of an export. Closing it before the end (e.g. because the client disconnected) cancels
+    the copy on the server. This is a class and not a generator, so closing works even if it was never iterated
+    """
+
+    def __init__(self, writer, thread, connection):
+        """
+        :param writer: The writer the copy writes into
+        :param thread: The thread running the copy
+        :param connection: The connection of the copy
+        """
+        self.writer = writer
+        self.thread = thread
+        self.connection = connection
+        self.on_close = []
+        self._first = None
+        self._chunks = writer.chunks()
+        self._closed = False
+
+    def start(self):
+        """
+        Waits for the first chunk, so errors of the query are raised before the response is started
+        :return: The stream itself
+        """
+        self._first = next(self._chunks, None)
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first is not None:
+            chunk, self._first = self._first, None
+            return chunk
+        return next(self._chunks)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self.thread.is_alive():
+                self.writer.cancelled.set()
+                try:
+                    self.connection.cancel()
+                except psycopg2.Error:
+                    pass
+                self.thread.join()
+        finally:
+            for callback in self.on_close:
+                callback()
@@ -0,0 +1,444 @@
+import os
+import re
+import time
+import select
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+import psycopg2
+
+QUERY_SCHEMATA = """
+    SELECT current_database()::text AS catalog_name, n.nspname::text AS schema_name,
+           pg_get_userbyid(n.nspowner)::text AS schema_owner
+    FROM pg_namespace n
+    WHERE (pg_has_role(n.nspowner, 'USAGE') OR has_schema_privilege(n.oid, 'CREATE, USAGE'))
+      AND n.nspname <> 'pg_toast' AND n.nspname NOT LIKE 'pg\\_temp\\_%' AND n.nspname NOT LIKE 'pg\\_toast\\_temp\\_%'
+    ORDER BY n.oid
+"""
+
+# The default and generated flags of the columns are selected by get_columns_query, their columns of pg_attribute
+# depend on the server version
+QUERY_COLUMNS = """
+    SELECT n.nspname::text, c.relname::text, c.relkind::text, a.attname::text, a.atttypid::int,
+           format_type(a.atttypid, a.atttypmod), a.attnotnull, {default}, {generated}
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE c.relkind IN ('r', 'v', 'm', 'p', 'f')
+      AND n.nspname <> 'pg_toast' AND n.nspname NOT LIKE 'pg\\_temp\\_%' AND n.nspname NOT LIKE 'pg\\_toast\\_temp\\_%'
+    ORDER BY n.nspname, c.relname, a.attnum
+"""
+
+QUERY_INDEXES = """
+    SELECT n.nspname::text, c.relname::text, i.relname::text, x.indisunique, x.indisprimary,
+           array(SELECT a.attname::text
+                 FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+                 JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+                 ORDER BY k.position)
+    FROM pg_index x
+    JOIN pg_class c ON c.oid = x.indrelid
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname <> 'pg_toast' AND n.nspname NOT LIKE 'pg\\_temp\\_%' AND n.nspname NOT LIKE 'pg\\_toast\\_temp\\_%'
+    ORDER BY n.nspname, c.relname, i.relname
+"""
+
+# Event trigger that notifies all p2rest workers about DDL statements. Needs to be installed by a superuser
+EVENT_TRIGGER = """
+    CREATE OR REPLACE FUNCTION public.p2rest_notify_ddl() RETURNS event_trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_notify('{channel}', tg_tag);
+    END;
+    $$;
+    DROP EVENT TRIGGER IF EXISTS p2rest_notify_ddl;
+    CREATE EVENT TRIGGER p2rest_notify_ddl ON ddl_command_end EXECUTE PROCEDURE public.p2rest_notify_ddl();
+"""
+
+IDENTIFIER = re.compile(r'^(?:[A-Za-z_][A-Za-z0-9_$]*|"(?:[^"]|"")+")$')
+
+
+def get_columns_query(server_version):
+    """
+    Returns the query of the columns for a server version. Identity columns (attidentity) exist since postgres 10,
+    generated columns (attgenerated) since postgres 12
+    :param server_version: The version as returned by connection.server_version, e.g. 120004
+    :return: The query
+    """
+    default = "a.atthasdef OR a.attidentity <> ''" if server_version >= 100000 else 'a.atthasdef'
+    generated = "a.attgenerated <> ''" if server_version >= 120000 else 'false'
+    return QUERY_COLUMNS.format(default=default, generated=generated)
+
+
+def normalize_identifier(identifier):
+    """
+    Converts an identifier as it is written in a statement into the name stored in the catalog. Unquoted
+    identifiers are folded to lower case, quoted ones are taken as they are
+    :param identifier: The identifier
+    :return: The name in the catalog or None if the identifier is an expression and not a plain name
+    """
+    if not isinstance(identifier, str) or not IDENTIFIER.match(identifier):
+        return None
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier.lower()
+
+
+class CatalogSnapshot(object):
+    """
+    Metadata of the database at one point in time: schemata, relations with their columns and types, primary keys
+    and indexes
+    """
+
+    def __init__(self, schemata, relations):
+        """
+        :param schemata: Ordered dictionary of schema name to schema information
+        :param relations: Dictionary of (schema, relation) to relation information
+        """
+        self.schemata = schemata
+        self.relations = relations
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, connection):
+        """
+        Loads the catalog in bulk from pg_catalog
+        :param connection: The connection used for loading
+        :return: New snapshot
+        """
+        cursor = connection.cursor()
+        try:
+            cursor.execute(QUERY_SCHEMATA)
+            schemata = OrderedDict()
+            for catalog_name, schema_name, schema_owner in cursor.fetchall():
+                # same fields as information_schema.schemata
+                schemata[schema_name] = OrderedDict([
+                    ('catalog_name', catalog_name),
+                    ('schema_name', schema_name),
+                    ('schema_owner', schema_owner),
+                    ('default_character_set_catalog', None),
+                    ('default_character_set_schema', None),
+                    ('default_character_set_name', None),
+                    ('sql_path', None)
+                ])
+
+            relations = {}
+            cursor.execute(get_columns_query(connection.server_version))
+            for schema, name, kind, column, type_oid, type_name, not_null, default, generated in cursor.fetchall():
+                relation = relations.get((schema, name))
+                if relation is None:
+                    relation = {'schema': schema, 'name': name, 'kind': kind, 'columns': OrderedDict(),
+                                'primary_key': [], 'indexes': []}
+                    relations[(schema, name)] = relation
+                if column is not None:
+                    relation['columns'][column] = {'name': column, 'type': type_name, 'type_oid': type_oid,
+                                                   'nullable': not not_null, 'default': bool(default),
+                                                   'generated': bool(generated)}
+
+            cursor.execute(QUERY_INDEXES)
+            for schema, name, index, unique, primary, columns in cursor.fetchall():
+                relation = relations.get((schema, name))
+                if relation is None:
+                    continue
+                relation['indexes'].append({'name': index, 'columns': columns, 'unique': unique,
+                                            'primary': primary})
+                if primary:
+                    relation['primary_key'] = columns
+        finally:
+            cursor.close()
+        return cls(schemata, relations)
+
+    def get_relation(self, schema, relation):
+        """
+        Returns the information about a table or view
+        :param schema: Schema name as written in a statement
+        :param relation: Relation name as written in a statement
+        :return: Dictionary with the relation information or None if it does not exist
+        """
+        return self.relations.get((normalize_identifier(schema), normalize_identifier(relation)))
+
+
+class CatalogCache(object):
+    """
+    In process cache of the database catalog. The catalog is loaded on first use and whenever it was invalidated.
+    Invalidation happens after a time to live, after DDL statements of this service and, if the event trigger is
+    installed in the database, through a NOTIFY that is received by a listener thread in every worker process.
+    """
+
+    def __init__(self, pool, ttl=300, listen=True, channel='p2rest_catalog', refresh_interval=1):
+        """
+        Create a new catalog cache
+        :param pool: The connection pool used for loading the catalog
+        :param ttl: Seconds after which the catalog is loaded again. 0 disables it
+        :param listen: Start a thread that listens for notifications of the event trigger
+        :param channel: The channel of the notifications
+        :param refresh_interval: Minimum seconds between two loads caused by unknown relations or columns
+        """
+        self.pool = pool
+        self.ttl = ttl
+        self.listen = listen
+        self.channel = channel
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+        self._listener = None
+        self._listener_pid = None
+        self._handlers = {channel: [lambda payload: self.invalidate()]}
+        self.loads = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_config(cls, pool, config):
+        """
+        Creates a catalog cache from the flask configuration
+        """
+        return cls(pool,
+                   ttl=config['P2REST_CATALOG_TTL'],
+                   listen=config['P2REST_CATALOG_LISTEN'],
+                   channel=config['P2REST_CATALOG_CHANNEL'],
+                   refresh_interval=config['P2REST_CATALOG_REFRESH_INTERVAL'])
+
+    def get(self):
+        """
+        Returns the current catalog snapshot, loads it if necessary
+        :return: CatalogSnapshot
+        """
+        self._start_listener()
+        snapshot = self._snapshot
+        if snapshot is not None and (not self.ttl or time.monotonic() - snapshot.loaded_at < self.ttl):
+            return snapshot
+        return self._load(snapshot)
+
+    def refresh(self):
+        """
+        Loads the catalog from the database
+        :return: CatalogSnapshot
+        """
+        return self._load(self._snapshot)
+
+    def _load(self, current):
+        """
+        Loads the catalog unless another thread replaced the given snapshot in the meantime
+        :param current: The snapshot that shall be replaced
+        :return: CatalogSnapshot
+        """
+        with self._lock:
+            if self._snapshot is not None and self._snapshot is not current:
+                return self._snapshot
+            version = self._version
+            logging.debug('Loading catalog from host: %s, port: %s', self.pool.host, str(self.pool.port))
+            try:
+                with self.pool.connection() as connection:
+                    snapshot = CatalogSnapshot.load(connection)
+            except psycopg2.Error as error:
+                logging.error('We could not load the catalog: %s', str(error.args))
+                raise error
+            self.loads += 1
+            # an invalidation during the load means the snapshot may already be outdated, so it is not kept
+            if version == self._version:
+                self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self):
+        """
+        Drops the current snapshot, the next access loads the catalog again
+        """
+        self._version += 1
+        self._snapshot = None
+        self.invalidations += 1
+
+    def get_schemata(self):
+        """
+        :return: List of the information of all schemata
+        """
+        return list(self.get().schemata.values())
+
+    def get_schema(self, schema):
+        """
+        Returns the information about a schema. If the schema is not known, the catalog is loaded again (at most once
+        per refresh_interval)
+        :param schema: The schema name
+        :return: The information about a schema or None if it does not exist
+        """
+        snapshot = self.get()
+        result = snapshot.schemata.get(schema)
+        if result is None and time.monotonic() - snapshot.loaded_at >= self.refresh_interval:
+            result = self.refresh().schemata.get(schema)
+        return result
+
+    def get_relation(self, schema, relation, columns=()):
+        """
+        Returns the information about a relation. If the relation or one of the columns is not known, the catalog is
+        loaded again (at most once per refresh_interval), because it may have been created after the last load
+        :param schema: Schema name as written in a statement
+        :param relation: Relation name as written in a statement
+        :param columns: Names of columns that have to exist
+        :return: Dictionary with the relation information or None if it does not exist
+        """
+        snapshot = self.get()
+        result = snapshot.get_relation(schema, relation)
+        if (result is None or self.find_unknown_columns(result, columns)) and \
+                time.monotonic() - snapshot.loaded_at >= self.refresh_interval:
+            result = self.refresh().get_relation(schema, relation)
+        return result
+
+    @classmethod
+    def find_unknown_columns(cls, relation, columns):
+        """
+        :param relation: Relation information
+        :param columns: Column names as written in a statement. Expressions are ignored
+        :return: List of the columns that do not exist in the relation
+        """
+        unknown = []
+        for column in columns:
+            name = normalize_identifier(column)
+            if name is not None and name not in relation['columns']:
+                unknown.append(column)
+        return unknown
+
+    def stats(self):
+        """
+        Returns information about the state of the cache
+        :return: dictionary with the cache statistics
+        """
+        snapshot = self._snapshot
+        return {
+            'loaded': snapshot is not None,
+            'age': time.monotonic() - snapshot.loaded_at if snapshot else None,
+            'relations': len(snapshot.relations) if snapshot else 0,
+            'loads': self.loads,
+            'invalidations': self.invalidations,
+            'listening': self._listener is not None and self._listener.is_alive()
+        }
+
+    def subscribe(self, channel, handler):
+        """
+        Registers a handler for the notifications of a channel. The listener thread calls it with the payload of
+        every notification and with None after it (re)connected, because notifications may have been missed while it
+        was not connected. Handlers have to be registered before the listener is started
+        :param channel: The notification channel
+        :param handler: Function that takes the payload
+        """
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def channels(self):
+        """
+        Returns the channels handlers are registered for, the channel of the catalog first
+        """
+        return list(self._handlers)
+
+    def handlers(self, channel):
+        """
+        Returns the handlers registered for the notifications of a channel
+        """
+        return list(self._handlers.get(channel, ()))
+
+    def _start_listener(self):
+        """
+        Starts the listener thread once per process
+        """
+        if not self.listen or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._listener = CatalogListener(self)
+            self._listener.start()
+
+    def stop_listener(self):
+        """
+        Stops the listener thread of this process
+        """
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._listener_pid = None
+
+    def install_event_trigger(self):
+        """
+        Installs the event trigger that notifies the listeners about DDL statements. Needs superuser privileges
+        """
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(EVENT_TRIGGER.format(channel=self.channel))
+            connection.commit()
+            cursor.close()
+
+
+class CatalogListener(threading.Thread):
+    """
+    Thread that listens for notifications of the event trigger and invalidates the catalog cache. Notifications of
+    channels other caches subscribed to are passed on to their handlers. It uses its own connection, which is opened
+    again after errors.
+    """
+
+    def __init__(self, catalog, timeout=5, retry_interval=10):
+        super().__init__(name='p2rest-catalog-listener', daemon=True)
+        self.catalog = catalog
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+        self.join(self.timeout + 1)
+
+    def notify(self, channel, payload):
+        for handler in self.catalog.handlers(channel):
+            try:
+                handler(payload)
+            except Exception as error:
+                logging.error('Handler for notifications on %s failed: %s', channel, str(error.args))
+
+    def run(self):
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self.catalog.pool.connect()
+                connection.autocommit = True
+                cursor = connection.cursor()
+                channels = self.catalog.channels()
+                for channel in channels:
+                    cursor.execute('LISTEN "{channel}"'.format(channel=channel.replace('"', '""')))
+                # notifications may have been missed while we were not connected
+                for channel in channels:
+                    self.notify(channel, None)
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], self.timeout) == ([], [], []):
+                        continue
+                    connection.poll()
+                    notifies = connection.notifies[:]
+                    del connection.notifies[:]
+                    for notify in notifies:
+                        logging.debug('Notification on %s: %s', notify.channel, notify.payload)
+                        self.notify(notify.channel, notify.payload)
+            except (psycopg2.Error, OSError) as error:
+                logging.warning('Catalog listener lost its connection: %s', str(error.args))
+                self._stopped.wait(self.retry_interval)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+def init_catalog(app, pool):
+    """
+    Creates the catalog cache of the application. The cache can be retrieved later with get_catalog
+    :param app: The flask application
+    :param pool: The connection pool used for loading the catalog
+    :return: The new catalog cache
+    """
+    catalog = CatalogCache.from_config(pool, app.config)
+    app.extensions['p2rest_catalog'] = catalog
+    return catalog
+
+
+def get_catalog(app=None):
+    """
+    Returns the catalog cache of the given or current flask application
+    """
+    if app is None:
+        app = current_app
+    return app.extensions['p2rest_catalog']
@@ -0,0 +1,197 @@
+import base64
+import datetime
+import decimal
+import uuid
+
+from p2rest.src import metrics, timing
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def convert_timestamp(value):
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def convert_isoformat(value):
+    return value.isoformat()
+
+
+def convert_str(value):
+    return str(value)
+
+
+def convert_numeric(value):
+    # a float only keeps about 17 significant digits, the string keeps all digits of the numeric
+    return str(value)
+
+
+def convert_bytea(value):
+    return base64.b64encode(value).decode()
+
+
+def convert_value(value):
+    """
+    Generic converter for columns of a type we do not know. Checks the python type of every value
+    """
+    if isinstance(value, datetime.datetime):
+        return convert_timestamp(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return convert_isoformat(value)
+    if isinstance(value, (datetime.timedelta, uuid.UUID)):
+        return convert_str(value)
+    if isinstance(value, decimal.Decimal):
+        return convert_numeric(value)
+    if isinstance(value, (memoryview, bytes)):
+        return convert_bytea(value)
+    if isinstance(value, list):
+        return [None if item is None else convert_value(item) for item in value]
+    return value
+
+
+def array_converter(converter):
+    """
+    Creates a converter for an array column from the converter of its elements. Arrays can be nested
+    """
+    def convert_array(value):
+        return [None if item is None else (convert_array(item) if isinstance(item, list) else converter(item))
+                for item in value]
+    return convert_array
+
+
+# Type oids of columns whose values are returned by psycopg2 as json serializable python objects
+PASSTHROUGH_TYPES = {
+    16,  # bool
+    18,  # char
+    19,  # name
+    20,  # int8
+    21,  # int2
+    23,  # int4
+    25,  # text
+    26,  # oid
+    114,  # json
+    142,  # xml
+    650,  # cidr
+    700,  # float4
+    701,  # float8
+    790,  # money
+    869,  # inet
+    1042,  # bpchar
+    1043,  # varchar
+    3802,  # jsonb
+    1000, 1002, 1003, 1005, 1007, 1009, 1014, 1015, 1016, 1021, 1022, 199, 3807,  # arrays of the types above
+}
+
+# Type oids of columns that need a conversion and the converter used for them
+CONVERTERS = {
+    17: convert_bytea,
+    1082: convert_isoformat,  # date
+    1083: convert_isoformat,  # time
+    1114: convert_timestamp,  # timestamp
+    1184: convert_timestamp,  # timestamptz
+    1186: convert_str,  # interval
+    1266: convert_isoformat,  # timetz
+    1700: convert_numeric,  # numeric
+    2950: convert_str,  # uuid
+    1001: array_converter(convert_bytea),
+    1182: array_converter(convert_isoformat),
+    1183: array_converter(convert_isoformat),
+    1115: array_converter(convert_timestamp),
+    1185: array_converter(convert_timestamp),
+    1187: array_converter(convert_str),
+    1270: array_converter(convert_isoformat),
+    1231: array_converter(convert_numeric),
+    2951: array_converter(convert_str),
+}
+
+
+class RowConverter(object):
+    """
+    Converts the rows of one result into json serializable values. The conversion plan is built once per result from
+    the type oids in the cursor description: columns that need no conversion are passed through untouched, known
+    types get a dedicated converter and only columns of unknown types are checked value by value.
+    """
+
+    def __init__(self, columns):
+        """
+        Build the conversion plan
+        :param columns: The cursor description of the result
+        """
+        self.names = [column.name for column in columns]
+        self.converters = []
+        for index, column in enumerate(columns):
+            if column.type_code in PASSTHROUGH_TYPES:
+                continue
+            self.converters.append((index, CONVERTERS.get(column.type_code, convert_value)))
+
+    def convert_row(self, row):
+        """
+        Converts a single row into a list of values
+        :param row: Tuple returned by the cursor
+        :return: list of converted values
+        """
+        values = list(row)
+        for index, converter in self.converters:
+            value = values[index]
+            if value is not None:
+                values[index] = converter(value)
+        return values
+
+    def to_dicts(self, rows):
+        """
+        Converts the rows into dictionaries with the column names as keys
+        :param rows: List of tuples returned by the cursor
+        :return: List of dictionaries
+        """
+        names = self.names
+        if not self.converters:
+            return [dict(zip(names, row)) for row in rows]
+        convert_row = self.convert_row
+        return [dict(zip(names, convert_row(row))) for row in rows]
+
+    def to_lists(self, rows):
+        """
+        Converts the rows into lists of values in the order of the columns (compact form)
+        :param rows: List of tuples returned by the cursor
+        :return: List of lists
+        """
+        if not self.converters:
+            return [list(row) for row in rows]
+        convert_row = self.convert_row
+        return [convert_row(row) for row in rows]
+
+    def convert(self, rows, compact=False):
+        """
+        Converts the rows either into dictionaries or into the compact form
+        """
+        metrics.count_rows(len(rows))
+        with timing.span('convert'):
+            return self.to_lists(rows) if compact else self.to_dicts(rows)
+
+
+class RenderedRows(object):
+    """
+    Result of a select that was rendered to json by the database. The json text is kept as bytes and written to the
+    response without decoding it
+    """
+
+    def __init__(self, data, count):
+        """
+        :param data: The json array with all rows as bytes
+        :param count: Amount of rows in the array
+        """
+        self.data = data
+        self.count = count
+
+
+class CountedRows(object):
+    """
+    Result of a select together with the total amount of rows that match its filter, ignoring limit and offset
+    """
+
+    def __init__(self, data, total):
+        """
+        :param data: The result of the select as returned without a total
+        :param total: The total amount of rows, estimated if the estimate strategy was used
+        """
+        self.data = data
+        self.total = total
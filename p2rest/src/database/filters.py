@@ -0,0 +1,148 @@
+import json
+from werkzeug.exceptions import BadRequest
+
+# operators of the filter leaves
+COMPARISON_OPERATORS = ('=', '<', '>', '<=', '>=', '!=', '<>', 'like', 'ilike')
+LIST_OPERATORS = ('in', 'not in')
+RANGE_OPERATORS = ('between',)
+NULL_OPERATORS = ('is null', 'is not null')
+LEAF_OPERATORS = COMPARISON_OPERATORS + LIST_OPERATORS + RANGE_OPERATORS + NULL_OPERATORS
+
+# leaves of one column that are merged into a list leaf within a logical node: equalities joined by or become "in",
+# inequalities joined by and become "not in"
+MERGED_OPERATORS = {
+    'or': (('=', 'in'), 'in'),
+    'and': (('!=', '<>', 'not in'), 'not in'),
+}
+
+
+def _key(node):
+    """
+    Returns a key of a node or value that is equal for equal nodes, regardless of the order of their keys
+    """
+    return json.dumps(node, sort_keys=True, default=str)
+
+
+def _unique(items):
+    """
+    Removes duplicates from a list, keeping the first occurrence
+    """
+    seen = set()
+    result = []
+    for item in items:
+        key = _key(item)
+        if key not in seen:
+            seen.add(key)
+            result.append(item)
+    return result
+
+
+def _is_logical(node, operator):
+    """
+    True if the node is a valid and / or node with the given operator
+    """
+    return isinstance(node, dict) and 'column' not in node and node.get('operator') == operator and \
+        isinstance(node.get('childs'), list) and len(node['childs']) >= 2
+
+
+def _merge_leaves(children, operator):
+    """
+    Merges the equalities (or) or inequalities (and) of one column into a single list leaf
+    :param children: The children of a logical node
+    :param operator: 'and' or 'or'
+    :return: The children with the merged leaves at the position of the first leaf of their column
+    """
+    operators, merged_operator = MERGED_OPERATORS[operator]
+    groups = {}
+    for child in children:
+        if isinstance(child, dict) and child.get('operator') in operators and isinstance(child.get('column'), str) \
+                and 'value' in child:
+            values = child['value'] if child['operator'] in LIST_OPERATORS else [child['value']]
+            if not isinstance(values, list) or any(isinstance(value, (list, dict)) for value in values):
+                continue
+            groups.setdefault(child['column'], []).append((child, values))
+
+    result = []
+    for child in children:
+        column = child.get('column') if isinstance(child, dict) else None
+        group = groups.get(column) if isinstance(column, str) else None
+        if group is None or len(group) < 2 or not any(child is leaf for leaf, _ in group):
+            result.append(child)
+            continue
+        if child is group[0][0]:
+            values = _unique([value for _, leaf_values in group for value in leaf_values])
+            result.append({'column': column, 'operator': merged_operator, 'value': values})
+    return result
+
+
+def optimize_filter(node):
+    """
+    Simplifies a json filter before it is compiled: nested and / or nodes are flattened, duplicate predicates are
+    removed and the equalities of one column within an or node are merged into one "in" leaf (the inequalities
+    within an and node into one "not in" leaf), which is compiled to a single "= ANY" predicate with one array
+    parameter. Invalid nodes are kept as they are, so the compilation reports them.
+    :param node: json object representing the filter
+    :return: The optimized filter, the given one is not modified
+    """
+    if not isinstance(node, dict) or 'column' in node:
+        return node
+    operator = node.get('operator')
+    children = node.get('childs')
+    if operator == 'not' and isinstance(children, list) and len(children) == 1:
+        return dict(node, childs=[optimize_filter(children[0])])
+    if not _is_logical(node, operator) or operator not in MERGED_OPERATORS:
+        return node
+
+    flattened = []
+    for child in children:
+        child = optimize_filter(child)
+        if _is_logical(child, operator):
+            flattened.extend(child['childs'])
+        else:
+            flattened.append(child)
+    optimized = _unique(_merge_leaves(_unique(flattened), operator))
+    if len(optimized) == 1:
+        return optimized[0]
+    return {'operator': operator, 'childs': optimized}
+
+
+def array_literal(values):
+    """
+    Writes a list of filter values as postgres array literal ('{"BMW","VW"}'). The literal is sent as a parameter of
+    unknown type, so postgres reads it as an array of the column's type
+    :param values: List of strings, numbers, booleans or None
+    :return: The array literal
+    """
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append('NULL')
+        elif isinstance(value, bool):
+            elements.append('true' if value else 'false')
+        elif isinstance(value, (int, float)):
+            elements.append(repr(value))
+        elif isinstance(value, str):
+            elements.append('"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"')
+        else:
+            raise BadRequest('Invalid value in list: {}'.format(json.dumps(value, default=str)))
+    return '{' + ','.join(elements) + '}'
+
+
+def filter_columns(node, conjunctive=False):
+    """
+    Returns the columns of the leaves of a filter together with their operators
+    :param node: json object representing the filter
+    :param conjunctive: Only the leaves that every matching row satisfies, i.e. the ones that are not below an or or
+                        a not node
+    :return: List of tuples of the column as written in the filter and the operator, in the order of the leaves
+    """
+    if not isinstance(node, dict):
+        return []
+    if 'column' in node:
+        return [(node['column'], node.get('operator'))] if isinstance(node['column'], str) else []
+    if conjunctive and node.get('operator') != 'and':
+        return []
+    columns = []
+    for child in node.get('childs') or []:
+        columns.extend(filter_columns(child, conjunctive))
+    return columns
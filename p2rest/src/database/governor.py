@@ -0,0 +1,235 @@
+import logging
+import threading
+from flask import current_app
+from werkzeug.exceptions import BadRequest, ServiceUnavailable
+from p2rest.src.database.catalog import normalize_identifier
+from p2rest.src.database.results import split_relation
+
+# sqlstates of statements cancelled by statement_timeout and lock_timeout
+QUERY_CANCELED = '57014'
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def parse_timeouts(value):
+    """
+    Parses the timeouts of single relations
+    :param value: Either a dictionary of "schema.relation" to the statement timeout in milliseconds (or a list of
+                  statement and lock timeout) or a comma separated string of "schema.relation=statement_timeout" or
+                  "schema.relation=statement_timeout:lock_timeout"
+    :return: Dictionary of (schema, relation) to a tuple of statement and lock timeout, None keeps the default
+    """
+    if isinstance(value, dict):
+        items = [(name, timeouts if isinstance(timeouts, (list, tuple)) else [timeouts])
+                 for name, timeouts in value.items()]
+    else:
+        items = []
+        for item in (value or '').split(','):
+            if not item.strip():
+                continue
+            name, _, timeouts = item.partition('=')
+            if not timeouts.strip():
+                raise ValueError('Missing timeout for relation {}'.format(name))
+            items.append((name, [part for part in timeouts.split(':')]))
+
+    relations = {}
+    for name, timeouts in items:
+        key = split_relation(name)
+        if key is None or not 1 <= len(timeouts) <= 2:
+            raise ValueError('Invalid relation timeout: {}'.format(name))
+        timeouts = [int(timeout) if str(timeout).strip() else None for timeout in timeouts]
+        relations[key] = (timeouts[0], timeouts[1] if len(timeouts) > 1 else None)
+    return relations
+
+
+class QueryGovernor(object):
+    """
+    Bounds the cost of the statements of a request. Every statement runs with statement_timeout and lock_timeout set
+    for its transaction only (SET LOCAL), with overrides per relation. Optionally the planner's estimate of the
+    statement is checked before it runs: statements above the maximum cost or rows are rejected, statements above the
+    queue cost wait for one of a few slots, so expensive queries can not occupy all connections of a worker.
+    """
+
+    def __init__(self, statement_timeout=0, lock_timeout=0, relations=None, max_cost=0, max_rows=0, queue_cost=0,
+                 queue_slots=1, queue_timeout=10):
+        """
+        Create a new governor
+        :param statement_timeout: Milliseconds after which a statement is cancelled. 0 keeps the server's setting
+        :param lock_timeout: Milliseconds a statement waits for a lock. 0 keeps the server's setting
+        :param relations: Dictionary of (schema, relation) to a tuple of statement and lock timeout, see parse_timeouts
+        :param max_cost: Estimated total cost above which a statement is rejected. 0 disables it
+        :param max_rows: Estimated rows above which a statement is rejected. 0 disables it
+        :param queue_cost: Estimated total cost above which a statement needs a queue slot. 0 disables it
+        :param queue_slots: Amount of statements above the queue cost that run at the same time
+        :param queue_timeout: Seconds a statement waits for a queue slot
+        """
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        self.relations = relations or {}
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.queue_cost = queue_cost
+        self.queue_slots = queue_slots
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(queue_slots)
+
+        self._lock = threading.Lock()
+        self.explained = 0
+        self.rejected = 0
+        self.queued = 0
+        self.queue_timeouts = 0
+        self.cancelled = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Creates a governor from the flask configuration
+        """
+        return cls(statement_timeout=config['P2REST_STATEMENT_TIMEOUT'],
+                   lock_timeout=config['P2REST_LOCK_TIMEOUT'],
+                   relations=parse_timeouts(config['P2REST_RELATION_TIMEOUTS']),
+                   max_cost=config['P2REST_GOVERNOR_MAX_COST'],
+                   max_rows=config['P2REST_GOVERNOR_MAX_ROWS'],
+                   queue_cost=config['P2REST_GOVERNOR_QUEUE_COST'],
+                   queue_slots=config['P2REST_GOVERNOR_QUEUE_SLOTS'],
+                   queue_timeout=config['P2REST_GOVERNOR_QUEUE_TIMEOUT'])
+
+    @property
+    def explain(self):
+        """
+        True if the statements are checked with EXPLAIN before they run
+        """
+        return bool(self.max_cost or self.max_rows or self.queue_cost)
+
+    def timeouts(self, schema, relation):
+        """
+        Returns the statement and lock timeout in milliseconds for statements on a relation, 0 keeps the server's
+        setting
+        """
+        statement_timeout, lock_timeout = self.relations.get(
+            (normalize_identifier(schema), normalize_identifier(relation)), (None, None))
+        return (self.statement_timeout if statement_timeout is None else statement_timeout,
+                self.lock_timeout if lock_timeout is None else lock_timeout)
+
+    def apply(self, cursor, schema, relation):
+        """
+        Sets the timeouts for the current transaction of the cursor. Timeouts of 0 are reset to the server's setting,
+        so a transaction that is reused for several relations does not keep the override of a previous one
+        """
+        if not (self.statement_timeout or self.lock_timeout or self.relations):
+            return
+        cursor.execute('; '.join('SET LOCAL {name} = {value}'.format(
+            name=name, value="'{}ms'".format(int(value)) if value else 'DEFAULT')
+            for name, value in zip(('statement_timeout', 'lock_timeout'), self.timeouts(schema, relation))))
+
+    def estimate(self, cursor, query, params):
+        """
+        Returns the planner's estimate of a statement
+        :return: Tuple of the total cost and the rows
+        """
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+        plan = cursor.fetchone()[0][0]['Plan']
+        with self._lock:
+            self.explained += 1
+        return plan['Total Cost'], plan['Plan Rows']
+
+    def admit(self, cursor, schema, relation, query, params):
+        """
+        Sets the timeouts and checks the estimate of a statement before it runs
+        :param cursor: The cursor the statement will run on, in the transaction it will run in
+        :param schema: The schema of the relation
+        :param relation: The relation the statement reads
+        :param query: The statement with placeholders
+        :param params: The values of the placeholders
+        :return: Function that has to be called once the statement has finished
+        :raises BadRequest: if the estimate exceeds the maximum cost or rows
+        :raises ServiceUnavailable: if no queue slot was available in time
+        """
+        self.apply(cursor, schema, relation)
+        if not self.explain:
+            return release_nothing
+        cost, rows = self.estimate(cursor, query, params)
+        details = {'estimated_cost': cost, 'estimated_rows': rows, 'max_cost': self.max_cost,
+                   'max_rows': self.max_rows}
+        if (self.max_cost and cost > self.max_cost) or (self.max_rows and rows > self.max_rows):
+            with self._lock:
+                self.rejected += 1
+            error = BadRequest('The query is too expensive (estimated cost {:.0f}, estimated rows {}). Add a filter '
+                               'on an indexed column or lower the limit.'.format(cost, rows))
+            error.details = details
+            raise error
+        if not self.queue_cost or cost <= self.queue_cost:
+            return release_nothing
+
+        with self._lock:
+            self.queued += 1
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.queue_timeouts += 1
+            error = ServiceUnavailable('Too many expensive queries, no slot became available within {} seconds.'
+                                       .format(self.queue_timeout))
+            error.details = details
+            error.retry_after = max(1, int(self.queue_timeout))
+            raise error
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                self._slots.release()
+        return release
+
+    def translate(self, error, schema, relation):
+        """
+        Converts errors of statements cancelled by the timeouts into a ServiceUnavailable, other errors are returned
+        as they are
+        :param error: A psycopg2 error
+        :return: The error that should be raised
+        """
+        code = getattr(error, 'pgcode', None)
+        if code not in (QUERY_CANCELED, LOCK_NOT_AVAILABLE):
+            return error
+        with self._lock:
+            self.cancelled += 1
+        statement_timeout, lock_timeout = self.timeouts(schema, relation)
+        if code == LOCK_NOT_AVAILABLE:
+            exception = ServiceUnavailable('The query waited longer than {} ms for a lock.'.format(lock_timeout))
+        else:
+            exception = ServiceUnavailable('The query was cancelled after the statement timeout of {} ms.'
+                                           .format(statement_timeout))
+        exception.details = {'statement_timeout': statement_timeout, 'lock_timeout': lock_timeout}
+        exception.__cause__ = error
+        logging.warning('Query on %s.%s cancelled: %s', schema, relation, str(error.args))
+        return exception
+
+    def stats(self):
+        """
+        Returns the amount of explained, rejected, queued and cancelled statements
+        """
+        return {'explained': self.explained, 'rejected': self.rejected, 'queued': self.queued,
+                'queue_timeouts': self.queue_timeouts, 'cancelled': self.cancelled}
+
+
+def release_nothing():
+    """
+    Release function of statements that did not need a queue slot
+    """
+
+
+def init_governor(app):
+    """
+    Creates the query governor of the application. The governor can be retrieved later with get_governor
+    :param app: The flask application
+    :return: The new governor
+    """
+    governor = QueryGovernor.from_config(app.config)
+    app.extensions['p2rest_governor'] = governor
+    return governor
+
+
+def get_governor(app=None):
+    """
+    Returns the query governor of the given or current flask application
+    """
+    if app is None:
+        app = current_app
+    return app.extensions['p2rest_governor']
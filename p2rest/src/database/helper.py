@@ -1,7 +1,21 @@
 import psycopg2
 import logging
-import datetime
+import json
+import base64
+import binascii
 from werkzeug.exceptions import BadRequest
+from .converters import RowConverter
+from .catalog import normalize_identifier
+from .filters import optimize_filter, array_literal, LEAF_OPERATORS, LIST_OPERATORS, NULL_OPERATORS
+
+# Aggregate functions of POST /query/aggregate and the expression they are compiled to
+AGGREGATE_FUNCTIONS = {
+    'count': 'count({})',
+    'sum': 'sum({})',
+    'min': 'min({})',
+    'max': 'max({})',
+    'avg': 'avg({})'
+}
 
 
 class PostgresHelper(object):
@@ -10,96 +24,153 @@ class PostgresHelper(object):
     """
 
     @classmethod
-    def CheckConnection(cls, host, port, dbname, user, password) -> bool:
+    def CheckConnection(cls, pool) -> bool:
         """
         Check if we can connect to the database
-        :param host: The host ip or dns name for our connection
-        :param port: Database servers port
-        :param dbname: The database name we want to connect to
-        :param user: The db user for connecting
-        :param password: The db users password for connecting
+        :param pool: The connection pool that is checked. A connection is taken from the pool and a simple query
+                     is executed
         :return: boolean indicating if we can connect (true) or not (false)
         """
         connection_available = True
-        logging.debug('Check database connection for host: %s, port: %s', host, str(port))
+        logging.debug('Check database connection for host: %s, port: %s', pool.host, str(pool.port))
 
+        connection = None
         try:
-            connection = psycopg2.connect(host=host, port=port, dbname=dbname, user=user, password=password)
-            if connection:
-                connection.close()
-            else:
-                raise psycopg2.DatabaseError('Could not connect to the database')
+            connection = pool.getconn()
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
         except psycopg2.Error as error:
             logging.error('We could not connect to the database: %s', str(error.args))
             connection_available = False
+        finally:
+            if connection:
+                pool.putconn(connection)
 
         logging.debug('Database status is: %s', str(connection_available))
         return connection_available
 
     @classmethod
-    def ConvertPsycopg2Data(cls, data, columns):
+    def ConvertPsycopg2Data(cls, data, columns, compact=False):
         """
         Converts a psycopgs list of tuples into a dictionary representation
         :param data: The result data from the cursor fetch operation
         :param columns: Column description
-        :return: List of dictionary entries
-        """
-        result = []
-        for row in data:
-            entry = {}
-            for i in range(0, len(columns)):
-                if isinstance(row[i], datetime.datetime):
-                    entry[columns[i].name] = row[i].strftime('%Y-%m-%dT%H:%M:%S.%f')
-                elif isinstance(row[i], datetime.timedelta):
-                    entry[columns[i].name] = str(row[i])
-                else:
-                    entry[columns[i].name] = row[i]
-            result.append(entry)
-        return result
+        :param compact: If true the rows are returned as lists of values in the order of the columns
+        :return: List of dictionary entries (or lists of values)
+        """
+        return RowConverter(columns).convert(data, compact=compact)
 
     @classmethod
-    def convert_request_filter_to_string(cls, json_filter):
+    def convert_request_filter_to_string(cls, json_filter, columns=None, keyword='WHERE'):
         """
-        This method takes a json object representing a filter and constructs a postgres filter
-        expression for it
+        This method takes a json object representing a filter and constructs a parameterized postgres filter
+        expression for it. The values are not part of the expression, so all filters with the same structure result
+        in the same statement and postgres can reuse its plan. The filter is simplified with optimize_filter first
         :param json_filter: json object representing the filter
-        :return: postgres filter string
+        :param columns: Function returning the expression of a column name of the filter. It raises BadRequest for
+                        names that are not allowed. If None the column names are used as they are
+        :param keyword: The keyword the filter expression is prefixed with ('WHERE' or 'HAVING')
+        :return: postgres filter string with '%s' placeholders and the list of values for them
         """
-        result = ''
+        params = []
         if not json_filter or len(json_filter) == 0:
-            return result
+            return '', params
 
         try:
-            filter = json_filter
-            result = PostgresHelper._convert_request_filter_node(filter)
+            result = PostgresHelper._convert_request_filter_node(optimize_filter(json_filter), params, columns)
 
             if result and len(result) > 0:
-                return 'WHERE ' + result
+                return keyword + ' ' + result, params
             else:
-                return ''
+                return '', []
         except Exception as error:
             logging.error('Failed to parse json filter into postgres filter: %s', str(error.args))
             raise error
 
     @classmethod
-    def _convert_request_filter_node(cls, node):
+    def get_filter_columns(cls, json_filter):
+        """
+        Returns the names of all columns that are used in a json filter
+        :param json_filter: json object representing the filter
+        :return: list of column names
+        """
+        columns = []
+        nodes = [json_filter] if json_filter else []
+        while nodes:
+            node = nodes.pop()
+            if not isinstance(node, dict):
+                continue
+            if 'column' in node:
+                columns.append(node['column'])
+            nodes.extend(node.get('childs') or [])
+        return columns
+
+    @classmethod
+    def escape_identifier(cls, identifier):
+        """
+        Escapes percent signs in column names, so they are not taken for placeholders
+        """
+        return identifier.replace('%', '%%')
+
+    @classmethod
+    def quote_identifier(cls, name):
+        """
+        Quotes a name as it is stored in the catalog, so it can be used as identifier in a statement
+        """
+        return '"' + name.replace('"', '""') + '"'
+
+    @classmethod
+    def convert_filter_value(cls, value):
+        """
+        Converts the value of a filter leaf into a query parameter. Values used to be pasted into the statement, so
+        string values are often sent quoted ("'BMW'"). These quotes are removed.
+        :param value: The value of the filter node
+        :return: value for the query parameter
+        """
+        if isinstance(value, str) and len(value) >= 2 and value[0] == "'" and value[-1] == "'":
+            return value[1:-1].replace("''", "'")
+        return value
+
+    @classmethod
+    def _convert_request_filter_node(cls, node, params, columns=None):
         """
         Converts one json node into a filter expression part
-        :param node:
-        :return:
+        :param node: The json node
+        :param params: List the values of the node are appended to
+        :param columns: Function returning the expression of a column name, see convert_request_filter_to_string
+        :return: filter expression with placeholders
         """
         if 'column' in node.keys():
             # leaf node
             if 'operator' not in node.keys():
                 raise BadRequest('No operand specified for column {}'.format(node['column']))
-            if 'value' not in node.keys():
+            operator = node['operator']
+            if operator not in LEAF_OPERATORS:
+                raise BadRequest('Operator "{}" is not supported for columnd {}'.format(operator, node['column']))
+            if 'value' not in node.keys() and operator not in NULL_OPERATORS:
                 raise BadRequest('No value specified for column {}'.format(node['column']))
-            if node['operator'] not in ('=', '<', '>', '<=', '>=', '!=', '<>', 'like', 'ilike'):
-                raise BadRequest('Operator "{}" is not supported for columnd {}'.format(node['operator'],
-                                                                                        node['column']))
 
-            return "({column} {operator} {value})".format(column=node['column'], operator=node['operator'],
-                                                          value=node['value'])
+            column = PostgresHelper.escape_identifier(node['column']) if columns is None else columns(node['column'])
+            if operator in NULL_OPERATORS:
+                return "({column} {operator})".format(column=column, operator=operator.upper())
+            value = node['value']
+            if operator in LIST_OPERATORS:
+                if not isinstance(value, list) or not value:
+                    raise BadRequest('The value of operator "{}" for column {} must be a non-empty list'
+                                     .format(operator, node['column']))
+                # one array parameter, so lists of any length result in the same statement
+                params.append(array_literal([PostgresHelper.convert_filter_value(item) for item in value]))
+                return "({column} {comparison}(%s))".format(column=column,
+                                                            comparison='= ANY' if operator == 'in' else '<> ALL')
+            if operator == 'between':
+                if not isinstance(value, list) or len(value) != 2:
+                    raise BadRequest('The value of operator "between" for column {} must be a list of two values'
+                                     .format(node['column']))
+                params.extend(PostgresHelper.convert_filter_value(item) for item in value)
+                return "({column} BETWEEN %s AND %s)".format(column=column)
+            params.append(PostgresHelper.convert_filter_value(value))
+            return "({column} {operator} %s)".format(column=column, operator=operator)
         else:
             # logical node
             if 'operator' not in node.keys():
@@ -108,17 +179,19 @@ class PostgresHelper(object):
                 raise BadRequest('No child nodes specified for logical node')
 
             if node['operator'] == 'not':
-                if len(node['childs']) != 0:
+                if len(node['childs']) != 1:
                     raise BadRequest('For a logical not condition only one subexpression can be provided')
                 return "NOT ({expression})".format(expression=PostgresHelper
-                                                   ._convert_request_filter_node(node['childs'][0]))
+                                                   ._convert_request_filter_node(node['childs'][0], params,
+                                                                                 columns))
             if node['operator'] == 'and':
                 if len(node['childs']) < 2:
                     raise BadRequest('At least two sub expressions must be provided for a logical and')
                 temp = []
                 for sub_expression in node['childs']:
                     temp.append('{subexpression}'.format(subexpression=PostgresHelper
-                                                           ._convert_request_filter_node(sub_expression)))
+                                                           ._convert_request_filter_node(sub_expression, params,
+                                                                                         columns)))
                 return '({logicalexpression})'.format(logicalexpression=' and '.join(temp))
             if node['operator'] == 'or':
                 if len(node['childs']) < 2:
@@ -126,16 +199,138 @@ class PostgresHelper(object):
                 temp = []
                 for sub_expression in node['childs']:
                     temp.append('{subexpression}'.format(subexpression=PostgresHelper
-                                                           ._convert_request_filter_node(sub_expression)))
+                                                           ._convert_request_filter_node(sub_expression, params,
+                                                                                         columns)))
                 return '({logicalexpression})'.format(logicalexpression=' or '.join(temp))
+            raise BadRequest('Logical operator "{}" is not supported'.format(node['operator']))
 
     @classmethod
     def convert_order_by_to_string(cls, order_fields, order_type):
         """
-        Converts a list of fields tjat shall be used for ordering into a Postgres string
+        Converts a list of fields tjat shall be used for ordering into a Postgres string. The order type applies to
+        every field, like the row comparison of keyset pagination (see convert_keyset_to_string) expects
         :param order_fields:
         :param order_type:
         :return:
         """
         if order_fields and len(order_fields) > 0:
-            return 'ORDER BY {fields} {type}'.format(fields=', '.join(order_fields), type=order_type)
+            return 'ORDER BY {fields}'.format(fields=', '.join(
+                '{} {}'.format(PostgresHelper.resolve_column(field), order_type) for field in order_fields))
+        return ''
+
+    @classmethod
+    def convert_field_to_string(cls, field):
+        """
+        Converts a field of a select into a Postgres string. Column names are quoted, expressions (and *) are kept as
+        they are written
+        """
+        if normalize_identifier(field) is None:
+            return PostgresHelper.escape_identifier(field)
+        return PostgresHelper.resolve_column(field)
+
+    @classmethod
+    def resolve_column(cls, name):
+        """
+        Converts a column name as written in a statement into a quoted identifier. Unlike the fields of a select,
+        expressions are not allowed
+        :param name: The column name, unquoted names are folded to lower case
+        :return: The quoted identifier
+        """
+        identifier = normalize_identifier(name)
+        if identifier is None:
+            raise BadRequest('Invalid identifier: {}'.format(name))
+        return PostgresHelper.escape_identifier(PostgresHelper.quote_identifier(identifier))
+
+    @classmethod
+    def convert_aggregates_to_string(cls, group_by, aggregates):
+        """
+        Compiles the group by columns and the aggregates of POST /query/aggregate. All column names are quoted and
+        only the functions of AGGREGATE_FUNCTIONS are allowed, so nothing of the request is pasted into the statement
+        :param group_by: Names of the columns the rows are grouped by
+        :param aggregates: List of dictionaries with the function, the column ('*' for count only) and an optional
+                           alias. The alias defaults to function_column (function for count(*))
+        :return: The select list, the group by clause and a dictionary of the output names (group columns and aliases)
+                 to their expression, used for having and order by
+        """
+        outputs = {}
+        select = []
+        group = []
+        for name in group_by:
+            column = PostgresHelper.resolve_column(name)
+            if normalize_identifier(name) in outputs:
+                raise BadRequest('Column {} is grouped by more than once'.format(name))
+            outputs[normalize_identifier(name)] = column
+            select.append(column)
+            group.append(column)
+        for aggregate in aggregates:
+            function = str(aggregate.get('function', '')).lower()
+            if function not in AGGREGATE_FUNCTIONS:
+                raise BadRequest('Aggregate function "{}" is not supported. Must be one of {}'.format(
+                    aggregate.get('function'), ', '.join(sorted(AGGREGATE_FUNCTIONS))))
+            name = aggregate.get('column') or '*'
+            if name == '*':
+                if function != 'count':
+                    raise BadRequest('Only count can be used with *')
+                column = '*'
+                alias = aggregate.get('alias') or function
+            else:
+                column = PostgresHelper.resolve_column(name)
+                alias = aggregate.get('alias') or '{}_{}'.format(function, normalize_identifier(name))
+            if alias in outputs:
+                raise BadRequest('The output name {} is used more than once'.format(alias))
+            outputs[alias] = AGGREGATE_FUNCTIONS[function].format(column)
+            select.append('{} AS {}'.format(outputs[alias], PostgresHelper.quote_identifier(alias)))
+        if not select:
+            raise BadRequest('At least one group by column or aggregate has to be provided')
+        return ', '.join(select), 'GROUP BY ' + ', '.join(group) if group else '', outputs
+
+    @classmethod
+    def convert_keyset_to_string(cls, order_fields, order_type, values):
+        """
+        Builds the seek predicate for keyset pagination. Rows are compared as a whole with the values of the last row
+        of the previous page, e.g. (k1, k2) > (v1, v2). This allows postgres to use an index on the order fields
+        instead of reading and discarding all rows before the offset. The order fields must not be nullable, a
+        comparison with NULL is never true and would end the pagination early
+        :param order_fields: Fields that are used for ordering the result
+        :param order_type: 'asc' or 'desc'
+        :param values: Values of the order fields of the last row of the previous page
+        :return: postgres filter expression with placeholders and the list of values for them
+        """
+        if not order_fields or len(order_fields) != len(values):
+            raise BadRequest('The continuation token does not match the order fields')
+        return '({fields}) {operator} ({placeholders})'.format(
+            fields=', '.join(PostgresHelper.resolve_column(field) for field in order_fields),
+            operator='<' if order_type.lower() == 'desc' else '>',
+            placeholders=', '.join(['%s'] * len(values))), list(values)
+
+    @classmethod
+    def encode_continuation(cls, order_fields, order_type, row):
+        """
+        Creates an opaque continuation token from the order fields of the last returned row
+        :param order_fields: Fields that are used for ordering the result
+        :param order_type: 'asc' or 'desc'
+        :param row: The last row of the current page as dictionary, keyed by the column names of the result
+        :return: continuation token
+        """
+        values = [row[normalize_identifier(field) or field] for field in order_fields]
+        token = json.dumps({'fields': list(order_fields), 'type': order_type.lower(), 'values': values})
+        return base64.urlsafe_b64encode(token.encode()).decode()
+
+    @classmethod
+    def decode_continuation(cls, token, order_fields, order_type):
+        """
+        Reads the values of the last row of the previous page from a continuation token
+        :param token: The continuation token returned with the previous page
+        :param order_fields: Fields that are used for ordering the result
+        :param order_type: 'asc' or 'desc'
+        :return: List of values of the order fields
+        """
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            fields, type, values = data['fields'], data['type'], data['values']
+        except (ValueError, TypeError, KeyError, binascii.Error) as error:
+            logging.warning('Invalid continuation token: %s', str(error.args))
+            raise BadRequest('Invalid continuation token')
+        if fields != list(order_fields) or type != order_type.lower():
+            raise BadRequest('The continuation token was created for a different order')
+        return values
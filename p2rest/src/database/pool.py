@@ -0,0 +1,331 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from flask import current_app
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+from p2rest.src import timing
+from .statements import StatementCache
+
+
+class PooledConnection(object):
+    """
+    Book keeping information for one physical connection inside the pool
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool(object):
+    """
+    Per process pool of postgres connections that is shared by all threads of a worker.
+
+    Connections are opened lazily, so a pool that is created before gunicorn forks its workers does not hand out
+    sockets of the parent process. If the pool is used from another process than the one that opened its
+    connections, these connections are detached from their sockets and dropped (closing them would terminate the
+    session of the parent) and new ones are opened.
+    """
+
+    def __init__(self, host, port, dbname, user, password, min_size=1, max_size=10, idle_timeout=300,
+                 max_lifetime=3600, check_on_checkout=True, timeout=30, statement_cache_size=256,
+                 prepare_threshold=5):
+        """
+        Create a new connection pool
+        :param host: The host ip or dns name for our connection
+        :param port: Database servers port
+        :param dbname: The database name we want to connect to
+        :param user: The db user for connecting
+        :param password: The db users password for connecting
+        :param min_size: Amount of idle connections that are kept open even if they exceed the idle timeout
+        :param max_size: Maximum amount of connections (idle and in use) the pool opens
+        :param idle_timeout: Seconds after which an idle connection above min_size is closed. 0 disables it
+        :param max_lifetime: Seconds after which a connection is closed and replaced. 0 disables it
+        :param check_on_checkout: Run a 'SELECT 1' on an idle connection before handing it out
+        :param timeout: Seconds to wait for a free connection before a PoolError is raised
+        :param statement_cache_size: Amount of parameterized statements kept in the statement cache
+        :param prepare_threshold: Uses after which a statement is prepared on the connections. 0 disables it
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size: min_size={}, max_size={}'.format(min_size, max_size))
+
+        self.host = host
+        self.port = port
+        self.dbname = dbname
+        self.user = user
+        self.password = password
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.check_on_checkout = check_on_checkout
+        self.timeout = timeout
+        self.statements = StatementCache(max_size=statement_cache_size, prepare_threshold=prepare_threshold)
+
+        self._condition = threading.Condition(threading.Lock())
+        self._reset()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Creates a connection pool from the flask configuration
+        :param config: The flask config object (or any dictionary) containing the P2REST_DB_* settings
+        :param kwargs: Values that overwrite the ones from the configuration
+        :return: New connection pool
+        """
+        args = dict(host=config['P2REST_DB_HOST'],
+                    port=config['P2REST_DB_PORT'],
+                    dbname=config['P2REST_DB_NAME'],
+                    user=config['P2REST_DB_USER'],
+                    password=config['P2REST_DB_PASSWORD'],
+                    min_size=config['P2REST_DB_POOL_MIN_SIZE'],
+                    max_size=config['P2REST_DB_POOL_MAX_SIZE'],
+                    idle_timeout=config['P2REST_DB_POOL_IDLE_TIMEOUT'],
+                    max_lifetime=config['P2REST_DB_POOL_MAX_LIFETIME'],
+                    check_on_checkout=config['P2REST_DB_POOL_CHECK_ON_CHECKOUT'],
+                    timeout=config['P2REST_DB_POOL_TIMEOUT'],
+                    statement_cache_size=config['P2REST_STATEMENT_CACHE_SIZE'],
+                    prepare_threshold=config['P2REST_PREPARE_THRESHOLD'])
+        args.update(kwargs)
+        return cls(**args)
+
+    def _reset(self):
+        """
+        Forget about all connections. Used on creation and after a fork
+        """
+        self._pid = os.getpid()
+        self._idle = []
+        self._used = {}
+        self._connecting = 0
+        self._closed = False
+
+    def _check_pid(self):
+        """
+        Make sure that we never share connections with our parent process
+        """
+        if self._pid != os.getpid():
+            logging.debug('Connection pool used in new process %s, dropping inherited connections', os.getpid())
+            for entry in self._idle + list(self._used.values()):
+                self._detach(entry)
+            self._reset()
+
+    @staticmethod
+    def _detach(entry):
+        """
+        Replaces the socket of a connection inherited from the parent process with /dev/null in this process.
+        psycopg2 sends a terminate message when a connection is garbage collected, which would end the session the
+        parent still uses
+        """
+        if entry.connection.closed:
+            return
+        descriptor = os.open(os.devnull, os.O_RDWR)
+        try:
+            os.dup2(descriptor, entry.connection.fileno())
+        finally:
+            os.close(descriptor)
+
+    def _size(self):
+        return len(self._idle) + len(self._used) + self._connecting
+
+    def _is_expired(self, entry, now):
+        return bool(self.max_lifetime) and now - entry.created_at > self.max_lifetime
+
+    def _is_healthy(self, entry):
+        """
+        Checks if an idle connection can still be used
+        """
+        if entry.connection.closed:
+            return False
+        if not self.check_on_checkout:
+            return True
+        try:
+            cursor = entry.connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            entry.connection.rollback()
+            return True
+        except psycopg2.Error as error:
+            logging.warning('Discarding broken pooled connection: %s', str(error.args))
+            return False
+
+    @staticmethod
+    def _close(entry):
+        try:
+            entry.connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _evict_idle(self, now):
+        """
+        Close idle connections above min_size that have not been used for more than idle_timeout seconds
+        """
+        if not self.idle_timeout:
+            return
+        # the list is ordered from least to most recently used
+        while self._idle and self._size() > self.min_size and now - self._idle[0].last_used > self.idle_timeout:
+            self._close(self._idle.pop(0))
+
+    def connect(self):
+        """
+        Opens a new connection with the settings of the pool. The connection is not managed by the pool
+        :return: psycopg2 connection
+        """
+        return psycopg2.connect(host=self.host, port=self.port, dbname=self.dbname,
+                                user=self.user, password=self.password)
+
+    def _checkout(self, deadline):
+        """
+        Takes an idle connection or reserves a slot for a new one. Must not be called with the lock held
+        :param deadline: Point in time (monotonic clock) until we wait for a free connection
+        :return: Book keeping entry of an idle connection or None if a new connection shall be opened
+        """
+        with self._condition:
+            self._check_pid()
+            if self._closed:
+                raise PoolError('Connection pool is closed')
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                while self._idle:
+                    entry = self._idle.pop()
+                    if self._is_expired(entry, now) or entry.connection.closed:
+                        self._close(entry)
+                        continue
+                    self._used[id(entry.connection)] = entry
+                    return entry
+                if self._size() < self.max_size:
+                    self._connecting += 1
+                    return None
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise PoolError('Connection pool exhausted, no connection available after {} seconds'
+                                    .format(self.timeout))
+                self._condition.wait(remaining)
+
+    def getconn(self, timeout=None):
+        """
+        Get a connection from the pool. Blocks up to 'timeout' seconds if all connections are in use
+        :param timeout: Seconds to wait instead of the timeout of the pool, 0 raises a PoolError right away
+        :return: psycopg2 connection
+        """
+        with timing.span('connect'):
+            return self._getconn(timeout)
+
+    def _getconn(self, timeout):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            entry = self._checkout(deadline)
+            if entry is None:
+                break
+            # the health check is done outside of the lock, so a slow ping does not block other threads
+            if self._is_healthy(entry):
+                entry.last_used = time.monotonic()
+                return entry.connection
+            self.putconn(entry.connection, discard=True)
+
+        try:
+            connection = self.connect()
+        except psycopg2.Error:
+            with self._condition:
+                self._connecting -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._connecting -= 1
+            self._used[id(connection)] = PooledConnection(connection)
+        return connection
+
+    def putconn(self, connection, discard=False):
+        """
+        Return a connection to the pool. Open transactions are rolled back
+        :param connection: The connection that was retrieved with getconn
+        :param discard: If true the connection is closed instead of being reused
+        """
+        with self._condition:
+            entry = self._used.pop(id(connection), None)
+            if entry is None:
+                # connection of a parent process or from before the pool was closed
+                return
+            if not discard and not connection.closed:
+                try:
+                    if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+            now = time.monotonic()
+            if discard or self._closed or connection.closed or self._is_expired(entry, now):
+                self._close(entry)
+            else:
+                entry.last_used = now
+                self._idle.append(entry)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks out a connection and returns it to the pool afterwards. Connections that raised
+        an OperationalError or InterfaceError are discarded
+        """
+        connection = self.getconn()
+        discard = False
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(connection, discard=discard)
+
+    def closeall(self):
+        """
+        Close all idle connections and mark the pool as closed. Connections in use are closed when returned
+        """
+        with self._condition:
+            self._check_pid()
+            for entry in self._idle:
+                self._close(entry)
+            self._idle = []
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        Returns information about the current usage of the pool
+        :return: dictionary with the pool statistics
+        """
+        with self._condition:
+            self._check_pid()
+            return {
+                'size': self._size(),
+                'idle': len(self._idle),
+                'used': len(self._used) + self._connecting,
+                'min_size': self.min_size,
+                'max_size': self.max_size
+            }
+
+
+def init_pool(app):
+    """
+    Creates the connection pool of the application. The pool can be retrieved later with get_pool
+    :param app: The flask application
+    :return: The new connection pool
+    """
+    pool = ConnectionPool.from_config(app.config)
+    app.extensions['p2rest_pool'] = pool
+    return pool
+
+
+def get_pool(app=None):
+    """
+    Returns the connection pool of the given or current flask application
+    """
+    if app is None:
+        app = current_app
+    return app.extensions['p2rest_pool']
@@ -1,6 +1,37 @@
 import psycopg2
 import logging
+import threading
+from time import perf_counter
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+from werkzeug.exceptions import BadRequest, HTTPException
+from p2rest.src import metrics, timing
 from .helper import PostgresHelper
+from .catalog import normalize_identifier
+from .converters import RowConverter, RenderedRows, CountedRows
+from .bulk import CopyWriter, CopyStream
+from .governor import release_nothing
+from .analytics import count_result
+
+ENGINES = ('python', 'database')
+
+# statements used by the database rendering engine for building the json in postgres
+RENDER_QUERY = 'SELECT coalesce(json_agg(t), \'[]\')::text, count(*) FROM ({query}) t'
+RENDER_STREAM_QUERY = 'SELECT row_to_json(t)::text FROM ({query}) t'
+
+# strategies for counting the rows that match a filter
+COUNT_STRATEGIES = ('exact', 'estimate', 'inline')
+
+# row estimate of the statistics, scaled to the current size of the relation like the planner does. Views, never
+# analyzed tables (reltuples < 0) and partitioned tables have no usable estimate and return NULL
+QUERY_ESTIMATE_ROWS = """
+    SELECT CASE WHEN c.relkind NOT IN ('r', 'm') OR c.reltuples < 0 THEN NULL
+                WHEN c.relpages > 0 THEN c.reltuples / c.relpages *
+                    (pg_relation_size(c.oid) / current_setting('block_size')::int)
+                ELSE c.reltuples END
+    FROM pg_class c
+    WHERE c.oid = to_regclass(%s)
+"""
 
 
 class Postgres(object):
@@ -13,22 +44,22 @@ class Postgres(object):
         """
         Check if we can connect to the database
         """
-        logging.debug('Geting all available schemata for host: %s, port: %s', kwargs['host'], str(kwargs['port']))
+        logging.debug('Geting all available schemata for host: %s, port: %s', kwargs['pool'].host,
+                      str(kwargs['pool'].port))
 
         result = None
         connection = None
         cursor = None
 
         args = dict({'limit': 10000, 'offset': 0}, **kwargs)
-        if not {'host', 'port', 'dbname', 'user', 'password'} <= args.keys():
+        if not {'pool'} <= args.keys():
             raise ValueError('Missing required parameter for database connection')
 
         try:
-            connection = psycopg2.connect(host=args['host'], port=args['port'], dbname=args['dbname'],
-                                          user=args['user'], password=args['password'])
+            connection = args['pool'].getconn()
             cursor = connection.cursor()
-            cursor.execute('SELECT schema_name FROM information_schema.schemata LIMIT {limit} OFFSET {offset}'
-                           .format(limit=args['limit'], offset=args['offset']))
+            cursor.execute('SELECT schema_name FROM information_schema.schemata LIMIT %s OFFSET %s',
+                           (args['limit'], args['offset']))
             temp = cursor.fetchall()
             columns = cursor.description
             result = PostgresHelper.ConvertPsycopg2Data(temp, columns)
@@ -39,7 +70,7 @@ class Postgres(object):
             if cursor:
                 cursor.close()
             if connection:
-                connection.close()
+                args['pool'].putconn(connection)
 
         return result
 
@@ -54,18 +85,16 @@ class Postgres(object):
         cursor = None
 
         args = dict({'limit': 10000, 'offset': 0}, **kwargs)
-        if not {'host', 'port', 'dbname', 'user', 'password', 'schema_name'} <= args.keys():
+        if not {'pool', 'schema_name'} <= args.keys():
             raise ValueError('Missing required parameter for database connection')
 
-        logging.debug('Geting schemat info for %s on host: %s, port: %s', args['schema_name'], args['host'],
-                      str(args['port']))
+        logging.debug('Geting schemat info for %s on host: %s, port: %s', args['schema_name'], args['pool'].host,
+                      str(args['pool'].port))
 
         try:
-            connection = psycopg2.connect(host=args['host'], port=args['port'], dbname=args['dbname'],
-                                          user=args['user'], password=args['password'])
+            connection = args['pool'].getconn()
             cursor = connection.cursor()
-            cursor.execute('SELECT * FROM information_schema.schemata WHERE schema_name=\'{schema_name}\''
-                           .format(schema_name=args['schema_name']))
+            cursor.execute('SELECT * FROM information_schema.schemata WHERE schema_name=%s', (args['schema_name'],))
             temp = cursor.fetchall()
             columns = cursor.description
             result = PostgresHelper.ConvertPsycopg2Data(temp, columns)
@@ -76,7 +105,7 @@ class Postgres(object):
             if cursor:
                 cursor.close()
             if connection:
-                connection.close()
+                args['pool'].putconn(connection)
 
         return result
 
@@ -84,6 +113,8 @@ class Postgres(object):
     def create_schema(cls, **kwargs):
         """
         Create a new schema in the database
+        :param schema_name: Name of the schema as written in a statement, unquoted names are folded to lower case.
+                            Other names than identifiers are rejected with a BadRequest
         :return: boolean indicating if we can connect (true) or not (false)
         """
         result = None
@@ -91,17 +122,17 @@ class Postgres(object):
         cursor = None
 
         args = dict({'limit': 10000, 'offset': 0}, **kwargs)
-        if not {'host', 'port', 'dbname', 'user', 'password', 'schema_name'} <= args.keys():
+        if not {'pool', 'schema_name'} <= args.keys():
             raise ValueError('Missing required parameter for database connection')
 
-        logging.debug('Create schema %s on host: %s, port: %s', args['schema_name'], args['host'], str(args['port']))
+        logging.debug('Create schema %s on host: %s, port: %s', args['schema_name'], args['pool'].host,
+                      str(args['pool'].port))
 
         try:
-            connection = psycopg2.connect(host=args['host'], port=args['port'], dbname=args['dbname'],
-                                          user=args['user'], password=args['password'])
+            connection = args['pool'].getconn()
             cursor = connection.cursor()
             cursor.execute('CREATE SCHEMA IF NOT EXISTS {schema_name}'
-                           .format(schema_name=args['schema_name']))
+                           .format(schema_name=PostgresHelper.resolve_column(args['schema_name'])))
             connection.commit()
         except psycopg2.Error as error:
             logging.error('We could not connect to the database: %s', str(error.args))
@@ -110,29 +141,30 @@ class Postgres(object):
             if cursor:
                 cursor.close()
             if connection:
-                connection.close()
+                args['pool'].putconn(connection)
 
     @classmethod
     def delete_schema(cls, **kwargs):
         """
         Create a new schema in the database
+        :param schema_name: Name of the schema, see create_schema
         :return: boolean indicating if we can connect (true) or not (false)
         """
         connection = None
         cursor = None
 
         args = dict(**kwargs)
-        if not {'host', 'port', 'dbname', 'user', 'password', 'schema_name'} <= args.keys():
+        if not {'pool', 'schema_name'} <= args.keys():
             raise ValueError('Missing required parameter for database connection')
 
-        logging.debug('Delete schema %s on host: %s, port: %s', args['schema_name'], args['host'], str(args['port']))
+        logging.debug('Delete schema %s on host: %s, port: %s', args['schema_name'], args['pool'].host,
+                      str(args['pool'].port))
 
         try:
-            connection = psycopg2.connect(host=args['host'], port=args['port'], dbname=args['dbname'],
-                                          user=args['user'], password=args['password'])
+            connection = args['pool'].getconn()
             cursor = connection.cursor()
             cursor.execute('DROP SCHEMA IF EXISTS {schema_name} CASCADE'
-                           .format(schema_name=args['schema_name']))
+                           .format(schema_name=PostgresHelper.resolve_column(args['schema_name'])))
             connection.commit()
         except psycopg2.Error as error:
             logging.error('We could not connect to the database: %s', str(error.args))
@@ -141,57 +173,709 @@ class Postgres(object):
             if cursor:
                 cursor.close()
             if connection:
-                connection.close()
+                args['pool'].putconn(connection)
+
+    @classmethod
+    def copy_from(cls, **kwargs):
+        """
+        Loads rows into a table with COPY FROM STDIN. The rows are read from the file in chunks while they are sent
+        to the server and are committed in one transaction
+        :param pool: The connection pool used for the copy
+        :param schema: Schema name as stored in the catalog
+        :param relation: Table name as stored in the catalog
+        :param columns: Names of the columns (as stored in the catalog) in the order of the fields of every line
+        :param file: File like object returning csv lines
+        :param chunk_size: Amount of bytes read from the file per call
+        :return: Amount of rows loaded
+        """
+        connection = None
+        cursor = None
+
+        args = dict({'chunk_size': 65536}, **kwargs)
+        if not {'pool', 'schema', 'relation', 'columns', 'file'} <= args.keys():
+            raise ValueError('Missing required parameter for database connection')
+
+        logging.debug('Copy data into %s:%s on host: %s, port: %s', args['schema'], args['relation'],
+                      args['pool'].host, str(args['pool'].port))
+        metrics.count_query(args['schema'], args['relation'], 'ingest')
+
+        query = 'COPY {schema}.{relation} ({columns}) FROM STDIN WITH (FORMAT csv)'.format(
+            schema=PostgresHelper.quote_identifier(args['schema']),
+            relation=PostgresHelper.quote_identifier(args['relation']),
+            columns=', '.join(PostgresHelper.quote_identifier(column) for column in args['columns']))
+        try:
+            connection = args['pool'].getconn()
+            cursor = connection.cursor()
+            cursor.copy_expert(query, args['file'], args['chunk_size'])
+            rows = cursor.rowcount
+            connection.commit()
+        except psycopg2.Error as error:
+            logging.error('We could not copy data: %s', str(error.args))
+            raise error
+        finally:
+            if cursor:
+                cursor.close()
+            if connection:
+                args['pool'].putconn(connection)
+        return rows
+
+    @classmethod
+    def copy_to(cls, **kwargs):
+        """
+        Exports the result of a select with COPY TO STDOUT. The copy runs in a separate thread that passes the data
+        in chunks through a bounded queue, so the memory usage does not depend on the size of the result. The copy is
+        started and the first chunk is awaited before this method returns, so errors in the query are raised here
+        and not while the data is sent
+        :param pool: The connection pool used for the copy
+        :param limit: Maximum amount of rows, None exports all rows
+        :param format: 'csv' or 'binary' (the binary COPY format of postgres)
+        :param header: If true the csv data starts with the column names
+        :param chunk_size: Minimum amount of bytes per chunk
+        :param queue_size: Maximum amount of chunks waiting to be sent
+        :return: CopyStream yielding the data in chunks of bytes
+        """
+        args = cls._select_arguments(dict({'limit': None, 'format': 'csv', 'header': False, 'chunk_size': 65536,
+                                           'queue_size': 8}, **kwargs))
+        if args['format'] not in ('csv', 'binary'):
+            raise ValueError('Unknown export format {}'.format(args['format']))
+
+        logging.debug('Exporting data from %s:%s from host: %s, port: %s', args['schema'], args['relation'],
+                      args['pool'].host, str(args['pool'].port))
+        metrics.count_query(args['schema'], args['relation'], 'export')
+
+        writer = CopyWriter(args['chunk_size'], args['queue_size'])
+        connection = args['pool'].getconn()
+        try:
+            cursor = connection.cursor()
+            # COPY does not support parameters, the values are quoted by psycopg2
+            query = cursor.mogrify(*cls._select_query(args)).decode(extensions.encodings[connection.encoding])
+            release = cls._admit(args, cursor, query, None)
+            query = 'COPY ({query}) TO STDOUT WITH (FORMAT {format}{header})'.format(
+                query=query, format=args['format'],
+                header=', HEADER' if args['header'] and args['format'] == 'csv' else '')
+        except psycopg2.Error as error:
+            args['pool'].putconn(connection)
+            raise cls._translate(args, error)
+        except Exception:
+            args['pool'].putconn(connection)
+            raise
+
+        def copy():
+            error = None
+            try:
+                cursor.copy_expert(query, writer, args['chunk_size'])
+                logging.debug('Exported %s rows from %s:%s', cursor.rowcount, args['schema'], args['relation'])
+            except Exception as exception:
+                error = exception
+            finally:
+                release()
+                cursor.close()
+                # an aborted copy may leave data on the connection, so it is not reused
+                args['pool'].putconn(connection, discard=error is not None)
+                writer.close(error)
+
+        thread = threading.Thread(target=copy, name='p2rest-export', daemon=True)
+        thread.start()
+
+        try:
+            return CopyStream(writer, thread, connection).start()
+        except psycopg2.Error as error:
+            logging.error('We could not export data: %s', str(error.args))
+            raise cls._translate(args, error)
+
+    @classmethod
+    def _select_arguments(cls, kwargs):
+        """
+        Adds the default values to the arguments of a select and checks that all required ones are present
+        :param kwargs: Arguments provided to query_select or query_select_stream
+        :return: Dictionary with all arguments
+        """
+        args = dict({'limit': 10000, 'filter': '', 'offset': 0, 'fields': '*', 'order_fields': '', 'order_type': 'asc',
+                     'keyset': None, 'compact': False, 'engine': 'python', 'total': None}, **kwargs)
+        if not {'pool', 'schema', 'relation'} <= args.keys():
+            raise ValueError('Missing required parameter for database connection')
+        if args['engine'] not in ENGINES:
+            raise ValueError('Unknown rendering engine {}'.format(args['engine']))
+        if args['engine'] == 'database' and args['compact']:
+            raise ValueError('The compact form is not supported by the database rendering engine')
+        if args['total'] is not None and args['total'] not in COUNT_STRATEGIES:
+            raise ValueError('Unknown count strategy {}'.format(args['total']))
+        if args['engine'] == 'database' and args['total'] == 'inline':
+            raise ValueError('The inline total is not supported by the database rendering engine')
+        return args
+
+    @classmethod
+    @timing.span('compile')
+    def _select_query(cls, args):
+        """
+        Builds the parameterized select statement for the given arguments. Limit and offset are parameters as well,
+        so all requests of the same shape result in the same statement
+        :param args: Arguments as returned by _select_arguments
+        :return: SQL query string with placeholders and the list of values for them
+        """
+        filter, params = PostgresHelper.convert_request_filter_to_string(args['filter'], PostgresHelper.resolve_column)
+        offset = args['offset']
+        if args['keyset'] is not None:
+            # keyset pagination: seek behind the last row of the previous page instead of skipping rows
+            seek, seek_params = PostgresHelper.convert_keyset_to_string(args['order_fields'], args['order_type'],
+                                                                        args['keyset'])
+            filter = '{filter} AND {seek}'.format(filter=filter, seek=seek) if filter else 'WHERE ' + seek
+            params += seek_params
+            offset = 0
+
+        query = '''
+                SELECT {fields}{total} FROM {schema}.{relation} {filter} {order} LIMIT %s OFFSET %s
+            '''.format(
+                fields=', '.join(PostgresHelper.convert_field_to_string(field) for field in args['fields']),
+                # the window is computed before limit and offset are applied, so it counts all rows of the filter
+                total=', count(*) OVER () AS p2rest_total' if args['total'] == 'inline' else '',
+                schema=PostgresHelper.resolve_column(args['schema']),
+                relation=PostgresHelper.resolve_column(args['relation']),
+                filter=filter,
+                order=PostgresHelper.convert_order_by_to_string(args['order_fields'], args['order_type'])
+            )
+        return query, params + [args['limit'], offset]
+
+    @classmethod
+    def _admit(cls, args, cursor, query, params):
+        """
+        Lets the query governor of the request set the timeouts and check the estimate of a statement before it runs
+        :param args: Arguments of the request, the governor is optional
+        :param cursor: A cursor in the transaction the statement runs in
+        :param query: The statement with placeholders
+        :param params: Values for the placeholders
+        :return: Function that has to be called once the statement has finished, see QueryGovernor.admit
+        """
+        if args.get('governor') is None:
+            return release_nothing
+        return args['governor'].admit(cursor, args['schema'], args['relation'], query, params)
+
+    @classmethod
+    def _translate(cls, args, error):
+        """
+        Returns the error that is raised for an error of a statement, statements cancelled by the timeouts of the
+        governor become a ServiceUnavailable
+        """
+        if args.get('governor') is None or not isinstance(error, psycopg2.Error):
+            return error
+        return args['governor'].translate(error, args['schema'], args['relation'])
 
     @classmethod
     def query_select(cls, **kwargs):
         """
         Check if we can connect to the database
-        :param host: The host ip or dns name for our connection
-        :param port: Database servers port
-        :param dbname: The database name we want to connect to
-        :param user: The db user for connecting
-        :param password: The db users password for connecting
+        :param pool: The connection pool used for the query
+        :param keyset: Values of the order fields of the last row of the previous page. If provided, the rows
+                       following this row are returned and the offset is ignored
+        :param compact: If true a dictionary with the column names ('columns') and the rows as lists of values
+                        ('rows') is returned instead of a list of dictionaries
+        :param engine: 'python' converts the rows in python. 'database' lets postgres render the json and returns it
+                       as RenderedRows without decoding it
+        :param total: Strategy for counting all rows that match the filter: 'exact', 'estimate' or 'inline' (see
+                      count_rows). If set the result is returned as CountedRows
         :return: boolean indicating if we can connect (true) or not (false)
         """
         result = None
         connection = None
         cursor = None
 
-        args = dict({'limit': 10000, 'filter': '', 'offset': 0, 'fields': '*', 'order_fields': '', 'order_type': 'asc'},
-                    **kwargs)
-        if not {'host', 'port', 'dbname', 'user', 'password', 'schema', 'relation'} <= args.keys():
-            raise ValueError('Missing required parameter for database connection')
+        args = cls._select_arguments(kwargs)
 
-        logging.debug('Geting data from %s:%s from host: %s, port: %s', args['schema'], args['relation'], args['host'],
-                      str(args['port']))
+        logging.debug('Geting data from %s:%s from host: %s, port: %s', args['schema'], args['relation'],
+                      args['pool'].host, str(args['pool'].port))
+        metrics.count_query(args['schema'], args['relation'], 'select')
 
+        release = release_nothing
         try:
-            connection = psycopg2.connect(host=args['host'], port=args['port'], dbname=args['dbname'],
-                                          user=args['user'], password=args['password'])
+            connection = args['pool'].getconn()
             cursor = connection.cursor()
-            query = '''
-                SELECT {fields} FROM {schema}.{relation} {filter} {order} LIMIT {limit} OFFSET {offset}
-            '''.format(
-                fields=', '.join(args['fields']),
-                schema=args['schema'],
-                relation=args['relation'],
-                filter=PostgresHelper.convert_request_filter_to_string(args['filter']),
-                order=PostgresHelper.convert_order_by_to_string(args['order_fields'], args['order_type']),
-                limit=args['limit'],
-                offset=args['offset']
-            )
-            cursor.execute(query)
-            temp = cursor.fetchall()
-            columns = cursor.description
-            result = PostgresHelper.ConvertPsycopg2Data(temp, columns)
+            query, params = cls._select_query(args)
+            release = cls._admit(args, cursor, query, params)
+            result = cls._execute_select(args, query, params, cursor)
         except psycopg2.Error as error:
             logging.error('We could not cget data: %s', str(error.args))
+            raise cls._translate(args, error)
+        finally:
+            release()
+            if cursor:
+                cursor.close()
+            if connection:
+                args['pool'].putconn(connection)
+
+        return result
+
+    @classmethod
+    def _sampled(cls, args):
+        """
+        True if the query analytics of the request record the select
+        """
+        return args.get('analytics') is not None and args['analytics'].sample()
+
+    @classmethod
+    def _execute_select(cls, args, query, params, cursor, savepoint=None):
+        """
+        Executes a select on the given cursor and converts its result. Sampled selects are recorded by the query
+        analytics of the request
+        :param args: Arguments as returned by _select_arguments
+        :param query: The query as returned by _select_query
+        :param params: Values for the placeholders of the query
+        :param cursor: The cursor used for the query
+        :param savepoint: Savepoint of the current transaction, see StatementCache.execute
+        :return: The result as described in query_select
+        """
+        if not cls._sampled(args):
+            return cls._convert_select(args, query, params, cursor, savepoint)
+        start = perf_counter()
+        result = cls._convert_select(args, query, params, cursor, savepoint)
+        args['analytics'].record(args, query, perf_counter() - start, count_result(result))
+        return result
+
+    @classmethod
+    def _convert_select(cls, args, query, params, cursor, savepoint=None):
+        """
+        Executes a select on the given cursor and converts its result, see _execute_select
+        """
+        if args['engine'] == 'database':
+            extensions.register_type(extensions.BYTES, cursor)
+            args['pool'].statements.execute(cursor, RENDER_QUERY.format(query=query), params, savepoint)
+            with timing.span('fetch'):
+                data, count = cursor.fetchone()
+            metrics.count_rows(count)
+            result = RenderedRows(data, count)
+            if args['total'] is not None:
+                result = CountedRows(result, cls.count_rows(args, cursor, args['total'], savepoint))
+            return result
+        args['pool'].statements.execute(cursor, query, params, savepoint)
+        with timing.span('fetch'):
+            temp = cursor.fetchall()
+        description = cursor.description
+        total = None
+        if args['total'] == 'inline':
+            # the total is the last column of every row, an empty page does not contain it
+            description = description[:-1]
+            if temp:
+                total = temp[0][-1]
+                temp = [row[:-1] for row in temp]
+            elif not args['offset'] and args['keyset'] is None:
+                total = 0
+        converter = RowConverter(description)
+        result = converter.convert(temp, compact=args['compact'])
+        if args['compact']:
+            result = {'columns': converter.names, 'rows': result}
+        if args['total'] is not None:
+            if total is None:
+                total = cls.count_rows(args, cursor, 'exact' if args['total'] == 'inline' else args['total'],
+                                       savepoint)
+            result = CountedRows(result, total)
+        return result
+
+    @classmethod
+    def query_count(cls, **kwargs):
+        """
+        Counts the rows of a relation that match a filter
+        :param pool: The connection pool used for the query
+        :param filter: The filter as for query_select
+        :param strategy: 'exact' or 'estimate', see count_rows
+        :return: The amount of rows
+        """
+        connection = None
+        cursor = None
+
+        args = dict({'filter': '', 'strategy': 'exact'}, **kwargs)
+        if not {'pool', 'schema', 'relation'} <= args.keys():
+            raise ValueError('Missing required parameter for database connection')
+        if args['strategy'] not in ('exact', 'estimate'):
+            raise ValueError('Unknown count strategy {}'.format(args['strategy']))
+
+        logging.debug('Counting rows of %s:%s from host: %s, port: %s', args['schema'], args['relation'],
+                      args['pool'].host, str(args['pool'].port))
+        metrics.count_query(args['schema'], args['relation'], 'count')
+
+        release = release_nothing
+        try:
+            connection = args['pool'].getconn()
+            cursor = connection.cursor()
+            if args['strategy'] == 'exact':
+                release = cls._admit(args, cursor, *cls._count_query(args))
+            result = cls.count_rows(args, cursor, args['strategy'])
+        except psycopg2.Error as error:
+            logging.error('We could not count rows: %s', str(error.args))
+            raise cls._translate(args, error)
+        finally:
+            release()
+            if cursor:
+                cursor.close()
+            if connection:
+                args['pool'].putconn(connection)
+
+        return result
+
+    @classmethod
+    def count_rows(cls, args, cursor, strategy, savepoint=None):
+        """
+        Counts the rows that match the filter of a select, limit, offset and keyset are ignored.
+        'exact' runs count(*) with the same filter. 'estimate' reads the row estimate of the table statistics
+        (pg_class.reltuples) if there is no filter and the planner's estimate of the filtered query
+        (EXPLAIN (FORMAT JSON)) otherwise, so no rows are read
+        :param args: Arguments of the select
+        :param cursor: The cursor used for the query
+        :param strategy: 'exact' or 'estimate'
+        :param savepoint: Savepoint of the current transaction, see StatementCache.execute
+        :return: The amount of rows
+        """
+        if strategy == 'estimate':
+            filter, params = PostgresHelper.convert_request_filter_to_string(args['filter'],
+                                                                             PostgresHelper.resolve_column)
+            relation = '{schema}.{relation}'.format(schema=PostgresHelper.resolve_column(args['schema']),
+                                                    relation=PostgresHelper.resolve_column(args['relation']))
+            if not filter:
+                # the name is a parameter here, so its percent signs are not escaped
+                cursor.execute(QUERY_ESTIMATE_ROWS, [relation.replace('%%', '%')])
+                row = cursor.fetchone()
+                if row is not None and row[0] is not None:
+                    return int(row[0])
+            cursor.execute('EXPLAIN (FORMAT JSON) SELECT 1 FROM {relation} {filter}'.format(relation=relation,
+                                                                                           filter=filter), params)
+            return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+        query, params = cls._count_query(args)
+        args['pool'].statements.execute(cursor, query, params, savepoint)
+        return cursor.fetchone()[0]
+
+    @classmethod
+    @timing.span('compile')
+    def _count_query(cls, args):
+        """
+        Builds the statement counting the rows that match the filter of a select
+        :param args: Arguments of the select
+        :return: SQL query string with placeholders and the list of values for them
+        """
+        filter, params = PostgresHelper.convert_request_filter_to_string(args['filter'], PostgresHelper.resolve_column)
+        query = 'SELECT count(*) FROM {schema}.{relation} {filter}'.format(
+            schema=PostgresHelper.resolve_column(args['schema']),
+            relation=PostgresHelper.resolve_column(args['relation']), filter=filter)
+        return query, params
+
+    @classmethod
+    def query_aggregate(cls, **kwargs):
+        """
+        Groups the rows of a relation and computes aggregates in the database with one statement
+        :param pool: The connection pool used for the query
+        :param group_by: Names of the columns the rows are grouped by
+        :param aggregates: List of dictionaries with function, column and optional alias, see
+                           PostgresHelper.convert_aggregates_to_string
+        :param filter: Filter on the rows before grouping, only plain column names are allowed
+        :param having: Filter on the groups. Its columns are the group by columns and the aliases of the aggregates
+        :param order_fields: Group by columns or aliases the result is ordered by
+        :return: List of dictionaries, one per group
+        """
+        connection = None
+        cursor = None
+
+        args = dict({'limit': 10000, 'offset': 0, 'filter': '', 'having': '', 'group_by': [], 'aggregates': [],
+                     'order_fields': [], 'order_type': 'asc'}, **kwargs)
+        if not {'pool', 'schema', 'relation'} <= args.keys():
+            raise ValueError('Missing required parameter for database connection')
+
+        logging.debug('Aggregating data of %s:%s from host: %s, port: %s', args['schema'], args['relation'],
+                      args['pool'].host, str(args['pool'].port))
+        metrics.count_query(args['schema'], args['relation'], 'aggregate')
+
+        query, params = cls._aggregate_query(args)
+        release = release_nothing
+        try:
+            connection = args['pool'].getconn()
+            cursor = connection.cursor()
+            release = cls._admit(args, cursor, query, params)
+            args['pool'].statements.execute(cursor, query, params)
+            with timing.span('fetch'):
+                rows = cursor.fetchall()
+            result = RowConverter(cursor.description).convert(rows)
+        except psycopg2.Error as error:
+            logging.error('We could not aggregate data: %s', str(error.args))
+            raise cls._translate(args, error)
+        finally:
+            release()
+            if cursor:
+                cursor.close()
+            if connection:
+                args['pool'].putconn(connection)
+
+        return result
+
+    @classmethod
+    @timing.span('compile')
+    def _aggregate_query(cls, args):
+        """
+        Builds the parameterized statement of an aggregation
+        :param args: Arguments of query_aggregate with their default values
+        :return: SQL query string with placeholders and the list of values for them
+        """
+        select, group, outputs = PostgresHelper.convert_aggregates_to_string(args['group_by'], args['aggregates'])
+
+        def output(name):
+            expression = outputs.get(name) or outputs.get(normalize_identifier(name))
+            if expression is None:
+                raise BadRequest('Unknown group by column or aggregate: {}'.format(name))
+            return expression
+
+        where, params = PostgresHelper.convert_request_filter_to_string(args['filter'], PostgresHelper.resolve_column)
+        having, having_params = PostgresHelper.convert_request_filter_to_string(args['having'], output, 'HAVING')
+        order = ''
+        if args['order_fields']:
+            if args['order_type'].lower() not in ('asc', 'desc'):
+                raise BadRequest('Invalid order_type provided. Must be asc or desc.')
+            order = 'ORDER BY ' + ', '.join('{} {}'.format(output(field), args['order_type'])
+                                            for field in args['order_fields'])
+
+        query = 'SELECT {select} FROM {schema}.{relation} {where} {group} {having} {order} LIMIT %s OFFSET %s'.format(
+            select=select,
+            schema=PostgresHelper.resolve_column(args['schema']),
+            relation=PostgresHelper.resolve_column(args['relation']),
+            where=where,
+            group=group,
+            having=having,
+            order=order)
+        return query, params + having_params + [args['limit'], args['offset']]
+
+    @classmethod
+    def query_batch(cls, pool, selects, snapshot=False, concurrency=1):
+        """
+        Executes several selects with as few connections as possible. The selects are executed one after the other on
+        the same connection, with a concurrency above one they are distributed over several connections. Additional
+        connections are only used if the pool has them available right away.
+        :param pool: The connection pool used for the queries
+        :param selects: List of dictionaries with the arguments of query_select (without the pool)
+        :param snapshot: If true all selects read the same snapshot of the database in read only transactions. The
+                         snapshot is exported from the first connection and imported by the other ones
+        :param concurrency: Maximum amount of connections used for the selects
+        :return: List with a tuple of result and error for every select, one of both is None
+        """
+        items = [cls._select_arguments(dict(select, pool=pool)) for select in selects]
+        # the queries are built before a connection is used, so invalid filters fail the whole batch
+        queries = [cls._select_query(item) for item in items]
+        for item in items:
+            metrics.count_query(item['schema'], item['relation'], 'select')
+        results = [None] * len(items)
+        connections = []
+        try:
+            connections.append(pool.getconn())
+            while len(connections) < min(concurrency, len(items)):
+                try:
+                    connections.append(pool.getconn(timeout=0))
+                except PoolError:
+                    break
+
+            snapshot_id = None
+            if snapshot:
+                for index, connection in enumerate(connections):
+                    cursor = connection.cursor()
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+                    if index == 0 and len(connections) > 1:
+                        cursor.execute('SELECT pg_export_snapshot()')
+                        snapshot_id = cursor.fetchone()[0]
+                    elif index > 0:
+                        cursor.execute('SET TRANSACTION SNAPSHOT %s', [snapshot_id])
+                    cursor.close()
+
+            if len(connections) == 1:
+                cls._execute_batch(items, queries, results, range(len(items)), connections[0], snapshot)
+            else:
+                threads = [threading.Thread(target=cls._execute_batch,
+                                            args=(items, queries, results,
+                                                  range(index, len(items), len(connections)),
+                                                  connection, snapshot))
+                           for index, connection in enumerate(connections)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                # the threads have no request context, their rows are counted for the request here
+                metrics.count_rows(sum(count_result(result) for result, error in results if error is None))
+        except psycopg2.Error as error:
+            logging.error('We could not execute the batch: %s', str(error.args))
             raise error
         finally:
+            for connection in connections:
+                pool.putconn(connection)
+        return results
+
+    @classmethod
+    def _execute_batch(cls, items, queries, results, indexes, connection, snapshot):
+        """
+        Executes some selects of a batch on one connection. Errors are stored as result, so the remaining selects
+        are executed nevertheless
+        :param items: Arguments of all selects of the batch
+        :param queries: Queries and parameters of all selects of the batch
+        :param results: List the results are stored in
+        :param indexes: Positions of the selects that shall be executed on this connection
+        :param connection: The connection used for the selects
+        :param snapshot: If true the selects run in one transaction, failed selects are rolled back to a savepoint
+        """
+        cursor = connection.cursor()
+        savepoint = 'p2rest_batch' if snapshot else None
+        position = 0
+        try:
+            for position, index in enumerate(indexes):
+                try:
+                    if snapshot:
+                        cursor.execute('SAVEPOINT p2rest_batch')
+                    query, params = queries[index]
+                    release = cls._admit(items[index], cursor, query, params)
+                    try:
+                        results[index] = (cls._execute_select(items[index], query, params, cursor, savepoint), None)
+                    finally:
+                        release()
+                except HTTPException as error:
+                    # rejected by the governor before the select was executed
+                    results[index] = (None, error)
+                except psycopg2.Error as error:
+                    logging.warning('Select %d of the batch failed: %s', index, str(error.args))
+                    results[index] = (None, cls._translate(items[index], error))
+                    if snapshot:
+                        cursor.execute('ROLLBACK TO SAVEPOINT p2rest_batch')
+                    else:
+                        connection.rollback()
+        except psycopg2.Error as error:
+            # the connection can not be used anymore, the remaining selects fail with the same error
+            logging.error('Connection of the batch failed: %s', str(error.args))
+            for index in indexes[position:]:
+                if results[index] is None:
+                    results[index] = (None, error)
+        finally:
+            cursor.close()
+
+    @classmethod
+    def query_select_stream(cls, **kwargs):
+        """
+        Same as query_select, but the rows are read in batches from a server side cursor. The statement is executed
+        and the first batch is fetched before this method returns, so errors in the query are raised here and not
+        while the result is streamed. The connection is returned to the pool once the generator is exhausted or closed
+        :param pool: The connection pool used for the query
+        :param batch_size: Amount of rows fetched from the server side cursor per round trip
+        :param compact: If true the rows are lists of values in the order of the columns instead of dictionaries
+        :param engine: 'python' converts the rows in python. 'database' lets postgres render every row as json, the
+                       rows are returned as bytes
+        :param raw: If true the rows are returned as they are returned by the cursor and instead of the column names
+                    the cursor description is returned
+        :return: The column names and a BatchStream yielding lists of rows
+        """
+        connection = None
+        cursor = None
+
+        args = cls._select_arguments(dict({'batch_size': 1000, 'raw': False}, **kwargs))
+
+        logging.debug('Streaming data from %s:%s from host: %s, port: %s', args['schema'], args['relation'],
+                      args['pool'].host, str(args['pool'].port))
+        metrics.count_query(args['schema'], args['relation'], 'select')
+
+        release = release_nothing
+        try:
+            connection = args['pool'].getconn()
+            query, params = cls._select_query(args)
+            # the named cursor can only run the select itself, the governor uses a cursor of its own
+            with connection.cursor() as admission:
+                release = cls._admit(args, admission, query, params)
+            cursor = connection.cursor(name='p2rest_stream')
+            cursor.itersize = args['batch_size']
+            record = cls._stream_recorder(args, query)
+            if args['engine'] == 'database':
+                extensions.register_type(extensions.BYTES, cursor)
+                query = RENDER_STREAM_QUERY.format(query=query)
+            args['pool'].statements.execute(cursor, query, params)
+            with timing.span('fetch'):
+                rows = cursor.fetchmany(args['batch_size'])
+        except (psycopg2.Error, HTTPException) as error:
+            logging.error('We could not get data: %s', str(error.args))
+            release()
             if cursor:
                 cursor.close()
             if connection:
-                connection.close()
+                args['pool'].putconn(connection)
+            raise cls._translate(args, error)
+
+        if args['raw']:
+            return cursor.description, BatchStream(cls._stream_batches(args, cursor, rows, None, record),
+                                                   args['pool'], connection, cursor, release)
+        if args['engine'] == 'database':
+            return None, BatchStream(cls._stream_batches(args, cursor, rows, lambda batch: [row[0] for row in batch],
+                                                         record),
+                                     args['pool'], connection, cursor, release)
+        converter = RowConverter(cursor.description)
+        return converter.names, BatchStream(
+            cls._stream_batches(args, cursor, rows, lambda batch: converter.convert(batch, compact=args['compact']),
+                                record),
+            args['pool'], connection, cursor, release)
+
+    @classmethod
+    def _stream_recorder(cls, args, query):
+        """
+        Returns a function that records a streamed select with the amount of streamed rows in the query analytics, or
+        None if the select is not sampled. The latency is measured from now until the function is called
+        """
+        if not cls._sampled(args):
+            return None
+        start = perf_counter()
+        return lambda rows: args['analytics'].record(args, query, perf_counter() - start, rows)
 
-        return result
\ No newline at end of file
+    @classmethod
+    def _stream_batches(cls, args, cursor, rows, convert, record=None):
+        """
+        Generator that converts and yields the batches of a server side cursor
+        :param args: Arguments of the select
+        :param cursor: Named cursor the statement was executed on
+        :param rows: The first batch of rows that was already fetched
+        :param convert: Function converting a batch of rows, None yields the rows as they are
+        :param record: Function called with the amount of streamed rows once the cursor is exhausted, see
+                       _stream_recorder
+        :return: Generator yielding lists of rows
+        """
+        streamed = 0
+        try:
+            while rows:
+                yield rows if convert is None else convert(rows)
+                streamed += len(rows)
+                if len(rows) < args['batch_size']:
+                    break
+                with timing.span('fetch'):
+                    rows = cursor.fetchmany(args['batch_size'])
+        except psycopg2.Error as error:
+            logging.error('Error while streaming data: %s', str(error.args))
+            raise error
+        if record is not None:
+            record(streamed)
+
+
+class BatchStream(object):
+    """
+    Iterator over the batches of a streamed select. The cursor is closed and the connection is returned to the pool
+    once it is exhausted or closed. This is a class and not a generator, so closing works even if it was never
+    iterated (e.g. because the client disconnected before the response was started)
+    """
+
+    def __init__(self, batches, pool, connection, cursor, release=release_nothing):
+        self.batches = batches
+        self.pool = pool
+        self.connection = connection
+        self.cursor = cursor
+        self.release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.batches)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        try:
+            self.batches.close()
+            self.cursor.close()
+        finally:
+            self.release()
+            self.pool.putconn(connection)
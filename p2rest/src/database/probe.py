@@ -0,0 +1,188 @@
+import os
+import time
+import logging
+import threading
+from flask import current_app
+import psycopg2
+from psycopg2.pool import PoolError
+
+# Seconds since the last transaction replayed by a standby, NULL on a primary
+QUERY_REPLICATION_LAG = """
+    SELECT CASE WHEN pg_is_in_recovery() THEN extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+class HealthProber(object):
+    """
+    Checks the database with a 'SELECT 1' on a pooled connection and caches the outcome, so health and readiness
+    probes do not touch the database themselves. The probe runs in a background thread every interval seconds. If
+    the thread is disabled the probe runs within the request once the cached outcome is older than the interval.
+    """
+
+    def __init__(self, pool, interval=5, timeout=2, background=True, replication_lag=False, max_replication_lag=0):
+        """
+        Create a new prober
+        :param pool: The connection pool that is checked
+        :param interval: Seconds between two probes
+        :param timeout: Seconds to wait for a pooled connection and for the probe statement
+        :param background: Run the probes in a background thread
+        :param replication_lag: Read the replication lag if the database is a standby
+        :param max_replication_lag: Seconds of replication lag after which the service is not ready. 0 disables it
+        """
+        self.pool = pool
+        self.interval = interval
+        self.timeout = timeout
+        self.background = background
+        self.replication_lag = replication_lag or bool(max_replication_lag)
+        self.max_replication_lag = max_replication_lag
+
+        self._lock = threading.Lock()
+        self._result = None
+        self._thread = None
+        self._thread_pid = None
+        self._stopped = threading.Event()
+        self.probes = 0
+        self.failures = 0
+
+    @classmethod
+    def from_config(cls, pool, config):
+        """
+        Creates a prober from the flask configuration
+        """
+        return cls(pool,
+                   interval=config['P2REST_HEALTH_PROBE_INTERVAL'],
+                   timeout=config['P2REST_HEALTH_PROBE_TIMEOUT'],
+                   background=config['P2REST_HEALTH_PROBE_BACKGROUND'],
+                   replication_lag=config['P2REST_HEALTH_REPLICATION_LAG'],
+                   max_replication_lag=config['P2REST_HEALTH_MAX_REPLICATION_LAG'])
+
+    def probe(self):
+        """
+        Runs one probe and stores its outcome
+        :return: The outcome as returned by status
+        """
+        start = time.monotonic()
+        result = {'ok': True, 'error': None, 'replication_lag': None}
+        connection = None
+        discard = False
+        try:
+            connection = self.pool.getconn(timeout=self.timeout)
+            cursor = connection.cursor()
+            cursor.execute('SET LOCAL statement_timeout = %s', [int(self.timeout * 1000)])
+            cursor.execute('SELECT 1')
+            if self.replication_lag:
+                cursor.execute(QUERY_REPLICATION_LAG)
+                lag = cursor.fetchone()[0]
+                result['replication_lag'] = float(lag) if lag is not None else None
+            cursor.close()
+        except (psycopg2.Error, PoolError) as error:
+            logging.warning('Database probe failed: %s', str(error.args))
+            discard = isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            result['ok'] = False
+            result['error'] = str(error).strip()
+        finally:
+            if connection is not None:
+                self.pool.putconn(connection, discard=discard)
+
+        if result['ok'] and self.max_replication_lag and result['replication_lag'] is not None and \
+                result['replication_lag'] > self.max_replication_lag:
+            result['ok'] = False
+            result['error'] = 'Replication lag of {:.1f} seconds exceeds {} seconds'.format(
+                result['replication_lag'], self.max_replication_lag)
+        result['latency'] = time.monotonic() - start
+        result['checked_at'] = time.monotonic()
+        with self._lock:
+            self._result = result
+            self.probes += 1
+            if not result['ok']:
+                self.failures += 1
+        return result
+
+    def status(self):
+        """
+        Returns the outcome of the last probe. A probe is run first if there is none yet or, without background
+        thread, if it is older than the interval. An outcome older than three intervals means that the background
+        thread is stuck and is reported as failed
+        :return: Dictionary with ok, error, latency and age of the probe in seconds, replication lag and pool usage
+        """
+        self._start_thread()
+        result = self._result
+        if result is None or (not self._thread_running() and
+                              time.monotonic() - result['checked_at'] >= self.interval):
+            result = self.probe()
+        status = {key: value for key, value in result.items() if key != 'checked_at'}
+        status['age'] = time.monotonic() - result['checked_at']
+        if status['ok'] and status['age'] > 3 * max(self.interval, self.timeout):
+            status['ok'] = False
+            status['error'] = 'The last probe is {:.1f} seconds old'.format(status['age'])
+        pool = self.pool.stats()
+        status['pool'] = dict(pool, saturation=pool['used'] / pool['max_size'])
+        return status
+
+    def last(self):
+        """
+        Returns the outcome of the last probe without probing, None if there was none yet
+        """
+        return self._result
+
+    def stats(self):
+        """
+        Returns the amount of probes and failed probes
+        """
+        return {'probes': self.probes, 'failures': self.failures, 'background': self._thread_running()}
+
+    def _thread_running(self):
+        return self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive()
+
+    def _start_thread(self):
+        """
+        Starts the background thread once per process
+        """
+        if not self.background or self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='p2rest-health-prober', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread of this process
+        """
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._stopped.set()
+            self._thread.join(self.interval + self.timeout + 1)
+            self._thread = None
+            self._thread_pid = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.probe()
+            except Exception as error:
+                logging.error('Database prober failed: %s', str(error.args))
+            self._stopped.wait(self.interval)
+
+
+def init_prober(app, pool):
+    """
+    Creates the health prober of the application. The prober can be retrieved later with get_prober
+    :param app: The flask application
+    :param pool: The connection pool that is checked
+    :return: The new prober
+    """
+    prober = HealthProber.from_config(pool, app.config)
+    app.extensions['p2rest_prober'] = prober
+    return prober
+
+
+def get_prober(app=None):
+    """
+    Returns the health prober of the given or current flask application
+    """
+    if app is None:
+        app = current_app
+    return app.extensions['p2rest_prober']
@@ -0,0 +1,177 @@
+import itertools
+import threading
+from flask import current_app, request, has_request_context
+import psycopg2
+from psycopg2.extensions import parse_dsn
+from p2rest.src.database.pool import ConnectionPool
+from p2rest.src.database.probe import HealthProber
+
+# policies for distributing the reads over the replicas
+POLICIES = ('round_robin', 'least_outstanding')
+
+# request header with which a client requests reads from the primary, e.g. right after a write
+CONSISTENCY_HEADER = 'X-P2Rest-Consistency'
+
+# connection parameters of a replica that overwrite the ones of the primary
+CONNECTION_PARAMETERS = ('host', 'port', 'dbname', 'user', 'password')
+
+
+def parse_replicas(value):
+    """
+    Parses the connection parameters of the replicas. Parameters that are not provided are taken from the primary
+    :param value: Either a list of dsns or dictionaries, or a comma separated string of dsns. A dsn is a connection
+                  uri ("postgresql://user@host:5433/db"), a key value string ("host=replica1 port=5433") or
+                  "host[:port]"
+    :return: List of dictionaries with the connection parameters
+    """
+    if isinstance(value, (list, tuple)):
+        items = list(value)
+    else:
+        items = [item.strip() for item in (value or '').split(',') if item.strip()]
+
+    replicas = []
+    for item in items:
+        if isinstance(item, dict):
+            params = dict(item)
+        elif '=' not in item and '://' not in item:
+            host, _, port = item.partition(':')
+            params = {'host': host}
+            if port:
+                params['port'] = port
+        else:
+            try:
+                params = parse_dsn(item)
+            except psycopg2.ProgrammingError:
+                raise ValueError('Invalid replica dsn: {}'.format(item))
+        params = {key: value for key, value in params.items() if key in CONNECTION_PARAMETERS}
+        if not params.get('host'):
+            raise ValueError('Missing host of replica: {}'.format(item))
+        if 'port' in params:
+            params['port'] = int(params['port'])
+        replicas.append(params)
+    return replicas
+
+
+class ReplicaRouter(object):
+    """
+    Routes the read only statements to read replicas. Every replica has its own connection pool and a health prober
+    that reads its replication lag; replicas that can not be reached or lag behind more than the maximum lag are left
+    out until they recovered. Without healthy replicas, and for reads that have to see the latest writes, the primary
+    is used. Writes and DDL always use the primary pool (get_pool).
+    """
+
+    def __init__(self, primary, replicas=None, policy='round_robin', max_lag=30, check_interval=5, timeout=2,
+                 background=True):
+        """
+        Create a new router
+        :param primary: The connection pool of the primary
+        :param replicas: List of the connection pools of the replicas
+        :param policy: 'round_robin' uses the healthy replicas one after the other, 'least_outstanding' the one with
+                       the least connections in use by this worker process
+        :param max_lag: Seconds of replication lag after which a replica is not used. 0 disables it
+        :param check_interval: Seconds between two checks of a replica
+        :param timeout: Seconds a check waits for a connection and for its statement
+        :param background: Check the replicas in background threads instead of within the requests
+        """
+        if policy not in POLICIES:
+            raise ValueError('Unknown replica policy {}'.format(policy))
+        self.primary = primary
+        self.policy = policy
+        self.max_lag = max_lag
+        self.replicas = [HealthProber(pool, interval=check_interval, timeout=timeout, background=background,
+                                      replication_lag=True, max_replication_lag=max_lag)
+                         for pool in replicas or []]
+
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.routed = [0] * len(self.replicas)
+        self.primary_reads = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_config(cls, primary, config):
+        """
+        Creates a router and the pools of its replicas from the flask configuration
+        """
+        replicas = [ConnectionPool.from_config(config, **params)
+                    for params in parse_replicas(config['P2REST_DB_REPLICAS'])]
+        return cls(primary, replicas,
+                   policy=config['P2REST_DB_REPLICA_POLICY'],
+                   max_lag=config['P2REST_DB_REPLICA_MAX_LAG'],
+                   check_interval=config['P2REST_DB_REPLICA_CHECK_INTERVAL'],
+                   timeout=config['P2REST_HEALTH_PROBE_TIMEOUT'],
+                   background=config['P2REST_HEALTH_PROBE_BACKGROUND'])
+
+    def read_pool(self, primary=False):
+        """
+        Returns the pool a read only statement should use
+        :param primary: If true the primary is used, so the statement sees all committed writes
+        :return: ConnectionPool
+        """
+        if primary or not self.replicas:
+            with self._lock:
+                self.primary_reads += 1
+            return self.primary
+
+        healthy = [index for index, prober in enumerate(self.replicas) if prober.status()['ok']]
+        if not healthy:
+            with self._lock:
+                self.fallbacks += 1
+            return self.primary
+        if self.policy == 'least_outstanding':
+            index = min(healthy, key=lambda index: self.replicas[index].pool.stats()['used'])
+        else:
+            index = healthy[next(self._counter) % len(healthy)]
+        with self._lock:
+            self.routed[index] += 1
+        return self.replicas[index].pool
+
+    def stats(self):
+        """
+        Returns the state of every replica and the amount of reads routed to the replicas and to the primary
+        """
+        replicas = []
+        for prober, routed in zip(self.replicas, self.routed):
+            result = prober.last() or {}
+            replicas.append({'host': prober.pool.host, 'port': prober.pool.port, 'ok': result.get('ok'),
+                             'error': result.get('error'), 'replication_lag': result.get('replication_lag'),
+                             'used': prober.pool.stats()['used'], 'routed': routed})
+        return {'policy': self.policy, 'replicas': replicas, 'primary_reads': self.primary_reads,
+                'fallbacks': self.fallbacks}
+
+
+def init_router(app, pool):
+    """
+    Creates the replica router of the application. The pool for reads can be retrieved later with get_read_pool
+    :param app: The flask application
+    :param pool: The connection pool of the primary
+    :return: The new router
+    """
+    router = ReplicaRouter.from_config(pool, app.config)
+    app.extensions['p2rest_router'] = router
+    return router
+
+
+def get_router(app=None):
+    """
+    Returns the replica router of the given or current flask application
+    """
+    if app is None:
+        app = current_app
+    return app.extensions['p2rest_router']
+
+
+def requires_primary():
+    """
+    Returns true if the current request has to see all committed writes, i.e. it has the header
+    "X-P2Rest-Consistency: primary"
+    """
+    return has_request_context() and request.headers.get(CONSISTENCY_HEADER, '').strip().lower() == 'primary'
+
+
+def get_read_pool(app=None):
+    """
+    Returns the connection pool for the read only statements of the current request. The primary is used if the
+    request requires it (see requires_primary)
+    """
+    return get_router(app).read_pool(primary=requires_primary())
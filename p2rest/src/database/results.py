@@ -0,0 +1,361 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+import psycopg2
+
+from p2rest.src.database.catalog import normalize_identifier
+from p2rest.src.database.converters import RenderedRows, CountedRows
+
+# Write counters of the cached tables. The statistics are flushed by the writing backends after their transaction
+# ended, so they can lag behind the writes for about a second
+QUERY_WRITE_COUNTERS = """
+    SELECT schemaname::text, relname::text, n_tup_ins, n_tup_upd, n_tup_del, n_live_tup, n_dead_tup
+    FROM pg_stat_user_tables
+    WHERE schemaname = ANY(%s) AND relname = ANY(%s)
+"""
+
+# Trigger that notifies all p2rest workers about writes to a table
+WRITE_TRIGGER = """
+    CREATE OR REPLACE FUNCTION public.p2rest_notify_write() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_notify(TG_ARGV[0], TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$;
+    DROP TRIGGER IF EXISTS p2rest_notify_write ON {relation};
+    CREATE TRIGGER p2rest_notify_write AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {relation}
+        FOR EACH STATEMENT EXECUTE PROCEDURE public.p2rest_notify_write(%s);
+"""
+
+# Amount of rows that are serialized to estimate the size of a result
+SIZE_SAMPLE = 20
+
+
+def split_relation(name):
+    """
+    Splits a qualified relation name ("schema.relation") into the names stored in the catalog
+    :param name: The qualified name, schema and relation may be quoted
+    :return: Tuple of schema and relation name or None if the name is not valid
+    """
+    parts = [part.strip() for part in name.split('.')]
+    if len(parts) != 2:
+        return None
+    schema, relation = normalize_identifier(parts[0]), normalize_identifier(parts[1])
+    if schema is None or relation is None:
+        return None
+    return schema, relation
+
+
+def parse_relations(value, ttl):
+    """
+    Parses the relations the result cache is enabled for
+    :param value: Either a dictionary of "schema.relation" to the ttl in seconds or a comma separated string of
+                  "schema.relation" or "schema.relation=ttl"
+    :param ttl: Time to live of relations without an explicit one
+    :return: Dictionary of (schema, relation) to ttl
+    """
+    if isinstance(value, dict):
+        items = [(name, relation_ttl) for name, relation_ttl in value.items()]
+    else:
+        items = []
+        for item in (value or '').split(','):
+            if not item.strip():
+                continue
+            name, _, relation_ttl = item.partition('=')
+            items.append((name, float(relation_ttl) if relation_ttl.strip() else None))
+
+    relations = {}
+    for name, relation_ttl in items:
+        key = split_relation(name)
+        if key is None:
+            raise ValueError('Invalid relation for the result cache: {}'.format(name))
+        relations[key] = ttl if relation_ttl is None else relation_ttl
+    return relations
+
+
+def estimate_size(data):
+    """
+    Estimates the memory a result needs from the json size of a few rows
+    :param data: Result of Postgres.query_select
+    :return: Estimated size in bytes
+    """
+    if isinstance(data, CountedRows):
+        return estimate_size(data.data)
+    if isinstance(data, RenderedRows):
+        return len(data.data)
+    rows = data['rows'] if isinstance(data, dict) else data
+    if not rows:
+        return 64
+    sample = rows[:SIZE_SAMPLE]
+    return int(len(json.dumps(sample, default=str)) * len(rows) / len(sample))
+
+
+class ResultCache(object):
+    """
+    In process cache for the results of selects. It is enabled per relation and keyed by the canonical form of the
+    select arguments. The size of all entries is limited, the least recently used ones are evicted first. Entries
+    expire after the ttl of their relation and are invalidated when the write counters of the table in
+    pg_stat_user_tables change, when a notification with the name of the relation arrives (see install_write_trigger)
+    or when the catalog changes. The counters are read from the primary, so only results read from the primary are
+    stored; results of a lagging replica could be older than the counters they are checked against. Misses are
+    therefore read from the primary, hits are served without reading from any server.
+    """
+
+    def __init__(self, pool, relations=None, max_bytes=64 * 1024 * 1024, check_interval=1,
+                 channel='p2rest_results'):
+        """
+        Create a new result cache
+        :param pool: The connection pool used for reading the write counters
+        :param relations: Dictionary of (schema, relation) to the ttl in seconds of the relations that are cached
+        :param max_bytes: Maximum estimated size of all entries
+        :param check_interval: Minimum seconds between two checks of the write counters. 0 disables the check
+        :param channel: The channel of the notifications about writes
+        """
+        self.pool = pool
+        self.relations = relations or {}
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.channel = channel
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._generations = {}
+        self._counters = {}
+        self._last_check = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_config(cls, pool, config):
+        """
+        Creates a result cache from the flask configuration
+        """
+        return cls(pool,
+                   relations=parse_relations(config['P2REST_RESULT_CACHE_RELATIONS'],
+                                             config['P2REST_RESULT_CACHE_TTL']),
+                   max_bytes=config['P2REST_RESULT_CACHE_MAX_BYTES'],
+                   check_interval=config['P2REST_RESULT_CACHE_CHECK_INTERVAL'],
+                   channel=config['P2REST_RESULT_CACHE_CHANNEL'])
+
+    def get_relation(self, args):
+        """
+        Returns the relation of a select if its results are cached
+        :param args: The arguments of Postgres.query_select
+        :return: Tuple of schema and relation name or None
+        """
+        if not self.relations:
+            return None
+        relation = (normalize_identifier(args['schema']), normalize_identifier(args['relation']))
+        return relation if relation in self.relations else None
+
+    @classmethod
+    def make_key(cls, args):
+        """
+        Creates the cache key of a select. Dictionaries are sorted, so requests that only differ in the order of their
+        keys share an entry
+        :param args: The arguments of Postgres.query_select
+        :return: The key as string
+        """
+        return json.dumps({key: value for key, value in args.items() if key not in ('pool', 'governor', 'analytics')},
+                          sort_keys=True, separators=(',', ':'), default=str)
+
+    def get(self, args, primary=False):
+        """
+        Looks up the result of a select
+        :param args: The arguments of Postgres.query_select. On a miss their pool is replaced with the pool of the
+                     cache, so the select is read from the primary and its result can be stored
+        :param primary: If true the select has to see all committed writes. The cache is not read, because the write
+                        counters lag behind the writes, but the result is stored
+        :return: Tuple of the cached result (None on a miss) and a token that has to be passed to put. The token is
+                 None if the select can not be cached
+        """
+        relation = self.get_relation(args)
+        if relation is None:
+            self.skipped += 1
+            return None, None
+        self._check_writes()
+
+        key = self.make_key(args)
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generations.get(relation, 0)
+            token = (key, relation, generation)
+            if primary:
+                self.bypassed += 1
+                args['pool'] = self.pool
+                return None, token
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['expires'] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry['data'], None
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            args['pool'] = self.pool
+            return None, token
+
+    def put(self, token, data):
+        """
+        Stores the result of a select. The result is dropped if the relation was invalidated since the lookup,
+        because it may have been read before the write that caused the invalidation
+        :param token: The token returned by get
+        :param data: The result of Postgres.query_select
+        """
+        if token is None:
+            return
+        key, relation, generation = token
+        size = estimate_size(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._generations.get(relation, 0) != generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {'data': data, 'relation': relation, 'size': size,
+                                  'expires': time.monotonic() + self.relations[relation]}
+            self._keys.setdefault(relation, set()).add(key)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """
+        Removes an entry, the caller has to hold the lock
+        """
+        entry = self._entries.pop(key)
+        self._keys[entry['relation']].discard(key)
+        self.size -= entry['size']
+
+    def invalidate(self, relation=None):
+        """
+        Removes all entries of a relation
+        :param relation: Tuple of schema and relation name. None invalidates all relations
+        """
+        with self._lock:
+            relations = list(self.relations) if relation is None else [relation]
+            for name in relations:
+                self._generations[name] = self._generations.get(name, 0) + 1
+                for key in list(self._keys.get(name, ())):
+                    self._remove(key)
+            self.invalidations += 1
+
+    def notify(self, payload):
+        """
+        Handles a notification about a write. The payload is the qualified name of the relation. Notifications without
+        a payload invalidate all relations
+        """
+        if payload is None:
+            self.invalidate()
+            return
+        relation = split_relation(payload)
+        if relation is not None:
+            self.invalidate(relation)
+
+    def _check_writes(self):
+        """
+        Reads the write counters of the cached tables (at most once per check_interval) and invalidates the
+        relations whose counters changed
+        """
+        if not self.check_interval or time.monotonic() - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_check < self.check_interval:
+                return
+            self._last_check = time.monotonic()
+
+        schemata = [schema for schema, _ in self.relations]
+        names = [name for _, name in self.relations]
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(QUERY_WRITE_COUNTERS, [schemata, names])
+                rows = cursor.fetchall()
+                cursor.close()
+        except psycopg2.Error as error:
+            logging.error('We could not read the write counters: %s', str(error.args))
+            self.invalidate()
+            return
+
+        for schema, name, *counters in rows:
+            relation = (schema, name)
+            if relation not in self.relations:
+                continue
+            if self._counters.get(relation, counters) != counters:
+                self.invalidate(relation)
+            self._counters[relation] = counters
+
+    def stats(self):
+        """
+        Returns information about the usage of the cache
+        :return: dictionary with the cache statistics
+        """
+        lookups = self.hits + self.misses
+        return {
+            'relations': len(self.relations),
+            'entries': len(self._entries),
+            'size': self.size,
+            'max_size': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'skipped': self.skipped,
+            'bypassed': self.bypassed,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations
+        }
+
+    def install_write_trigger(self, relation):
+        """
+        Installs a trigger that notifies the workers about writes to a table
+        :param relation: Qualified name of the table ("schema.relation")
+        """
+        names = split_relation(relation)
+        if names is None:
+            raise ValueError('Invalid relation: {}'.format(relation))
+        qualified = '.'.join('"{}"'.format(name.replace('"', '""')) for name in names)
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(WRITE_TRIGGER.format(relation=qualified), [self.channel])
+            connection.commit()
+            cursor.close()
+
+
+def init_result_cache(app, pool, catalog):
+    """
+    Creates the result cache of the application. The cache can be retrieved later with get_result_cache
+    :param app: The flask application
+    :param pool: The connection pool used for reading the write counters
+    :param catalog: The catalog cache whose listener passes on the notifications
+    :return: The new result cache
+    """
+    results = ResultCache.from_config(pool, app.config)
+    if results.relations:
+        catalog.subscribe(results.channel, results.notify)
+        # DDL statements can change the result of every select
+        catalog.subscribe(catalog.channel, lambda payload: results.invalidate())
+    app.extensions['p2rest_results'] = results
+    return results
+
+
+def get_result_cache(app=None):
+    """
+    Returns the result cache of the given or current flask application
+    """
+    if app is None:
+        app = current_app
+    return app.extensions['p2rest_results']
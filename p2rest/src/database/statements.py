@@ -0,0 +1,188 @@
+import re
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+import psycopg2
+from psycopg2 import errors
+
+from p2rest.src import timing
+
+PLACEHOLDER = re.compile(r'%%|%s')
+
+# savepoint set before prepared statements are executed without a savepoint of the caller
+STATEMENT_SAVEPOINT = 'p2rest_statement'
+
+
+class CompiledStatement(object):
+    """
+    A parameterized statement (psycopg2 '%s' placeholders) together with the statements used to prepare and execute
+    it on the server
+    """
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+        self.uses = 0
+        self.parameters = 0
+
+        def replace(match):
+            if match.group(0) == '%%':
+                return '%'
+            self.parameters += 1
+            return '$' + str(self.parameters)
+
+        self.prepare_query = 'PREPARE {name} AS {query}'.format(name=name, query=PLACEHOLDER.sub(replace, query))
+        if self.parameters:
+            self.execute_query = 'EXECUTE {name} ({placeholders})'.format(
+                name=name, placeholders=', '.join(['%s'] * self.parameters))
+        else:
+            self.execute_query = 'EXECUTE {name}'.format(name=name)
+
+
+class StatementCache(object):
+    """
+    LRU cache of parameterized statements keyed by their query text, which is the same for all requests of the same
+    shape (schema, relation, fields, filter tree, order) since the values are passed as parameters. Statements that
+    were used more often than prepare_threshold are prepared on the server (PREPARE / EXECUTE), so postgres can reuse
+    their plan instead of parsing and planning the statement on every request. Prepared statements are tracked per
+    connection.
+    """
+
+    def __init__(self, max_size=256, prepare_threshold=5):
+        """
+        Create a new statement cache
+        :param max_size: Maximum amount of statements kept in the cache
+        :param prepare_threshold: Amount of uses after which a statement is prepared. 0 disables prepared statements
+        """
+        self.max_size = max_size
+        self.prepare_threshold = prepare_threshold
+
+        self._lock = threading.Lock()
+        self._statements = OrderedDict()
+        self._prepared = weakref.WeakKeyDictionary()
+        self._counter = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prepares = 0
+        self.prepared_executions = 0
+
+    def get(self, query):
+        """
+        Returns the compiled statement for a query and updates its usage
+        :param query: Parameterized query
+        :return: CompiledStatement
+        """
+        with self._lock:
+            statement = self._statements.get(query)
+            if statement is not None:
+                self._statements.move_to_end(query)
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._counter += 1
+                statement = CompiledStatement('p2rest_{}'.format(self._counter), query)
+                self._statements[query] = statement
+                while len(self._statements) > self.max_size:
+                    self._statements.popitem(last=False)
+                    self.evictions += 1
+            statement.uses += 1
+            return statement
+
+    def _prepared_names(self, connection):
+        with self._lock:
+            names = self._prepared.get(connection)
+            if names is None:
+                names = set()
+                self._prepared[connection] = names
+            return names
+
+    def _deallocate_evicted(self, cursor, names):
+        """
+        Removes prepared statements from the connection that are no longer in the cache
+        """
+        if len(names) <= self.max_size:
+            return
+        with self._lock:
+            alive = {statement.name for statement in self._statements.values()}
+        for name in names - alive:
+            cursor.execute('DEALLOCATE {name}'.format(name=name))
+            names.discard(name)
+
+    def execute(self, cursor, query, params, savepoint=None):
+        """
+        Executes a parameterized query. Hot statements are executed as prepared statements, except on named (server
+        side) cursors, because postgres can not declare a cursor for an EXECUTE.
+        :param cursor: The cursor the query is executed on
+        :param query: Parameterized query
+        :param params: Values for the placeholders
+        :param savepoint: Savepoint that is rolled back to when the statement has to be prepared again. Without it
+                          a savepoint is set before the execution, so the transaction and its settings (e.g. the
+                          SET LOCAL timeouts of the governor) are kept
+        """
+        with timing.span('execute'):
+            self._execute(cursor, query, params, savepoint)
+
+    def _execute(self, cursor, query, params, savepoint):
+        statement = self.get(query)
+        if not self.prepare_threshold or statement.uses < self.prepare_threshold or cursor.name is not None:
+            cursor.execute(query, params)
+            return
+
+        names = self._prepared_names(cursor.connection)
+        try:
+            self._execute_prepared(cursor, statement, names, params, savepoint is None)
+        except (errors.InvalidSqlStatementName, errors.FeatureNotSupported) as error:
+            # the statement was deallocated on the server or the result type changed after a schema change
+            logging.info('Preparing statement %s again: %s', statement.name, str(error.args))
+            savepoint = savepoint or STATEMENT_SAVEPOINT
+            self._rollback(cursor, savepoint)
+            if statement.name in names:
+                names.discard(statement.name)
+                try:
+                    cursor.execute('DEALLOCATE {name}'.format(name=statement.name))
+                except psycopg2.Error:
+                    self._rollback(cursor, savepoint)
+            self._execute_prepared(cursor, statement, names, params)
+
+    @staticmethod
+    def _rollback(cursor, savepoint):
+        cursor.execute('ROLLBACK TO SAVEPOINT {name}'.format(name=savepoint))
+
+    def _execute_prepared(self, cursor, statement, names, params, savepoint=False):
+        if statement.name not in names:
+            self._deallocate_evicted(cursor, names)
+            cursor.execute(statement.prepare_query)
+            names.add(statement.name)
+            with self._lock:
+                self.prepares += 1
+        else:
+            with self._lock:
+                self.prepared_executions += 1
+        if savepoint:
+            # the savepoint is set in the same round trip as the execution
+            cursor.execute('SAVEPOINT {name}; {query}'.format(name=STATEMENT_SAVEPOINT, query=statement.execute_query),
+                           params)
+        else:
+            cursor.execute(statement.execute_query, params)
+
+    def stats(self):
+        """
+        Returns the usage statistics of the cache
+        :return: dictionary with the statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            executions = self.prepares + self.prepared_executions
+            return {
+                'size': len(self._statements),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'prepares': self.prepares,
+                'prepared_executions': self.prepared_executions,
+                'plan_reuse_rate': self.prepared_executions / executions if executions else 0.0
+            }
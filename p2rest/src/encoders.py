@@ -0,0 +1,108 @@
+import json
+import logging
+from flask import current_app, Response
+from p2rest.src import timing
+from p2rest.src.database.converters import convert_value
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional, without it the standard library encoder is used
+    orjson = None
+
+# names of the encoders, 'auto' uses orjson if it is installed
+ENCODERS = ('auto', 'orjson', 'json')
+
+
+def default(value):
+    """
+    Converts values the encoders do not support natively, e.g. of results that did not pass a row converter
+    """
+    converted = convert_value(value)
+    return str(value) if converted is value else converted
+
+
+def dumps_json(value):
+    """
+    Encodes a value with the json module of the standard library
+    :return: The json document as bytes
+    """
+    return json.dumps(value, default=default).encode()
+
+
+def dumps_orjson(value):
+    """
+    Encodes a value with orjson. NaN and infinity are encoded as null
+    :return: The json document as bytes
+    """
+    return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def create_encoder(name):
+    """
+    Returns the encoding function of an encoder
+    :param name: One of ENCODERS
+    :return: Function encoding a value as json bytes
+    """
+    if name not in ENCODERS:
+        raise ValueError('Unknown json encoder {}'.format(name))
+    if name == 'orjson' and orjson is None:
+        raise ValueError('The json encoder orjson needs the package orjson')
+    if name == 'orjson' or (name == 'auto' and orjson is not None):
+        return dumps_orjson
+    return dumps_json
+
+
+def init_encoder(app):
+    """
+    Selects the json encoder of the row payloads. It can be retrieved later with get_encoder
+    :param app: The flask application
+    :return: The encoding function
+    """
+    encoder = create_encoder(app.config['P2REST_JSON_ENCODER'])
+    logging.info('JSON encoder: %s (P2REST_JSON_ENCODER=%s)', 'orjson' if encoder is dumps_orjson else 'json',
+                 app.config['P2REST_JSON_ENCODER'])
+    app.extensions['p2rest_encoder'] = encoder
+    return encoder
+
+
+def get_encoder(app=None):
+    """
+    Returns the json encoding function of the given or current flask application
+    """
+    if app is None:
+        app = current_app
+    return app.extensions['p2rest_encoder']
+
+
+def dumps(value):
+    """
+    Encodes a value with the json encoder of the current application
+    :return: The json document as bytes
+    """
+    return get_encoder()(value)
+
+
+def envelope(response, model):
+    """
+    Orders the response envelope like the swagger model, fields that are not set are null. Unlike marshal the values,
+    the rows in particular, are not walked, so they have to be of the documented types already
+    :param response: The response envelope
+    :param model: The swagger model of the response
+    :return: Dictionary of the envelope
+    """
+    return {key: response.get(key) for key in model}
+
+
+def render(response, model, status=200):
+    """
+    Renders a response envelope with the json encoder of the current application. The swagger model only documents
+    the response, the rows are written by the encoder directly
+    :param response: The response envelope
+    :param model: The swagger model of the response
+    :param status: The http status code
+    :return: Response
+    """
+    with timing.span('serialize'):
+        body = dumps(envelope(response, model))
+    return Response(body + b'\n', status=status, mimetype='application/json')
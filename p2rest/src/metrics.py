@@ -0,0 +1,165 @@
+import os
+from time import perf_counter_ns
+from flask import g, request, current_app, has_request_context
+from werkzeug.exceptions import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+
+# Directory of the metric files of all gunicorn workers. If it is set, /metrics aggregates the metrics of all workers
+MULTIPROCESS_DIRECTORY = 'prometheus_multiproc_dir'
+
+# The metrics are created once per process and shared by all applications of the process
+REQUEST_DURATION = Histogram('p2rest_request_duration_seconds', 'Total duration of the requests',
+                             ['endpoint', 'method', 'status'])
+PHASE_DURATIONS = {
+    'connect': Histogram('p2rest_db_connection_seconds', 'Time spent waiting for pooled connections per request',
+                         ['endpoint']),
+    'compile': Histogram('p2rest_query_compile_seconds', 'Time spent building sql statements per request',
+                         ['endpoint']),
+    'execute': Histogram('p2rest_db_execute_seconds', 'Time spent executing sql statements per request',
+                         ['endpoint']),
+    'fetch': Histogram('p2rest_db_fetch_seconds', 'Time spent fetching rows per request', ['endpoint']),
+    'convert': Histogram('p2rest_row_conversion_seconds', 'Time spent converting rows per request', ['endpoint']),
+    'serialize': Histogram('p2rest_serialization_seconds', 'Time spent rendering responses per request',
+                           ['endpoint'])
+}
+ROWS = Histogram('p2rest_rows_returned', 'Rows returned per request', ['endpoint'],
+                 buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000, float('inf')))
+RESPONSE_BYTES = Histogram('p2rest_response_bytes', 'Size of the response bodies', ['endpoint'],
+                           buckets=(100, 1000, 10000, 100000, 1000000, 10000000, 100000000, float('inf')))
+RELATION_QUERIES = Counter('p2rest_relation_queries_total', 'Queries per relation and operation',
+                           ['schema', 'relation', 'operation'])
+ERRORS = Counter('p2rest_errors_total', 'Failed requests by exception class', ['endpoint', 'exception'])
+POOL_CONNECTIONS = Gauge('p2rest_pool_connections', 'Connections of the pools by state', ['pool', 'state'],
+                         multiprocess_mode='livesum')
+POOL_MAX_CONNECTIONS = Gauge('p2rest_pool_max_connections', 'Maximum size of the pools', ['pool'],
+                             multiprocess_mode='livesum')
+
+
+def _current():
+    """
+    Returns the measurements of the current request or None outside of requests (e.g. in worker threads)
+    """
+    if not has_request_context():
+        return None
+    return g.get('p2rest_metrics')
+
+
+def count_rows(rows):
+    """
+    Adds rows to the amount of rows returned by the current request
+    """
+    current = _current()
+    if current is not None:
+        current['rows'] += rows
+
+
+def count_query(schema, relation, operation):
+    """
+    Counts a query on a relation
+    :param operation: select, aggregate, count, ingest or export
+    """
+    RELATION_QUERIES.labels(schema=schema.strip('"'), relation=relation.strip('"'), operation=operation).inc()
+
+
+def record_error(error):
+    """
+    Counts a failed request. For errors the service converted into http errors the class of the original exception is
+    used (e.g. the psycopg2 error behind an InternalServerError)
+    """
+    if g.get('p2rest_metrics') is None:
+        return
+    cause = error.__cause__ or error.__context__
+    if isinstance(error, HTTPException) and cause is not None and not isinstance(cause, HTTPException):
+        error = cause
+    ERRORS.labels(endpoint=request.endpoint or 'none', exception=type(error).__name__).inc()
+
+
+class CountingIterable(object):
+    """
+    Wraps the body of a streamed response and counts the bytes sent
+    """
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.bytes = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+
+
+def _before_request():
+    g.p2rest_metrics = {'rows': 0}
+
+
+def _pools():
+    """
+    Returns the name and the pool of the primary and of every replica, replicas are named by their position
+    """
+    pools = []
+    pool = current_app.extensions.get('p2rest_pool')
+    if pool is not None:
+        pools.append(('primary', pool))
+    router = current_app.extensions.get('p2rest_router')
+    if router is not None:
+        pools.extend(('replica-{}'.format(index), prober.pool) for index, prober in enumerate(router.replicas))
+    return pools
+
+
+def _after_request(response):
+    current = g.get('p2rest_metrics')
+    timings = g.get('p2rest_timing')
+    if current is None or timings is None:
+        return response
+    labels = {'endpoint': request.endpoint or 'none', 'method': request.method, 'status': str(response.status_code)}
+    for name, pool in _pools():
+        stats = pool.stats()
+        POOL_CONNECTIONS.labels(pool=name, state='idle').set(stats['idle'])
+        POOL_CONNECTIONS.labels(pool=name, state='used').set(stats['used'])
+        POOL_MAX_CONNECTIONS.labels(pool=name).set(stats['max_size'])
+
+    if not response.is_streamed:
+        _observe(current, timings, labels, response.content_length or 0)
+        return response
+    # streamed responses are measured after the last chunk was sent, the rows are converted while sending
+    body = CountingIterable(response.response)
+    response.response = body
+    response.call_on_close(lambda: _observe(current, timings, labels, body.bytes))
+    return response
+
+
+def _observe(current, timings, labels, size):
+    endpoint = labels['endpoint']
+    REQUEST_DURATION.labels(**labels).observe((perf_counter_ns() - timings['start']) / 1e9)
+    for phase, nanoseconds in timings['spans'].items():
+        PHASE_DURATIONS[phase].labels(endpoint=endpoint).observe(nanoseconds / 1e9)
+    if current['rows'] or 'convert' in timings['spans']:
+        ROWS.labels(endpoint=endpoint).observe(current['rows'])
+    RESPONSE_BYTES.labels(endpoint=endpoint).observe(size)
+
+
+def init_metrics(app):
+    """
+    Registers the metrics endpoint and the request hooks of the application. With gunicorn the environment variable
+    prometheus_multiproc_dir has to point to an empty directory, so the endpoint reports the metrics of all workers
+    :param app: The flask application
+    :return: The metrics exporter or None if the metrics are disabled
+    """
+    if not app.config['P2REST_METRICS']:
+        return None
+    if MULTIPROCESS_DIRECTORY in os.environ:
+        exporter = GunicornInternalPrometheusMetrics(app, path=app.config['P2REST_METRICS_PATH'],
+                                                     export_defaults=False)
+    else:
+        exporter = PrometheusMetrics(app, path=app.config['P2REST_METRICS_PATH'], export_defaults=False)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.extensions['p2rest_metrics'] = exporter
+    return exporter
@@ -0,0 +1,124 @@
+import datetime
+from contextlib import contextmanager
+from time import perf_counter_ns
+from flask import g, has_request_context, current_app, json
+
+# The phases of a request in the order they are reported
+PHASES = ('connect', 'compile', 'execute', 'fetch', 'convert', 'serialize')
+DESCRIPTIONS = {
+    'connect': 'Waiting for a pooled connection',
+    'compile': 'Building the sql statement',
+    'execute': 'Executing the statement',
+    'fetch': 'Fetching the rows',
+    'convert': 'Converting the rows',
+    'serialize': 'Rendering the response',
+}
+
+
+def _current():
+    """
+    Returns the timings of the current request or None outside of requests (e.g. in worker threads)
+    """
+    if not has_request_context():
+        return None
+    return g.get('p2rest_timing')
+
+
+def start():
+    """
+    Starts the timings of the current request
+    """
+    g.p2rest_timing = {'start': perf_counter_ns(), 'spans': {}}
+
+
+def add(phase, nanoseconds):
+    """
+    Adds time spent in a phase to the current request
+    :param phase: One of PHASES
+    :param nanoseconds: The time spent
+    """
+    current = _current()
+    if current is not None:
+        current['spans'][phase] = current['spans'].get(phase, 0) + nanoseconds
+
+
+@contextmanager
+def span(phase):
+    """
+    Context manager measuring the time spent in a phase of the current request. Spans of the same phase add up
+    """
+    begin = perf_counter_ns()
+    try:
+        yield
+    finally:
+        add(phase, perf_counter_ns() - begin)
+
+
+def spans():
+    """
+    Returns the time spent per phase of the current request in nanoseconds
+    """
+    current = _current()
+    return dict(current['spans']) if current is not None else {}
+
+
+def elapsed():
+    """
+    Returns the nanoseconds since the start of the current request
+    """
+    current = _current()
+    return perf_counter_ns() - current['start'] if current is not None else 0
+
+
+def duration(start_time=None):
+    """
+    Returns the duration of the current request for the duration field of the responses, formatted like a timedelta
+    but measured with the monotonic clock
+    :param start_time: Start of the measurement as returned by perf_counter_ns, by default the start of the request
+    """
+    nanoseconds = perf_counter_ns() - start_time if start_time is not None else elapsed()
+    return str(datetime.timedelta(microseconds=nanoseconds // 1000))
+
+
+def get_timings():
+    """
+    Returns the timings of the current request in milliseconds, as added to the response envelope
+    """
+    current = spans()
+    timings = {phase: round(current[phase] / 1e6, 3) for phase in PHASES if phase in current}
+    timings['total'] = round(elapsed() / 1e6, 3)
+    return timings
+
+
+def server_timing():
+    """
+    Returns the Server-Timing header of the current request
+    """
+    return ', '.join('{};desc="{}";dur={}'.format(phase, DESCRIPTIONS.get(phase, phase), milliseconds)
+                     if phase != 'total' else '{};dur={}'.format(phase, milliseconds)
+                     for phase, milliseconds in get_timings().items())
+
+
+def _after_request(response):
+    if _current() is None:
+        return response
+    if current_app.config['P2REST_SERVER_TIMING']:
+        # streamed responses send their headers first, so only the phases until then are included
+        response.headers['Server-Timing'] = server_timing()
+    if current_app.config['P2REST_TIMING_ENVELOPE'] and not response.is_streamed and \
+            response.mimetype == 'application/json':
+        # the timings are appended to the rendered envelope instead of parsing and rendering it again
+        body = response.get_data().rstrip()
+        if body.startswith(b'{') and body.endswith(b'}') and body != b'{}':
+            response.set_data(body[:-1] + b', "timings": ' + json.dumps(get_timings()).encode() + b'}\n')
+    return response
+
+
+def init_timing(app):
+    """
+    Registers the request hooks that measure the phases of every request and report them in the Server-Timing header
+    and, with P2REST_TIMING_ENVELOPE, in a timings object of the json responses
+    :param app: The flask application
+    """
+    app.before_request(start)
+    app.after_request(_after_request)
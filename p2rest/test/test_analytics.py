@@ -0,0 +1,173 @@
+"""
+Test module for the query analytics and the index advisor
+"""
+import json
+import time
+import unittest
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.analytics import get_analytics
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL,
+        price integer NOT NULL
+    );
+    INSERT INTO public.{table_name} SELECT i, 'Manufacturer ' || (i % 100), i % 1000 FROM generate_series(1, 20000) i;
+    CREATE INDEX ON public.{table_name} (price);
+    ANALYZE public.{table_name};
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+class TestAnalytics(unittest.TestCase):
+    """
+    Test case for the recording of the query shapes and the suggested indexes
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table, every select is recorded
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.admin_header = {'Authorization': 'Bearer ' + self.app.config['P2REST_ADMIN_API_KEY']}
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+        self.analytics = get_analytics(self.app)
+        self.analytics.sample_rate = 1
+        self.analytics.min_rows = 1000
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            connection.commit()
+
+    def select(self, headers=None, **kwargs):
+        request_data = dict({'schema': 'public', 'relation': self._testMethodName}, **kwargs)
+        response = self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json',
+                                      headers=headers or {})
+        self.assertEqual(response.status_code, 200)
+        # streamed responses keep their connection until they were read
+        response.get_data()
+        response.close()
+        return response
+
+    def test_query_shapes(self):
+        """
+        Selects that only differ in their values share a shape, the shapes are listed by frequency or latency
+        :return:
+        """
+        for manufacturer in ('Manufacturer 1', 'Manufacturer 2', 'Manufacturer 3'):
+            self.select(filter={'column': 'manufacturer', 'operator': '=', 'value': manufacturer}, limit=10)
+        self.select(filter={'column': 'id', 'operator': 'in', 'value': [1, 2, 3]})
+        self.select(headers={'Accept': 'application/x-ndjson'}, limit=250, order_fields=['id'])
+
+        response = self.client().get('/admin/queries?order=frequent', headers=self.admin_header)
+        self.assertEqual(response.status_code, 200)
+        data = response.json
+        self.assertEqual(data['data']['statistics']['samples'], 5)
+        self.assertEqual(data['data']['statistics']['shapes'], 3)
+        shapes = data['data']['shapes']
+        self.assertEqual(shapes[0]['samples'], 3)
+        self.assertEqual(shapes[0]['calls'], 3)
+        self.assertEqual(shapes[0]['mean_rows'], 10)
+        self.assertEqual(shapes[0]['filter'], [{'column': 'manufacturer', 'operator': '='}])
+        self.assertNotIn('Manufacturer 1', shapes[0]['query'])
+        self.assertEqual({shape['mean_rows'] for shape in shapes[1:]}, {3, 250})
+
+        response = self.client().get('/admin/queries?order=slowest&limit=1', headers=self.admin_header)
+        self.assertEqual(len(response.json['data']['shapes']), 1)
+        self.assertEqual(self.client().get('/admin/queries?order=fastest', headers=self.admin_header).status_code, 400)
+        self.assertEqual(self.client().get('/admin/queries?limit=all', headers=self.admin_header).status_code, 400)
+
+        self.assertEqual(self.client().delete('/admin/queries', headers=self.admin_header).status_code, 200)
+        self.assertEqual(self.client().get('/admin/queries', headers=self.admin_header).json['data']['shapes'], [])
+
+        self.analytics.sample_rate = 0
+        self.select(filter={'column': 'manufacturer', 'operator': '=', 'value': 'Manufacturer 1'})
+        self.assertEqual(self.analytics.shapes(), [])
+
+    def test_index_advisor(self):
+        """
+        Indexes are suggested for filter columns and order fields no index starts with
+        :return:
+        """
+        self.select(filter={'operator': 'and', 'childs': [
+            {'column': 'manufacturer', 'operator': '=', 'value': 'Manufacturer 1'},
+            {'column': 'id', 'operator': '>', 'value': 100}]}, order_fields=['id'])
+        # served by the index of the price and by the primary key
+        self.select(filter={'column': 'price', 'operator': 'between', 'value': [1, 5]})
+        self.select(filter={'column': 'id', 'operator': 'in', 'value': [1, 2, 3]})
+        self.select(order_fields=['id'])
+        # no single index serves both columns of an or
+        self.select(filter={'operator': 'or', 'childs': [
+            {'column': 'manufacturer', 'operator': '=', 'value': 'Manufacturer 1'},
+            {'column': 'price', 'operator': '=', 'value': 1}]})
+        self.select(order_fields=['manufacturer'], limit=5)
+
+        # the scan counters of the table are updated shortly after the transactions ended
+        deadline = time.monotonic() + 5
+        while True:
+            response = self.client().get('/admin/indexes', headers=self.admin_header)
+            self.assertEqual(response.status_code, 200)
+            suggestions = response.json['data']
+            if suggestions or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        self.assertEqual(len(suggestions), 2)
+        self.assertEqual({tuple(suggestion['columns']) for suggestion in suggestions},
+                         {('manufacturer', 'id'), ('manufacturer',)})
+        for suggestion in suggestions:
+            self.assertEqual(suggestion['schema'], 'public')
+            self.assertEqual(suggestion['relation'], self._testMethodName)
+            self.assertEqual(suggestion['shapes'], 1)
+            self.assertGreater(suggestion['seq_scan'], 0)
+            self.assertEqual(suggestion['live_rows'], 20000)
+        self.assertIn('CREATE INDEX ON "public"."{}" ("manufacturer", "id")'.format(self._testMethodName),
+                      [suggestion['statement'] for suggestion in suggestions])
+
+        # the suggested index serves all shapes
+        self.execute('CREATE INDEX ON public.{} (manufacturer, id)'.format(self._testMethodName))
+        self.app.extensions['p2rest_catalog'].invalidate()
+        self.assertEqual(self.client().get('/admin/indexes', headers=self.admin_header).json['data'], [])
+
+        # small tables are read sequentially anyway
+        self.execute('DROP INDEX public.{}_manufacturer_id_idx'.format(self._testMethodName))
+        self.app.extensions['p2rest_catalog'].invalidate()
+        self.analytics.min_rows = 100000
+        self.assertEqual(self.client().get('/admin/indexes', headers=self.admin_header).json['data'], [])
+
+    def test_admin_api_key(self):
+        """
+        The admin endpoints require the api key and are disabled without one, the health endpoints do not serve them
+        :return:
+        """
+        for path in ('/admin/statistics', '/admin/queries', '/admin/indexes'):
+            self.assertEqual(self.client().get(path).status_code, 401)
+            self.assertEqual(self.client().get(path, headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+            self.assertEqual(self.client().get(path, headers=self.admin_header).status_code, 200)
+        self.assertEqual(self.client().delete('/admin/queries').status_code, 401)
+        self.assertEqual(self.client().get('/health/statistics').status_code, 404)
+        self.assertEqual(self.client().delete('/health/queries').status_code, 404)
+
+        self.app.config['P2REST_ADMIN_API_KEY'] = ''
+        self.assertEqual(self.client().get('/admin/statistics', headers={'Authorization': 'Bearer '}).status_code,
+                         403)
+
+
+if __name__ == '__main__':
+    unittest.main()
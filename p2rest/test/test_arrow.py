@@ -0,0 +1,186 @@
+"""
+Test module for the arrow and parquet output of selects and exports
+"""
+import datetime
+import decimal
+import io
+import json
+import unittest
+from p2rest.test.helper.test_helper import check_common_data
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.arrow import pyarrow, ARROW_MIMETYPE, PARQUET_MIMETYPE
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL,
+        price numeric(10, 2) NULL,
+        sold boolean NOT NULL DEFAULT false,
+        registered date NULL,
+        updated timestamptz NULL,
+        tags text[] NULL,
+        attributes jsonb NULL,
+        location point NULL
+    );
+    INSERT INTO public.{table_name}
+    SELECT i, 'Manufacturer ' || i, i * 1.5, i % 2 = 0, DATE '2020-01-01' + i,
+           TIMESTAMPTZ '2020-01-01 00:00:00+00' + i * INTERVAL '1 hour', ARRAY['a', 'b' || i],
+           jsonb_build_object('hp', i), point(i, i)
+    FROM generate_series(1, 25) i;
+    INSERT INTO public.{table_name} (id, manufacturer) VALUES (26, 'Empty');
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestArrow(unittest.TestCase):
+    """
+    Test case for the columnar formats
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.app.config['P2REST_STREAM_BATCH_SIZE'] = 10
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            connection.commit()
+
+    def select(self, accept, **kwargs):
+        request_data = dict({'schema': 'public', 'relation': self._testMethodName, 'order_fields': ['id']}, **kwargs)
+        return self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json',
+                                  headers={'Accept': accept})
+
+    def test_select_arrow(self):
+        """
+        The rows are returned as arrow ipc stream with one record batch per batch of the cursor and typed columns
+        :return:
+        """
+        import pyarrow.ipc
+        response = self.select(ARROW_MIMETYPE)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, ARROW_MIMETYPE)
+        reader = pyarrow.ipc.open_stream(response.get_data())
+        batches = list(reader)
+        self.assertEqual([batch.num_rows for batch in batches], [10, 10, 6])
+        table = pyarrow.Table.from_batches(batches)
+        schema = table.schema
+        self.assertEqual(schema.field('id').type, pyarrow.int32())
+        self.assertEqual(schema.field('manufacturer').type, pyarrow.string())
+        self.assertEqual(schema.field('price').type, pyarrow.decimal128(10, 2))
+        self.assertEqual(schema.field('sold').type, pyarrow.bool_())
+        self.assertEqual(schema.field('registered').type, pyarrow.date32())
+        self.assertEqual(schema.field('updated').type, pyarrow.timestamp('us', tz='UTC'))
+        self.assertEqual(schema.field('tags').type, pyarrow.list_(pyarrow.string()))
+        self.assertEqual(schema.field('location').type, pyarrow.string())
+
+        rows = table.to_pylist()
+        self.assertEqual(rows[0]['id'], 1)
+        self.assertEqual(rows[0]['price'], decimal.Decimal('1.50'))
+        self.assertEqual(rows[0]['registered'], datetime.date(2020, 1, 2))
+        self.assertEqual(rows[0]['updated'], datetime.datetime(2020, 1, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(rows[0]['tags'], ['a', 'b1'])
+        self.assertEqual(json.loads(rows[0]['attributes']), {'hp': 1})
+        self.assertEqual(rows[0]['location'], '(1,1)')
+        self.assertEqual(rows[25], {'id': 26, 'manufacturer': 'Empty', 'price': None, 'sold': False,
+                                    'registered': None, 'updated': None, 'tags': None, 'attributes': None,
+                                    'location': None})
+        self.assertEqual(get_pool(self.app).stats()['used'], 0)
+
+    def test_select_parquet(self):
+        """
+        The rows are returned as parquet file, filters and limits apply like for json
+        :return:
+        """
+        import pyarrow.parquet
+        response = self.select(PARQUET_MIMETYPE, fields=['id', 'manufacturer'], limit=15,
+                               filter={'column': 'sold', 'operator': '=', 'value': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, PARQUET_MIMETYPE)
+        table = pyarrow.parquet.read_table(io.BytesIO(response.get_data()))
+        self.assertEqual(table.column_names, ['id', 'manufacturer'])
+        self.assertEqual(table.column('id').to_pylist(), list(range(2, 26, 2)))
+
+        # the batches of the cursor are collected into row groups, unconstrained numerics keep their digits as text
+        self.app.config['P2REST_PARQUET_ROW_GROUP_SIZE'] = 15
+        response = self.select(PARQUET_MIMETYPE, fields=['id', 'price / 3'])
+        parquet = pyarrow.parquet.ParquetFile(io.BytesIO(response.get_data()))
+        self.assertEqual([parquet.metadata.row_group(index).num_rows for index in range(parquet.num_row_groups)],
+                         [20, 6])
+        table = parquet.read()
+        self.assertEqual(table.schema.field('?column?').type, pyarrow.string())
+        self.assertEqual(table.column('?column?').to_pylist()[0], '0.50000000000000000000')
+
+    def test_select_errors(self):
+        """
+        Keyset pagination is not supported, errors of the query are reported before the response is started
+        :return:
+        """
+        response = self.select(ARROW_MIMETYPE, keyset=True)
+        self.assertEqual(response.status_code, 400)
+        check_common_data(self, response.json, response.status_code)
+
+        response = self.select(ARROW_MIMETYPE, fields=['id / 0'])
+        self.assertEqual(response.status_code, 500)
+        check_common_data(self, response.json, response.status_code)
+
+        response = self.select('application/json, {};q=0.5'.format(ARROW_MIMETYPE))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 26)
+
+    def test_select_disconnect(self):
+        """
+        The connection is returned to the pool if the client disconnects before reading the response
+        :return:
+        """
+        request_data = {'schema': 'public', 'relation': self._testMethodName}
+        response = self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json',
+                                      headers={'Accept': ARROW_MIMETYPE}, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        self.assertEqual(get_pool(self.app).stats()['used'], 0)
+
+    def test_export(self):
+        """
+        Exports can be written as arrow ipc stream or parquet file
+        :return:
+        """
+        import pyarrow.ipc
+        import pyarrow.parquet
+        request_data = {'schema': 'public', 'relation': self._testMethodName, 'fields': ['id', 'price'],
+                        'order_fields': ['id'], 'format': 'arrow'}
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, ARROW_MIMETYPE)
+        table = pyarrow.ipc.open_stream(response.get_data()).read_all()
+        self.assertEqual(table.num_rows, 26)
+
+        self.app.config['P2REST_EXPORT_MAX_ROWS'] = 5
+        request_data['format'] = 'parquet'
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('.parquet', response.headers['Content-Disposition'])
+        table = pyarrow.parquet.read_table(io.BytesIO(response.get_data()))
+        self.assertEqual(table.column('price').to_pylist(),
+                         [decimal.Decimal(value) for value in ('1.50', '3.00', '4.50', '6.00', '7.50')])
+        self.assertEqual(get_pool(self.app).stats()['used'], 0)
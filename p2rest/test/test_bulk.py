@@ -0,0 +1,293 @@
+"""
+Test module for our bulk endpoints
+"""
+import unittest
+import json
+from p2rest.test.helper.test_helper import check_common_data
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.bulk import render_csv_value
+from p2rest.src.api.bulk import content_disposition
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id serial NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL,
+        "Type" varchar(50) NULL,
+        tags text[] NULL,
+        attributes jsonb NULL,
+        sold boolean NOT NULL DEFAULT false
+    );
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+class TestBulk(unittest.TestCase):
+    """
+    Test case for the bulk endpoints
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            rows = cursor.fetchall() if cursor.description else None
+            connection.commit()
+        return rows
+
+    def test_render_csv_value(self):
+        """
+        Json values are rendered in the csv format of COPY
+        :return:
+        """
+        self.assertEqual(render_csv_value(None, 'text'), '')
+        self.assertEqual(render_csv_value('', 'text'), '""')
+        self.assertEqual(render_csv_value('a "b", c', 'text'), '"a ""b"", c"')
+        self.assertEqual(render_csv_value(True, 'boolean'), 'true')
+        self.assertEqual(render_csv_value(1.5, 'numeric'), '1.5')
+        self.assertEqual(render_csv_value(['a', None, 'b"c'], 'text[]'), '"{""a"",NULL,""b\\""c""}"')
+        self.assertEqual(render_csv_value({'a': [1]}, 'jsonb'), '"{""a"": [1]}"')
+
+    def test_ingest_csv(self):
+        """
+        Rows of a csv body with header are loaded, columns that are not provided get their default
+        :return:
+        """
+        body = 'manufacturer,Type,"tags"\r\nBMW,760i,"{a,b}"\r\nVW,,\r\n"Audi, AG","A""4",{}\r\n'
+        response = self.client().post('/bulk/ingest/public/{}'.format(self._testMethodName), data=body,
+                                      content_type='text/csv')
+        data = response.json
+        self.assertEqual(response.status_code, 200)
+        check_common_data(self, data, response.status_code)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['data']['rows'], 3)
+        self.assertEqual(data['data']['bytes'], len(body))
+        self.assertEqual(self.execute('SELECT manufacturer, "Type", tags, sold FROM public.{} ORDER BY id'
+                                      .format(self._testMethodName)),
+                         [('BMW', '760i', ['a', 'b'], False), ('VW', None, None, False),
+                          ('Audi, AG', 'A"4', [], False)])
+
+        response = self.client().post('/bulk/ingest/public/{}?header=false&columns=manufacturer,sold'
+                                      .format(self._testMethodName), data='Ford,true\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 1)
+
+    def test_ingest_ndjson(self):
+        """
+        Rows of a newline delimited json body are converted and loaded. The keys of the first line are the columns
+        :return:
+        """
+        lines = [
+            {'manufacturer': 'BMW', 'Type': '760i', 'tags': ['a', 'b c'], 'attributes': {'hp': 544}, 'sold': False},
+            {'manufacturer': 'VW', 'sold': True},
+            {'manufacturer': '', 'Type': None, 'attributes': [1, 2], 'sold': False}
+        ]
+        body = '\n'.join(json.dumps(line) for line in lines) + '\n'
+        response = self.client().post('/bulk/ingest/public/{}'.format(self._testMethodName), data=body,
+                                      content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 3)
+        self.assertEqual(response.json['data']['bytes'], len(body))
+        self.assertEqual(self.execute('SELECT manufacturer, "Type", tags, attributes, sold FROM public.{} ORDER BY id'
+                                      .format(self._testMethodName)),
+                         [('BMW', '760i', ['a', 'b c'], {'hp': 544}, False), ('VW', None, None, None, True),
+                          ('', None, None, [1, 2], False)])
+
+    def test_ingest_errors(self):
+        """
+        Unknown relations and columns are rejected before the copy starts, invalid lines roll back the whole load
+        :return:
+        """
+        url = '/bulk/ingest/public/{}'.format(self._testMethodName)
+        response = self.client().post('/bulk/ingest/public/does_not_exist', data='id\n1\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        check_common_data(self, response.json, response.status_code)
+
+        response = self.client().post(url, data='manufacturer,colour\nBMW,red\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('colour', response.json['description'])
+
+        response = self.client().post(url, data='{"manufacturer": "BMW"}\n{"colour": "red"}\n',
+                                      content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Line 2', response.json['description'])
+
+        response = self.client().post(url, data='manufacturer,sold\nBMW,maybe\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client().post(url, data='manufacturer\nBMW\n', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.execute('SELECT count(*) FROM public.{}'.format(self._testMethodName)), [(0,)])
+
+    def test_ingest_validation(self):
+        """
+        Columns and the values of the first json line are checked against the catalog before the copy starts
+        :return:
+        """
+        url = '/bulk/ingest/public/{}'.format(self._testMethodName)
+        self.execute('ALTER TABLE public.{} ADD COLUMN label text GENERATED ALWAYS AS (manufacturer || \'!\') STORED'
+                     .format(self._testMethodName))
+        self.app.extensions['p2rest_catalog'].invalidate()
+
+        response = self.client().post(url, data='manufacturer,label\nBMW,x\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('label', response.json['description'])
+
+        response = self.client().post(url, data='{"Type": "760i"}\n', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('manufacturer', response.json['description'])
+
+        response = self.client().post(url, data='{"manufacturer": {"name": "BMW"}, "tags": ["a"]}\n',
+                                      content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Line 1', response.json['description'])
+
+        response = self.client().post(url, data='{"manufacturer": "BMW"}\n{"manufacturer": ["VW"]}\n',
+                                      content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Line 2', response.json['description'])
+
+        # plain values are checked against the type of their column, on the first line and while the json is read
+        for data, content_type, line in (('{"id": "abc", "manufacturer": "BMW"}\n', 'application/x-ndjson', 1),
+                                         ('{"manufacturer": "BMW", "sold": 1.5}\n', 'application/x-ndjson', 1),
+                                         ('{"manufacturer": "BMW"}\n{"manufacturer": "VW", "id": true}\n',
+                                          'application/x-ndjson', 2),
+                                         ('id,manufacturer\n3000000000,BMW\n', 'text/csv', 2),
+                                         ('id,manufacturer,sold\n1,BMW,maybe\n', 'text/csv', 2)):
+            response = self.client().post(url, data=data, content_type=content_type)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Line {}'.format(line), response.json['description'])
+
+        response = self.client().post(url + '?header=false', data='5,BMW,760i,,,true\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.execute('SELECT label FROM public.{}'.format(self._testMethodName)), [('BMW!',)])
+
+    def test_export(self):
+        """
+        Rows are exported as csv or in the binary format, filtered like selects
+        :return:
+        """
+        self.execute("INSERT INTO public.{} (manufacturer, \"Type\") SELECT 'BMW', 'Series ' || i "
+                     "FROM generate_series(1, 1000) i".format(self._testMethodName))
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'fields': ['id', 'manufacturer', '"Type"'],
+            'filter': {'column': 'id', 'operator': '<=', 'value': '3'},
+            'order_fields': ['id']
+        }
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(response.get_data(as_text=True),
+                         'id,manufacturer,Type\n1,BMW,Series 1\n2,BMW,Series 2\n3,BMW,Series 3\n')
+
+        request_data.update({'filter': '', 'format': 'binary'})
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_data().startswith(b'PGCOPY\n\xff\r\n\x00'))
+
+        self.app.config['P2REST_EXPORT_MAX_ROWS'] = 10
+        request_data.update({'format': 'csv', 'header': False, 'limit': 500})
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 10)
+
+    def test_export_filename(self):
+        """
+        The filename of an export is sent as UTF-8 and as ascii fallback without quotes
+        :return:
+        """
+        relation = 'Type"\\{}'.format(self._testMethodName)
+        self.execute('CREATE TABLE public."{}" (id integer)'.format(relation.replace('"', '""')))
+        try:
+            request_data = {'schema': 'public', 'relation': '"{}"'.format(relation.replace('"', '""'))}
+            response = self.client().post('/bulk/export', data=json.dumps(request_data),
+                                          content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['Content-Disposition'],
+                             'attachment; filename="Type__{name}.csv"; filename*=UTF-8\'\'Type%22%5C{name}.csv'
+                             .format(name=self._testMethodName))
+        finally:
+            self.execute('DROP TABLE public."{}"'.format(relation.replace('"', '""')))
+
+        self.assertEqual(content_disposition('Prüf\r\n.parquet'),
+                         'attachment; filename="Pr_f__.parquet"; filename*=UTF-8\'\'Pr%C3%BCf%0D%0A.parquet')
+
+    def test_export_constant_memory(self):
+        """
+        The export is sent in chunks, a client that stops reading cancels the copy and frees the connection
+        :return:
+        """
+        self.app.config['P2REST_EXPORT_CHUNK_SIZE'] = 1024
+        request_data = {'schema': 'pg_catalog', 'relation': 'pg_attribute', 'header': False}
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json',
+                                      buffered=False)
+        self.assertEqual(response.status_code, 200)
+        chunk = next(response.response)
+        self.assertGreaterEqual(len(chunk), 1024)
+        response.close()
+        self.assertEqual(get_pool(self.app).stats()['used'], 0)
+
+    def test_export_abort(self):
+        """
+        A response that is closed before its first chunk was read cancels the copy and frees the export slot
+        :return:
+        """
+        self.app.config['P2REST_EXPORT_MAX_CONCURRENT'] = 1
+        request_data = {'schema': 'pg_catalog', 'relation': 'pg_attribute', 'header': False}
+        for export_format in ('csv', 'binary', 'csv'):
+            request_data['format'] = export_format
+            # the test client reads the first chunk, the server may close the response before
+            with self.app.test_request_context('/bulk/export', method='POST', data=json.dumps(request_data),
+                                               content_type='application/json'):
+                response = self.app.full_dispatch_request()
+                self.assertEqual(response.status_code, 200)
+                response.close()
+            self.assertEqual(get_pool(self.app).stats()['used'], 0)
+
+    def test_export_errors(self):
+        """
+        Invalid exports are rejected before data is sent, the amount of concurrent exports is limited
+        :return:
+        """
+        self.app.config['P2REST_EXPORT_MAX_CONCURRENT'] = 1
+        request_data = {'schema': 'public', 'relation': self._testMethodName, 'fields': ['colour']}
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        check_common_data(self, response.json, response.status_code)
+
+        request_data['fields'] = ['id / 0']
+        self.execute("INSERT INTO public.{} (manufacturer) VALUES ('BMW')".format(self._testMethodName))
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('division by zero', response.json['description'])
+
+        request_data['fields'] = ['id']
+        running = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json',
+                                     buffered=False)
+        self.assertEqual(running.status_code, 200)
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        running.close()
+        response = self.client().post('/bulk/export', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
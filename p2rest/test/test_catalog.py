@@ -0,0 +1,138 @@
+"""
+Test module for the catalog cache
+"""
+import time
+import unittest
+
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.catalog import CatalogCache, get_catalog, get_columns_query, normalize_identifier
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.test_catalog;
+    CREATE TABLE public.test_catalog (
+        id serial PRIMARY KEY,
+        "Name" varchar(50) NOT NULL,
+        created timestamp NULL
+    );
+    CREATE INDEX test_catalog_created ON public.test_catalog (created, id);
+"""
+
+
+class TestCatalog(unittest.TestCase):
+    """
+    Test case for the catalog cache
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.pool = get_pool(self.app)
+        self.execute(QUERY_CREATE_TABLE)
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute('DROP TABLE IF EXISTS public.test_catalog')
+
+    def execute(self, query):
+        with self.pool.connection() as connection:
+            connection.cursor().execute(query)
+            connection.commit()
+
+    def test_normalize_identifier(self):
+        """
+        Identifiers are folded like postgres does it, expressions are ignored
+        :return:
+        """
+        self.assertEqual(normalize_identifier('Id'), 'id')
+        self.assertEqual(normalize_identifier('"Name"'), 'Name')
+        self.assertEqual(normalize_identifier('"a""b"'), 'a"b')
+        self.assertIsNone(normalize_identifier('id + 1'))
+        self.assertIsNone(normalize_identifier('count(*)'))
+
+    def test_load_relation(self):
+        """
+        Columns, types, primary key and indexes of a relation are loaded
+        :return:
+        """
+        relation = get_catalog(self.app).get_relation('public', 'test_catalog')
+        self.assertEqual(list(relation['columns']), ['id', 'Name', 'created'])
+        self.assertEqual(relation['columns']['Name']['type'], 'character varying(50)')
+        self.assertFalse(relation['columns']['Name']['nullable'])
+        self.assertEqual(relation['columns']['created']['type_oid'], 1114)
+        self.assertEqual(relation['primary_key'], ['id'])
+        self.assertIn({'name': 'test_catalog_created', 'columns': ['created', 'id'], 'unique': False,
+                       'primary': False}, relation['indexes'])
+        self.assertEqual(CatalogCache.find_unknown_columns(relation, ['ID', '"Name"', 'name', 'lower(id)']),
+                         ['name'])
+
+    def test_columns_query(self):
+        """
+        Servers before postgres 10 and 12 have neither identity nor generated columns, their query does not read them
+        :return:
+        """
+        with self.pool.connection() as connection:
+            for server_version in (90600, 110000, connection.server_version):
+                query = get_columns_query(server_version)
+                self.assertEqual('attidentity' in query, server_version >= 100000)
+                self.assertEqual('attgenerated' in query, server_version >= 120000)
+                cursor = connection.cursor()
+                cursor.execute(query + ' LIMIT 1')
+                self.assertEqual(len(cursor.fetchone()), 9)
+                cursor.close()
+            connection.rollback()
+
+    def test_refresh_on_unknown_relation(self):
+        """
+        Unknown relations cause a new load, but not more often than the refresh interval
+        :return:
+        """
+        catalog = get_catalog(self.app)
+        catalog.refresh_interval = 0
+        catalog.get()
+        self.execute('CREATE TABLE public.test_catalog_new (id integer)')
+        try:
+            self.assertIsNotNone(catalog.get_relation('public', 'test_catalog_new'))
+            catalog.refresh_interval = 60
+            loads = catalog.loads
+            self.assertIsNone(catalog.get_relation('public', 'does_not_exist'))
+            self.assertEqual(catalog.loads, loads)
+        finally:
+            self.execute('DROP TABLE public.test_catalog_new')
+
+    def test_listener_invalidates(self):
+        """
+        DDL statements invalidate the cache through the event trigger and the listener thread
+        :return:
+        """
+        catalog = CatalogCache(self.pool, listen=True)
+        received = []
+        catalog.subscribe('p2rest_results', received.append)
+        self.assertEqual(catalog.channels(), ['p2rest_catalog', 'p2rest_results'])
+        self.assertEqual(catalog.handlers('p2rest_results'), [received.append])
+        self.assertEqual(catalog.handlers('unknown'), [])
+        catalog.install_event_trigger()
+        try:
+            catalog.get()
+            for _ in range(50):
+                if catalog.stats()['listening'] and catalog.invalidations > 0:
+                    break
+                time.sleep(0.1)
+            catalog.get()
+            invalidations = catalog.invalidations
+            self.execute('ALTER TABLE public.test_catalog ADD COLUMN changed boolean')
+            for _ in range(50):
+                if catalog.invalidations > invalidations:
+                    break
+                time.sleep(0.1)
+            self.assertGreater(catalog.invalidations, invalidations)
+            self.assertIn('changed', catalog.get_relation('public', 'test_catalog')['columns'])
+        finally:
+            catalog.stop_listener()
+            self.execute('DROP EVENT TRIGGER IF EXISTS p2rest_notify_ddl')
@@ -0,0 +1,125 @@
+"""
+Test module for the compression of the responses
+"""
+import gzip
+import json
+import unittest
+from p2rest.src import create_app
+from p2rest.src.compression import brotli, zstandard
+from p2rest.src.database.pool import get_pool
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL
+    );
+    INSERT INTO public.{table_name} SELECT i, 'Manufacturer ' || i FROM generate_series(1, 100) i;
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+class TestCompression(unittest.TestCase):
+    """
+    Test case for the negotiation and the compression of regular and streamed responses
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            connection.commit()
+
+    def select(self, encoding=None, accept=None, **kwargs):
+        request_data = dict({'schema': 'public', 'relation': self._testMethodName}, **kwargs)
+        headers = {}
+        if encoding is not None:
+            headers['Accept-Encoding'] = encoding
+        if accept is not None:
+            headers['Accept'] = accept
+        return self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json',
+                                  headers=headers)
+
+    def test_gzip(self):
+        """
+        Responses are compressed with the best encoding the client accepts
+        :return:
+        """
+        response = self.select(encoding='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(int(response.headers['Content-Length']), len(response.data))
+        body = json.loads(gzip.decompress(response.data))
+        self.assertEqual(body['count'], 100)
+
+        uncompressed = self.select()
+        self.assertNotIn('Content-Encoding', uncompressed.headers)
+        self.assertGreater(len(uncompressed.data), len(response.data))
+        self.assertEqual(json.loads(uncompressed.data)['data'], body['data'])
+
+    @unittest.skipIf(brotli is None or zstandard is None, 'brotli and zstandard are not installed')
+    def test_brotli_zstd(self):
+        """
+        The encodings are offered in the configured order, the quality values of the client are respected
+        :return:
+        """
+        response = self.select(encoding='gzip, br, zstd')
+        self.assertEqual(response.headers['Content-Encoding'], 'zstd')
+        self.assertEqual(json.loads(zstandard.ZstdDecompressor().decompressobj().decompress(response.data))['count'],
+                         100)
+
+        response = self.select(encoding='gzip, br, zstd;q=0.5')
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.data))['count'], 100)
+
+        self.app.config['P2REST_COMPRESSION_ENCODINGS'] = 'gzip'
+        response = self.select(encoding='br, zstd')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_stream(self):
+        """
+        Streamed responses are compressed chunk by chunk
+        :return:
+        """
+        self.app.config['P2REST_STREAM_BATCH_SIZE'] = 10
+        response = self.select(encoding='gzip', accept='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        rows = [json.loads(line) for line in gzip.decompress(response.data).decode().splitlines()]
+        self.assertEqual(sorted(row['id'] for row in rows), list(range(1, 101)))
+
+    def test_threshold(self):
+        """
+        Small responses and disabled compression are sent uncompressed
+        :return:
+        """
+        response = self.select(encoding='gzip', limit=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(response.data)['count'], 1)
+
+        self.app.config['P2REST_COMPRESSION'] = False
+        response = self.select(encoding='gzip')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(response.data)['count'], 100)
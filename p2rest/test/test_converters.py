@@ -0,0 +1,77 @@
+"""
+Test module for the row converters
+"""
+import unittest
+import json
+
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.helper import PostgresHelper
+from p2rest.src.database.converters import RowConverter
+
+QUERY_TYPES = """
+    SELECT 1::int AS int, 'text'::text AS text, 1.5::numeric AS numeric,
+           '2020-01-02 03:04:05.123456'::timestamp AS timestamp, '2020-01-02'::date AS date,
+           '1 day 02:00:00'::interval AS interval, 'a0eebc99-9c0b-4ef8-bb6d-6bb9bd380a11'::uuid AS uuid,
+           '\\x0102'::bytea AS bytea, ARRAY['2020-01-02'::date, NULL] AS dates, '{"a": 1}'::jsonb AS jsonb,
+           NULL::timestamp AS empty, 12345678901234567890.123456789::numeric AS precise
+"""
+
+
+class TestConverters(unittest.TestCase):
+    """
+    Test case for the row converters
+    """
+
+    def setUp(self):
+        """
+        Create the app and query a row with all types we want to check
+        :return:
+        """
+        self.app = create_app('test')
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(QUERY_TYPES)
+            self.rows = cursor.fetchall()
+            self.columns = cursor.description
+
+    def test_convert_types(self):
+        """
+        All values are converted into json serializable values
+        :return:
+        """
+        row = RowConverter(self.columns).to_dicts(self.rows)[0]
+        self.assertEqual(row, {
+            'int': 1,
+            'text': 'text',
+            'numeric': '1.5',
+            'timestamp': '2020-01-02T03:04:05.123456',
+            'date': '2020-01-02',
+            'interval': '1 day, 2:00:00',
+            'uuid': 'a0eebc99-9c0b-4ef8-bb6d-6bb9bd380a11',
+            'bytea': 'AQI=',
+            'dates': ['2020-01-02', None],
+            'jsonb': {'a': 1},
+            'empty': None,
+            'precise': '12345678901234567890.123456789'
+        })
+        json.dumps(row)
+
+    def test_passthrough(self):
+        """
+        Columns that need no conversion are not part of the conversion plan
+        :return:
+        """
+        converter = RowConverter(self.columns)
+        self.assertEqual([converter.names[index] for index, _ in converter.converters],
+                         ['numeric', 'timestamp', 'date', 'interval', 'uuid', 'bytea', 'dates', 'empty', 'precise'])
+
+    def test_compact(self):
+        """
+        The compact form contains the values in the order of the columns
+        :return:
+        """
+        rows = PostgresHelper.ConvertPsycopg2Data(self.rows, self.columns, compact=True)
+        self.assertEqual(rows[0][:4], [1, 'text', '1.5', '2020-01-02T03:04:05.123456'])
+        self.assertEqual(PostgresHelper.ConvertPsycopg2Data(self.rows, self.columns),
+                         RowConverter(self.columns).to_dicts(self.rows))
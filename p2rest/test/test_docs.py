@@ -0,0 +1,45 @@
+"""
+Test module for the swagger documentation
+"""
+import os
+import unittest
+from unittest import mock
+from p2rest.src import create_app
+from p2rest.src.api.query import create_filter_model
+
+
+class TestDocs(unittest.TestCase):
+    """
+    Test case for the swagger specification and ui
+    """
+
+    def test_docs(self):
+        """
+        The specification and the ui are served unless they are disabled
+        :return:
+        """
+        client = create_app('test').test_client()
+        response = client.get('/swagger.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/query/select', response.json['paths'])
+        self.assertIn('Data5', response.json['definitions'])
+        self.assertEqual(client.get('/').status_code, 200)
+
+    def test_disabled(self):
+        """
+        Without docs only the endpoints are served
+        :return:
+        """
+        with mock.patch.dict(os.environ, {'P2REST_DOCS': 'false'}):
+            client = create_app('test').test_client()
+        self.assertEqual(client.get('/swagger.json').status_code, 404)
+        self.assertEqual(client.get('/').status_code, 404)
+        self.assertEqual(client.get('/health/live').status_code, 200)
+
+    def test_filter_models(self):
+        """
+        The nested filter models are built once
+        :return:
+        """
+        self.assertIs(create_filter_model(), create_filter_model())
+        self.assertIs(create_filter_model()['childs'].container.model, create_filter_model(4))
@@ -0,0 +1,116 @@
+"""
+Test module for the json encoders of the query responses
+"""
+import datetime
+import decimal
+import json
+import unittest
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.encoders import init_encoder, create_encoder, dumps_json, orjson
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL,
+        price numeric(10, 2),
+        built timestamp
+    );
+    INSERT INTO public.{table_name}
+    SELECT i, 'Manufacturer ' || i, i * 1.5, '2020-01-01'::timestamp + i * interval '1 day'
+    FROM generate_series(1, 20) i;
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+class TestEncoders(unittest.TestCase):
+    """
+    Test case for the responses written by the json encoders
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            connection.commit()
+
+    def post(self, path, headers=None, **kwargs):
+        request_data = dict({'schema': 'public', 'relation': self._testMethodName}, **kwargs)
+        return self.client().post(path, data=json.dumps(request_data), content_type='application/json',
+                                  headers=headers)
+
+    def responses(self):
+        """
+        Returns the bodies of the query endpoints
+        """
+        ndjson = self.post('/query/select', headers={'Accept': 'application/x-ndjson'}, order_fields=['id'])
+        return [
+            json.loads(self.post('/query/select', order_fields=['id']).data),
+            json.loads(self.post('/query/select', order_fields=['id'], compact=True).data),
+            json.loads(self.post('/query/select', order_fields=['id'], stream=True, compact=True).data),
+            [json.loads(line) for line in ndjson.data.splitlines()],
+            json.loads(self.post('/query/aggregate', aggregates=[{'function': 'sum', 'column': 'price'}]).data),
+            json.loads(self.post('/query/count').data),
+        ]
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_same_responses(self):
+        """
+        orjson and the standard library encoder write the same documents
+        :return:
+        """
+        self.app.config['P2REST_JSON_ENCODER'] = 'orjson'
+        init_encoder(self.app)
+        fast = self.responses()
+        self.app.config['P2REST_JSON_ENCODER'] = 'json'
+        init_encoder(self.app)
+        standard = self.responses()
+
+        for fast_body, standard_body in zip(fast, standard):
+            if isinstance(fast_body, dict):
+                fast_body.pop('duration')
+                standard_body.pop('duration')
+            self.assertEqual(fast_body, standard_body)
+        # the envelope is ordered like the swagger model
+        self.assertEqual(list(fast[0].keys()), ['status_code', 'message', 'description', 'count', 'data',
+                                                'continuation', 'total'])
+        self.assertEqual(fast[0]['data'][0], {'id': 1, 'manufacturer': 'Manufacturer 1', 'price': '1.50',
+                                              'built': '2020-01-02T00:00:00.000000'})
+        self.assertEqual(fast[1]['data']['rows'], fast[2]['data']['rows'])
+        self.assertEqual(fast[3], fast[0]['data'])
+
+    def test_encoders(self):
+        """
+        Unknown encoders are rejected, values that were not converted are encoded as strings or numbers
+        :return:
+        """
+        with self.assertRaises(ValueError):
+            create_encoder('ujson')
+        self.assertEqual(json.loads(dumps_json({'price': decimal.Decimal('1.5'),
+                                                'built': datetime.datetime(2020, 1, 2)})),
+                         {'price': '1.5', 'built': '2020-01-02T00:00:00.000000'})
+
+        self.app.config['P2REST_JSON_ENCODER'] = 'json'
+        with self.assertLogs(level='INFO') as logs:
+            init_encoder(self.app)
+        self.assertIn('JSON encoder: json (P2REST_JSON_ENCODER=json)', logs.output[0])
@@ -0,0 +1,79 @@
+"""
+Test module for the filter optimizer
+"""
+import unittest
+
+from werkzeug.exceptions import BadRequest
+
+from p2rest.src.database.filters import optimize_filter, array_literal
+from p2rest.src.database.helper import PostgresHelper
+
+
+def equal(column, value):
+    return {'column': column, 'operator': '=', 'value': value}
+
+
+class TestFilters(unittest.TestCase):
+    """
+    Test case for the filter optimizer
+    """
+
+    def test_optimize_filter(self):
+        """
+        Nested nodes are flattened, duplicates removed and equalities of one column merged into one list
+        :return:
+        """
+        json_filter = {'operator': 'or', 'childs': [
+            equal('id', 1),
+            {'operator': 'or', 'childs': [equal('id', 2), equal('name', 'a'), equal('id', 1)]},
+            {'operator': 'and', 'childs': [equal('name', 'b'), equal('name', 'b')]},
+            {'column': 'id', 'operator': 'in', 'value': [3, 2]}]}
+        self.assertEqual(optimize_filter(json_filter), {'operator': 'or', 'childs': [
+            {'column': 'id', 'operator': 'in', 'value': [1, 2, 3]},
+            {'column': 'name', 'operator': 'in', 'value': ['a', 'b']}]})
+
+        json_filter = {'operator': 'and', 'childs': [
+            {'column': 'id', 'operator': '!=', 'value': 1}, {'column': 'id', 'operator': '<>', 'value': 2},
+            {'operator': 'not', 'childs': [{'operator': 'or', 'childs': [equal('id', 3), equal('id', 3)]}]}]}
+        self.assertEqual(optimize_filter(json_filter), {'operator': 'and', 'childs': [
+            {'column': 'id', 'operator': 'not in', 'value': [1, 2]},
+            {'operator': 'not', 'childs': [equal('id', 3)]}]})
+
+        # invalid nodes are left to the compilation, which reports them
+        for json_filter in ({'operator': 'or', 'childs': [equal('id', 1)]},
+                            {'operator': 'xor', 'childs': [equal('id', 1), equal('id', 2)]},
+                            {'operator': 'or', 'childs': [equal('id', [1]), equal('id', 2)]}):
+            self.assertEqual(optimize_filter(json_filter), json_filter)
+
+    def test_compile_filter(self):
+        """
+        List operators are compiled to one array parameter, the others to placeholders per value
+        :return:
+        """
+        json_filter = {'operator': 'or', 'childs': [equal('id', 1), equal('id', 2), equal('name', 'a"b')]}
+        self.assertEqual(PostgresHelper.convert_request_filter_to_string(json_filter),
+                         ('WHERE ((id = ANY(%s)) or (name = %s))', ['{1,2}', 'a"b']))
+        self.assertEqual(PostgresHelper.convert_request_filter_to_string(
+            {'column': 'id', 'operator': 'between', 'value': [1, 5]}), ('WHERE (id BETWEEN %s AND %s)', [1, 5]))
+        self.assertEqual(PostgresHelper.convert_request_filter_to_string(
+            {'column': 'id', 'operator': 'is not null'}), ('WHERE (id IS NOT NULL)', []))
+        self.assertEqual(array_literal(['a"b', 'c\\d', None, True, 1.5]), '{"a\\"b","c\\\\d",NULL,true,1.5}')
+        with self.assertRaises(BadRequest):
+            array_literal([{'a': 1}])
+
+    def test_compile_identifiers(self):
+        """
+        Column and relation names are quoted, expressions in the fields of a select are kept
+        :return:
+        """
+        self.assertEqual([PostgresHelper.convert_field_to_string(field) for field in ('Type', '"Type"', 'id + 1', '*')],
+                         ['"type"', '"Type"', 'id + 1', '*'])
+        self.assertEqual(PostgresHelper.resolve_column('"a%b"'), '"a%%b"')
+        with self.assertRaises(BadRequest):
+            PostgresHelper.resolve_column('cars; DROP TABLE cars')
+        self.assertEqual(PostgresHelper.convert_order_by_to_string(['manufacturer', 'ID'], 'desc'),
+                         'ORDER BY "manufacturer" desc, "id" desc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""
+Test module for the query governor
+"""
+import json
+import unittest
+from p2rest.test.helper.test_helper import check_common_data
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.governor import init_governor, get_governor, parse_timeouts
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL
+    );
+    INSERT INTO public.{table_name} SELECT i, 'Manufacturer ' || i FROM generate_series(1, 20000) i;
+    ANALYZE public.{table_name};
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+class TestGovernor(unittest.TestCase):
+    """
+    Test case for the timeouts and the admission control of the statements
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            connection.commit()
+
+    def configure(self, **config):
+        self.app.config.update(config)
+        init_governor(self.app)
+
+    def post(self, path, **kwargs):
+        request_data = dict({'schema': 'public', 'relation': self._testMethodName}, **kwargs)
+        return self.client().post(path, data=json.dumps(request_data), content_type='application/json')
+
+    def test_parse_timeouts(self):
+        """
+        Timeouts per relation are parsed from strings and dictionaries
+        :return:
+        """
+        self.assertEqual(parse_timeouts('public.cars=500, Public."Big Table"=1000:200'),
+                         {('public', 'cars'): (500, None), ('public', 'Big Table'): (1000, 200)})
+        self.assertEqual(parse_timeouts({'public.cars': [500, 100]}), {('public', 'cars'): (500, 100)})
+        self.assertEqual(parse_timeouts(''), {})
+        with self.assertRaises(ValueError):
+            parse_timeouts('cars=500')
+        with self.assertRaises(ValueError):
+            parse_timeouts('public.cars')
+
+    def test_statement_timeout(self):
+        """
+        Statements exceeding the timeout of their relation are cancelled and answered with status 503
+        :return:
+        """
+        self.configure(P2REST_STATEMENT_TIMEOUT=0,
+                       P2REST_RELATION_TIMEOUTS='public.{}=100'.format(self._testMethodName))
+        response = self.post('/query/select', fields=['id', 'pg_sleep(0.5)'], limit=1)
+        self.assertEqual(response.status_code, 503)
+        check_common_data(self, response.json, response.status_code)
+        self.assertEqual(response.json['data']['statement_timeout'], 100)
+        self.assertEqual(get_governor(self.app).stats()['cancelled'], 1)
+
+        # the setting only lasts for the transaction of the request
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('SHOW statement_timeout')
+            self.assertEqual(cursor.fetchone()[0], '0')
+
+        response = self.post('/query/aggregate', aggregates=[{'function': 'count', 'column': '*'}],
+                             filter={'column': 'id', 'operator': '=', 'value': 1})
+        self.assertEqual(response.status_code, 200)
+
+        self.configure(P2REST_STATEMENT_TIMEOUT=100, P2REST_RELATION_TIMEOUTS='')
+        response = self.post('/query/select', fields=['id', 'pg_sleep(0.5)'], limit=1, stream=True)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(get_pool(self.app).stats()['used'], 0)
+
+    def test_max_cost(self):
+        """
+        Statements whose estimate exceeds the maximum cost are rejected before they run
+        :return:
+        """
+        self.configure(P2REST_GOVERNOR_MAX_COST=100)
+        response = self.post('/query/select', order_fields=['manufacturer'], limit=10000)
+        self.assertEqual(response.status_code, 400)
+        check_common_data(self, response.json, response.status_code)
+        self.assertGreater(response.json['data']['estimated_cost'], 100)
+        self.assertEqual(response.json['data']['max_cost'], 100)
+
+        response = self.post('/query/select', filter={'column': 'id', 'operator': '=', 'value': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 1)
+
+        response = self.post('/query/count', filter={'column': 'manufacturer', 'operator': 'like', 'value': '%1%'})
+        self.assertEqual(response.status_code, 400)
+        response = self.post('/query/count', filter={'column': 'manufacturer', 'operator': 'like', 'value': '%1%'},
+                             strategy='estimate')
+        self.assertEqual(response.status_code, 200)
+
+        request_data = {'queries': [
+            {'schema': 'public', 'relation': self._testMethodName, 'order_fields': ['manufacturer'], 'limit': 10000},
+            {'schema': 'public', 'relation': self._testMethodName, 'filter': {'column': 'id', 'operator': '=',
+                                                                              'value': 5}}
+        ]}
+        response = self.client().post('/query/batch', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status_code'] for item in response.json['data']], [400, 200])
+        self.assertEqual(get_governor(self.app).stats()['rejected'], 3)
+
+    def test_queue(self):
+        """
+        Statements above the queue cost wait for a slot and are answered with status 503 if none becomes available
+        :return:
+        """
+        self.configure(P2REST_GOVERNOR_QUEUE_COST=100, P2REST_GOVERNOR_QUEUE_SLOTS=1, P2REST_GOVERNOR_QUEUE_TIMEOUT=0.1)
+        response = self.post('/query/select', order_fields=['manufacturer'], limit=10)
+        self.assertEqual(response.status_code, 200)
+
+        governor = get_governor(self.app)
+        self.assertTrue(governor._slots.acquire(blocking=False))
+        try:
+            response = self.post('/query/select', order_fields=['manufacturer'], limit=10)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            check_common_data(self, response.json, response.status_code)
+
+            # cheap statements do not need a slot
+            response = self.post('/query/select', filter={'column': 'id', 'operator': '=', 'value': 5})
+            self.assertEqual(response.status_code, 200)
+        finally:
+            governor._slots.release()
+        self.assertEqual(governor.stats()['queue_timeouts'], 1)
+        self.assertEqual(get_pool(self.app).stats()['used'], 0)
@@ -2,12 +2,15 @@
 """
 Test module for our application configuration
 """
+import time
 import unittest
 import os
 import psycopg2
 from flask import current_app
 
 from p2rest.src import create_app
+from p2rest.src.database.pool import ConnectionPool
+from p2rest.src.database.probe import HealthProber, get_prober
 
 
 class TestHealth(unittest.TestCase):
@@ -81,4 +84,59 @@ class TestHealth(unittest.TestCase):
         :return:
         """
         response = self.client().delete('/health/')  # , headers=self.admin_header)
-        self.assertEqual(response.status_code, 405)  # not allowed
\ No newline at end of file
+        self.assertEqual(response.status_code, 405)  # not allowed
+
+    def test_liveness_endpoint(self):
+        """
+        The liveness probe does not depend on the database
+        :return:
+        """
+        response = self.client().get('/health/live')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['data']['status'], 'Up')
+
+    def test_readiness_endpoint(self):
+        """
+        The readiness probe reports the cached outcome of the last database probe
+        :return:
+        """
+        prober = get_prober(self.app)
+        prober.interval = 60
+        for _ in range(3):
+            response = self.client().get('/health/ready')
+            data = response.json
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['db_connection'], 'Ok')
+            self.assertIsNone(data['data']['error'])
+            self.assertGreater(data['data']['latency'], 0)
+            self.assertEqual(data['data']['pool']['max_size'], self.app.config['P2REST_DB_POOL_MAX_SIZE'])
+            self.assertIn('saturation', data['data']['pool'])
+        self.assertEqual(prober.probes, 1)
+
+        prober.interval = 0
+        response = self.client().get('/health/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(prober.probes, 2)
+
+    def test_readiness_failure(self):
+        """
+        A failed probe makes the service not ready, the background thread refreshes the outcome
+        :return:
+        """
+        pool = ConnectionPool.from_config(self.app.config, port=1, timeout=1)
+        prober = HealthProber(pool, interval=0.05, timeout=1, background=True)
+        self.app.extensions['p2rest_prober'] = prober
+        try:
+            response = self.client().get('/health/ready')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json['data']['db_connection'], 'NOK')
+            self.assertIsNotNone(response.json['data']['error'])
+            time.sleep(0.3)
+            self.assertGreater(prober.probes, 1)
+            self.assertTrue(prober.stats()['background'])
+
+            response = self.client().get('/health/')
+            self.assertEqual(response.json['data']['db_connection'], 'NOK')
+        finally:
+            prober.stop()
+        self.assertFalse(prober.stats()['background'])
@@ -0,0 +1,169 @@
+"""
+Test module for the prometheus metrics
+"""
+import os
+import json
+import unittest
+from prometheus_client import REGISTRY
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.replicas import init_router
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL
+    );
+    INSERT INTO public.{table_name} SELECT i, 'Manufacturer ' || i FROM generate_series(1, 20) i;
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+def sample(name, **labels):
+    """
+    Returns the current value of a metric sample, 0 if it does not exist yet
+    """
+    value = REGISTRY.get_sample_value(name, labels)
+    return value if value is not None else 0
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test case for the metrics endpoint and the request measurements
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            connection.commit()
+
+    def select(self, **kwargs):
+        request_data = dict({'schema': 'public', 'relation': self._testMethodName}, **kwargs)
+        return self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json')
+
+    def test_select_metrics(self):
+        """
+        A select is measured per phase and counted for its relation
+        :return:
+        """
+        queries = sample('p2rest_relation_queries_total', schema='public', relation=self._testMethodName,
+                         operation='select')
+        requests = sample('p2rest_request_duration_seconds_count', endpoint='query_select_list_api', method='POST',
+                          status='200')
+        rows = sample('p2rest_rows_returned_sum', endpoint='query_select_list_api')
+        executes = sample('p2rest_db_execute_seconds_count', endpoint='query_select_list_api')
+
+        response = self.select(limit=15)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(sample('p2rest_relation_queries_total', schema='public', relation=self._testMethodName,
+                                operation='select'), queries + 1)
+        self.assertEqual(sample('p2rest_request_duration_seconds_count', endpoint='query_select_list_api', method='POST',
+                                status='200'), requests + 1)
+        self.assertEqual(sample('p2rest_rows_returned_sum', endpoint='query_select_list_api'), rows + 15)
+        self.assertEqual(sample('p2rest_db_execute_seconds_count', endpoint='query_select_list_api'), executes + 1)
+        self.assertGreater(sample('p2rest_response_bytes_count', endpoint='query_select_list_api'), 0)
+
+        response = self.client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data(as_text=True)
+        for name in ('p2rest_request_duration_seconds', 'p2rest_db_connection_seconds', 'p2rest_db_execute_seconds',
+                     'p2rest_row_conversion_seconds', 'p2rest_serialization_seconds', 'p2rest_rows_returned',
+                     'p2rest_response_bytes', 'p2rest_relation_queries_total', 'p2rest_pool_connections'):
+            self.assertIn(name, body)
+
+    def test_stream_metrics(self):
+        """
+        Streamed responses are measured once the body was sent
+        :return:
+        """
+        rows = sample('p2rest_rows_returned_sum', endpoint='query_select_list_api')
+        size = sample('p2rest_response_bytes_sum', endpoint='query_select_list_api')
+        response = self.select(stream=True)
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data()
+        response.close()
+        self.assertEqual(sample('p2rest_rows_returned_sum', endpoint='query_select_list_api'), rows + 20)
+        self.assertEqual(sample('p2rest_response_bytes_sum', endpoint='query_select_list_api'), size + len(body))
+
+    def test_batch_metrics(self):
+        """
+        Rows of batch selects are counted whether they were executed on one or on several connections
+        :return:
+        """
+        for concurrency in (1, 2):
+            rows = sample('p2rest_rows_returned_sum', endpoint='query_batch_api')
+            request_data = {'concurrency': concurrency, 'queries': [
+                {'schema': 'public', 'relation': self._testMethodName, 'limit': 5},
+                {'schema': 'public', 'relation': self._testMethodName, 'limit': 10},
+                {'schema': 'public', 'relation': self._testMethodName}]}
+            response = self.client().post('/query/batch', data=json.dumps(request_data),
+                                          content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(sample('p2rest_rows_returned_sum', endpoint='query_batch_api'), rows + 35)
+
+    def test_pool_metrics(self):
+        """
+        The gauges report the primary pool and every replica pool
+        :return:
+        """
+        self.app.config['P2REST_DB_REPLICAS'] = '{}:{}'.format(self.app.config['P2REST_DB_HOST'],
+                                                                self.app.config['P2REST_DB_PORT'])
+        router = init_router(self.app, get_pool(self.app))
+        response = self.select(limit=1)
+        self.assertEqual(response.status_code, 200)
+        for name, pool in (('primary', get_pool(self.app)), ('replica-0', router.replicas[0].pool)):
+            self.assertEqual(sample('p2rest_pool_max_connections', pool=name), pool.stats()['max_size'])
+            self.assertEqual(sample('p2rest_pool_connections', pool=name, state='idle'), pool.stats()['idle'])
+        self.assertGreater(sample('p2rest_pool_max_connections', pool='replica-0'), 0)
+
+    def test_error_metrics(self):
+        """
+        Failed requests are counted by the class of the original exception
+        :return:
+        """
+        errors = sample('p2rest_errors_total', endpoint='query_select_list_api', exception='DivisionByZero')
+        response = self.select(fields=['id / 0'])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(sample('p2rest_errors_total', endpoint='query_select_list_api', exception='DivisionByZero'),
+                         errors + 1)
+
+        errors = sample('p2rest_errors_total', endpoint='query_select_list_api', exception='BadRequest')
+        response = self.select(total='everything')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sample('p2rest_errors_total', endpoint='query_select_list_api', exception='BadRequest'),
+                         errors + 1)
+
+    def test_metrics_disabled(self):
+        """
+        Without metrics there is no endpoint
+        :return:
+        """
+        os.environ['P2REST_METRICS'] = 'false'
+        try:
+            app = create_app('test')
+        finally:
+            del os.environ['P2REST_METRICS']
+        self.assertIsNone(app.extensions.get('p2rest_metrics'))
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
@@ -0,0 +1,131 @@
+"""
+Test module for our database connection pool
+"""
+import os
+import unittest
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from p2rest.src import create_app
+from p2rest.src.database.pool import ConnectionPool, get_pool
+
+
+class TestPool(unittest.TestCase):
+    """
+    Test case for the connection pool
+    """
+
+    def setUp(self):
+        """
+        Create the app and a small pool
+        :return:
+        """
+        self.app = create_app('test')
+        self.pool = ConnectionPool.from_config(self.app.config, max_size=2, timeout=0.1)
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.pool.closeall()
+
+    def test_pool_created_by_app(self):
+        """
+        The application factory creates a pool from the configuration
+        :return:
+        """
+        pool = get_pool(self.app)
+        self.assertIsInstance(pool, ConnectionPool)
+        self.assertEqual(pool.max_size, self.app.config['P2REST_DB_POOL_MAX_SIZE'])
+
+    def test_connection_reused(self):
+        """
+        A returned connection is handed out again instead of opening a new one
+        :return:
+        """
+        connection = self.pool.getconn()
+        self.pool.putconn(connection)
+        self.assertIs(self.pool.getconn(), connection)
+        self.assertEqual(self.pool.stats()['size'], 1)
+
+    def test_pool_exhausted(self):
+        """
+        No more than max_size connections are opened
+        :return:
+        """
+        first = self.pool.getconn()
+        second = self.pool.getconn()
+        self.assertIsNot(first, second)
+        with self.assertRaises(PoolError):
+            self.pool.getconn()
+        self.pool.putconn(second)
+        self.assertIs(self.pool.getconn(), second)
+
+    def test_transaction_rolled_back(self):
+        """
+        Open transactions are rolled back when a connection is returned
+        :return:
+        """
+        with self.pool.connection() as connection:
+            connection.cursor().execute('SELECT 1')
+            self.assertNotEqual(connection.get_transaction_status(), extensions.TRANSACTION_STATUS_IDLE)
+        self.assertEqual(connection.get_transaction_status(), extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_broken_connection_discarded(self):
+        """
+        Connections that were closed while idle are replaced on checkout
+        :return:
+        """
+        connection = self.pool.getconn()
+        self.pool.putconn(connection)
+        connection.close()
+        replacement = self.pool.getconn()
+        self.assertIsNot(replacement, connection)
+        self.assertFalse(replacement.closed)
+
+    def test_max_lifetime(self):
+        """
+        Connections exceeding their lifetime are closed when returned
+        :return:
+        """
+        self.pool.max_lifetime = 0.000001
+        connection = self.pool.getconn()
+        self.pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(self.pool.stats()['size'], 0)
+
+    def test_fork_drops_inherited_connections(self):
+        """
+        A pool used in a forked process does not reuse the connections of its parent
+        :return:
+        """
+        connection = self.pool.getconn()
+        self.pool.putconn(connection)
+        self.pool._pid = -1  # pretend the connections were opened by another process
+        child_connection = self.pool.getconn()
+        self.assertIsNot(child_connection, connection)
+        self.assertFalse(connection.closed)
+        connection.close()
+
+    def test_fork_keeps_parent_sessions(self):
+        """
+        The connections a forked process drops do not terminate the sessions of its parent
+        :return:
+        """
+        connection = self.pool.getconn()
+        self.pool.putconn(connection)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.pool.putconn(self.pool.getconn())
+                # like the garbage collection of psycopg2 versions that close connections of other processes
+                connection.close()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1')
+        self.assertEqual(cursor.fetchone(), (1,))
+        cursor.close()
+        connection.rollback()
@@ -2,11 +2,14 @@
 """
 Test module for our schema endpoint
 """
+import time
 import unittest
 import json
 import psycopg2
 from p2rest.test.helper.test_helper import check_common_data
 from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.results import get_result_cache
 
 
 QUERY_CREATE_TABLE = """
@@ -77,7 +80,7 @@ class TestQuery(unittest.TestCase):
         con.commit()
         TestQuery.close_connection(con, cur)
 
-        # self.admin_header = {'Authorization': 'Bearer ' + os.environ['admin_token']}
+        self.admin_header = {'Authorization': 'Bearer ' + self.app.config['P2REST_ADMIN_API_KEY']}
         # self.user_header = {'Authorization': 'Bearer ' + os.environ['user_token']}
 
     def tearDown(self):
@@ -169,3 +172,596 @@ class TestQuery(unittest.TestCase):
         self.assertEqual(data['count'], len(data['data']))
         self.assertEqual(len(data['data']), 10)
         self.assertEqual(len(data['data'][0].keys()), 1)
+
+    def test_query_select_stream_json(self):
+        """
+        Test a streamed POST call to the query/select endpoint that returns the usual envelope
+        :return:
+        """
+        self.app.config['P2REST_STREAM_BATCH_SIZE'] = 3
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'order_fields': ['id'],
+            'stream': True
+        }
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        data = json.loads(response.get_data(as_text=True))
+
+        check_common_data(self, data, response.status_code)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['count'], 10)
+        self.assertEqual([row['id'] for row in data['data']], list(range(1, 11)))
+
+    def test_query_select_stream_ndjson(self):
+        """
+        Test a streamed POST call to the query/select endpoint that returns newline delimited json
+        :return:
+        """
+        self.app.config['P2REST_STREAM_BATCH_SIZE'] = 4
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'fields': ['id', 'manufacturer'],
+            'order_fields': ['id']
+        }
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json',
+                                      headers={'Accept': 'application/x-ndjson'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0], {'id': 1, 'manufacturer': 'BMW'})
+
+    def test_query_select_stream_error(self):
+        """
+        Errors in a streamed query are reported before the response is started
+        :return:
+        """
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'fields': ['id / 0'],
+            'stream': True
+        }
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+
+        self.assertEqual(response.status_code, 500)
+        check_common_data(self, response.json, response.status_code)
+
+    def test_query_select_keyset(self):
+        """
+        Test keyset pagination on the query/select endpoint
+        :return:
+        """
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'filter': {'column': 'id', 'operator': '!=', 'value': '5'},
+            'order_fields': ['id'],
+            'order_type': 'desc',
+            'limit': 4,
+            'keyset': True
+        }
+        ids = []
+        tokens = []
+        for page in range(3):
+            response = self.client().post('/query/select',
+                                          data=json.dumps(request_data),
+                                          content_type='application/json')
+            data = response.json
+            check_common_data(self, data, response.status_code)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in data['data']]
+            request_data['continuation'] = data['continuation']
+            tokens.append(data['continuation'])
+        self.assertEqual(ids, [10, 9, 8, 7, 6, 4, 3, 2, 1])
+        self.assertIsNone(data['continuation'])
+
+        # a token can not be used with a different order
+        request_data['continuation'] = tokens[0]
+        request_data['order_type'] = 'asc'
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        request_data['continuation'] = 'invalid'
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        check_common_data(self, response.json, response.status_code)
+
+    def test_query_select_keyset_fields(self):
+        """
+        Test keyset pagination ordered descending by two fields, one of them quoted
+        :return:
+        """
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'fields': ['id', 'manufacturer'],
+            'order_fields': ['"manufacturer"', 'ID'],
+            'order_type': 'desc',
+            'limit': 3,
+            'keyset': True
+        }
+        ids = []
+        for page in range(4):
+            response = self.client().post('/query/select',
+                                          data=json.dumps(request_data),
+                                          content_type='application/json')
+            data = response.json
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in data['data']]
+            request_data['continuation'] = data['continuation']
+        self.assertEqual(ids, [4, 3, 8, 7, 10, 9, 2, 1, 6, 5])
+        self.assertIsNone(data['continuation'])
+
+        # a NULL in the last row of a page would end the pagination
+        request_data = dict(request_data, fields=['id', 'licenseplate'], order_fields=['licenseplate', 'id'])
+        del request_data['continuation']
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('licenseplate', response.json['description'])
+
+        request_data['order_fields'] = ['id']
+        request_data['fields'] = ['licenseplate']
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_select_prepared(self):
+        """
+        Test that repeated selects with the same shape but different values are prepared and return correct data
+        :return:
+        """
+        get_pool(self.app).statements.prepare_threshold = 2
+        for value in ['BMW', "'VW'", 'Audi', 'Ford', "'Mercedes'"]:
+            request_data = {
+                'schema': 'public',
+                'relation': self._testMethodName,
+                'filter': {'column': 'manufacturer', 'operator': '=', 'value': value},
+                'order_fields': ['id']
+            }
+            response = self.client().post('/query/select',
+                                          data=json.dumps(request_data),
+                                          content_type='application/json')
+            data = response.json
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['count'], 2)
+            self.assertEqual({row['manufacturer'] for row in data['data']}, {value.strip("'")})
+
+        response = self.client().get('/admin/statistics', headers=self.admin_header)
+        statistics = response.json['data']['statements']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(statistics['misses'], 1)
+        self.assertEqual(statistics['hits'], 4)
+        self.assertEqual(statistics['prepares'], 1)
+        self.assertEqual(statistics['prepared_executions'], 3)
+
+    def test_query_select_filter_operators(self):
+        """
+        Test the list, range and null operators and the merging of equalities into one array parameter
+        :return:
+        """
+        con, cur = TestQuery.open_connection(self.app)
+        cur.execute("UPDATE public.{} SET licenseplate = NULL WHERE id IN (9, 10)".format(self._testMethodName))
+        con.commit()
+        TestQuery.close_connection(con, cur)
+
+        def select(json_filter):
+            request_data = {'schema': 'public', 'relation': self._testMethodName, 'filter': json_filter,
+                            'fields': ['id'], 'order_fields': ['id']}
+            response = self.client().post('/query/select', data=json.dumps(request_data),
+                                          content_type='application/json')
+            return response.status_code, [row['id'] for row in response.json['data']]
+
+        self.assertEqual(select({'column': 'manufacturer', 'operator': 'in', 'value': ['BMW', "'Audi'"]}),
+                         (200, [1, 2, 5, 6]))
+        self.assertEqual(select({'column': 'id', 'operator': 'not in', 'value': [1, 2, 3, 4, 5, 6]}),
+                         (200, [7, 8, 9, 10]))
+        self.assertEqual(select({'column': 'id', 'operator': 'between', 'value': [3, 5]}), (200, [3, 4, 5]))
+        self.assertEqual(select({'column': 'licenseplate', 'operator': 'is null'}), (200, [9, 10]))
+        self.assertEqual(select({'operator': 'and', 'childs': [
+            {'column': 'licenseplate', 'operator': 'is not null'},
+            {'column': 'id', 'operator': '>', 'value': 6}]}), (200, [7, 8]))
+
+        # nested equalities of one column share one statement regardless of the amount of values
+        statements = get_pool(self.app).statements
+        misses, hits = statements.misses, statements.hits
+        for ids in ([1, 2], [3, 4, 5, 6], [7, 8, 9, 10, 1]):
+            json_filter = {'operator': 'or', 'childs': [{'column': 'id', 'operator': '=', 'value': ids[0]}, {
+                'operator': 'or', 'childs': [{'column': 'id', 'operator': '=', 'value': value} for value in ids]}]}
+            self.assertEqual(select(json_filter), (200, sorted(ids)))
+        self.assertEqual(statements.misses - misses, 1)
+        self.assertEqual(statements.hits - hits, 2)
+
+        for json_filter in ({'column': 'id', 'operator': 'in', 'value': []},
+                            {'column': 'id', 'operator': 'in', 'value': 1},
+                            {'column': 'id', 'operator': 'between', 'value': [1]},
+                            {'column': 'id', 'operator': 'in', 'value': [[1]]},
+                            {'column': 'id', 'operator': 'is'},
+                            {'operator': 'or', 'childs': [{'column': 'id', 'operator': '=', 'value': 1}]}):
+            self.assertEqual(select(json_filter)[0], 400)
+
+    def test_query_select_compact(self):
+        """
+        Test the compact form of the query/select endpoint
+        :return:
+        """
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'fields': ['id', 'manufacturer'],
+            'order_fields': ['id'],
+            'compact': True
+        }
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        data = response.json
+
+        check_common_data(self, data, response.status_code)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['count'], 10)
+        self.assertEqual(data['data']['columns'], ['id', 'manufacturer'])
+        self.assertEqual(data['data']['rows'][0], [1, 'BMW'])
+
+        request_data['stream'] = True
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(json.loads(response.get_data(as_text=True))['data'], data['data'])
+
+    def test_query_select_database_engine(self):
+        """
+        Test a POST call to the query/select endpoint with rows rendered by the database
+        :return:
+        """
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'filter': {'column': 'manufacturer', 'operator': '=', 'value': 'VW'},
+            'order_fields': ['id'],
+            'engine': 'database'
+        }
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        data = response.json
+
+        check_common_data(self, data, response.status_code)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['data'][1], {'id': 4, 'manufacturer': 'VW', 'type': 'Passat',
+                                           'licenseplate': 'H-DM-415'})
+
+        request_data['filter']['value'] = 'Tesla'
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.json['data'], [])
+        self.assertEqual(response.json['count'], 0)
+
+        del request_data['filter']
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json',
+                                      headers={'Accept': 'application/x-ndjson'})
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(range(1, 11)))
+
+        request_data['compact'] = True
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_select_validation(self):
+        """
+        Relations and columns are checked against the catalog before the database is queried
+        :return:
+        """
+        request_data = {
+            'schema': 'public',
+            'relation': 'does_not_exist'
+        }
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        check_common_data(self, response.json, response.status_code)
+
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName.upper(),
+            'fields': ['id', '"type"', 'id + 1'],
+            'filter': {'operator': 'and', 'childs': [{'column': 'ID', 'operator': '>', 'value': '1'},
+                                                     {'column': 'colour', 'operator': '=', 'value': 'red'}]}
+        }
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('colour', response.json['description'])
+
+        request_data['filter'] = request_data['filter']['childs'][0]
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 9)
+
+        # expressions are only allowed in the fields
+        for filter_column, order_fields in (('id > 0 or id', ['id']), ('id', ['id desc']), ('id', ['lower(type)'])):
+            request_data['filter'] = {'column': filter_column, 'operator': '>', 'value': '1'}
+            request_data['order_fields'] = order_fields
+            response = self.client().post('/query/select',
+                                          data=json.dumps(request_data),
+                                          content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('have to be column names', response.json['description'])
+
+    def test_query_select_result_cache(self):
+        """
+        Results of cached relations are returned from the cache until the table is written to
+        :return:
+        """
+        results = get_result_cache(self.app)
+        results.relations = {('public', self._testMethodName): 60}
+        results.check_interval = 0.01
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'filter': {'column': 'manufacturer', 'operator': '=', 'value': 'BMW'},
+            'order_fields': ['id']
+        }
+        for _ in range(3):
+            response = self.client().post('/query/select',
+                                          data=json.dumps(request_data),
+                                          content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['count'], 2)
+        statistics = self.client().get('/admin/statistics', headers=self.admin_header).json['data']['results']
+        self.assertEqual(statistics['misses'], 1)
+        self.assertEqual(statistics['hits'], 2)
+        self.assertEqual(statistics['entries'], 1)
+
+        con, cur = TestQuery.open_connection(self.app)
+        cur.execute("INSERT INTO public.{} VALUES (11, 'BMW', 'M3', NULL)".format(self._testMethodName))
+        con.commit()
+        # the statistics are otherwise flushed up to a second after the transaction
+        cur.execute('SELECT pg_stat_force_next_flush()')
+        con.commit()
+        TestQuery.close_connection(con, cur)
+        time.sleep(0.02)
+
+        response = self.client().post('/query/select',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.json['count'], 3)
+        statistics = self.client().get('/admin/statistics', headers=self.admin_header).json['data']['results']
+        self.assertEqual(statistics['misses'], 2)
+        self.assertEqual(statistics['invalidations'], 1)
+
+    def test_query_batch(self):
+        """
+        Test several selects in one request, failed selects do not affect the other ones
+        :return:
+        """
+        request_data = {
+            'queries': [
+                {'schema': 'public', 'relation': self._testMethodName,
+                 'filter': {'column': 'manufacturer', 'operator': '=', 'value': 'BMW'}},
+                {'schema': 'public', 'relation': self._testMethodName, 'fields': ['id / 0']},
+                {'schema': 'public', 'relation': self._testMethodName, 'fields': ['id'], 'engine': 'database',
+                 'order_fields': ['id'], 'limit': 3},
+                {'schema': 'public', 'relation': self._testMethodName, 'fields': ['id'], 'compact': True,
+                 'keyset': True, 'order_fields': ['id'], 'limit': 5}
+            ]
+        }
+        for snapshot, concurrency in [(False, 1), (True, 1), (True, 3)]:
+            request_data['snapshot'] = snapshot
+            request_data['concurrency'] = concurrency
+            response = self.client().post('/query/batch',
+                                          data=json.dumps(request_data),
+                                          content_type='application/json')
+            data = response.json
+            self.assertEqual(response.status_code, 200)
+            check_common_data(self, data, response.status_code)
+            self.assertEqual(data['count'], 4)
+            self.assertEqual([item['status_code'] for item in data['data']], [200, 500, 200, 200])
+            self.assertEqual(data['data'][0]['count'], 2)
+            self.assertIn('division by zero', data['data'][1]['description'])
+            self.assertEqual(data['data'][2]['data'], [{'id': 1}, {'id': 2}, {'id': 3}])
+            self.assertEqual(data['data'][3]['data']['rows'], [[1], [2], [3], [4], [5]])
+            self.assertIsNotNone(data['data'][3]['continuation'])
+
+    def test_query_batch_validation(self):
+        """
+        All selects of a batch are validated before the first one is executed
+        :return:
+        """
+        request_data = {
+            'queries': [
+                {'schema': 'public', 'relation': self._testMethodName},
+                {'schema': 'public', 'relation': self._testMethodName, 'order_type': 'up'}
+            ]
+        }
+        response = self.client().post('/query/batch',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Select 1', response.json['description'])
+
+        response = self.client().post('/query/batch',
+                                      data=json.dumps({'queries': []}),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_aggregate(self):
+        """
+        Rows are grouped and aggregated in the database, having filters on the aggregates
+        :return:
+        """
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'group_by': ['manufacturer'],
+            'aggregates': [
+                {'function': 'count', 'column': '*', 'alias': 'cars'},
+                {'function': 'max', 'column': 'id'},
+                {'function': 'avg', 'column': 'id', 'alias': 'Average'}
+            ],
+            'filter': {'column': 'id', 'operator': '>', 'value': '1'},
+            'having': {'column': 'cars', 'operator': '>=', 'value': '2'},
+            'order_fields': ['Average'],
+            'order_type': 'desc'
+        }
+        response = self.client().post('/query/aggregate',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        data = response.json
+        self.assertEqual(response.status_code, 200)
+        check_common_data(self, data, response.status_code)
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(data['data'][0], {'manufacturer': 'Ford', 'cars': 2, 'max_id': 10,
+                                           'Average': '9.5000000000000000'})
+        self.assertEqual([row['manufacturer'] for row in data['data']], ['Ford', 'Mercedes', 'Audi', 'VW'])
+
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'aggregates': [{'function': 'sum', 'column': 'id'}, {'function': 'COUNT'}]
+        }
+        response = self.client().post('/query/aggregate',
+                                      data=json.dumps(request_data),
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['data'], [{'sum_id': 55, 'count': 10}])
+
+    def test_query_aggregate_validation(self):
+        """
+        Only known columns and aggregate functions are allowed, expressions are rejected
+        :return:
+        """
+        invalid = [
+            {'group_by': ['manufacturer'], 'aggregates': [{'function': 'string_agg', 'column': 'type'}]},
+            {'aggregates': [{'function': 'sum', 'column': '*'}]},
+            {'aggregates': [{'function': 'sum', 'column': 'id); DROP TABLE x; --'}]},
+            {'aggregates': [{'function': 'sum', 'column': 'colour'}]},
+            {'group_by': ['manufacturer'], 'having': {'column': 'id', 'operator': '>', 'value': '1'}},
+            {'group_by': ['manufacturer'], 'order_fields': ['type']},
+            {'group_by': ['manufacturer'], 'filter': {'column': 'id > 0 or id', 'operator': '>', 'value': '1'}},
+            {'aggregates': [{'function': 'count'}, {'function': 'count', 'column': '*'}]},
+            {}
+        ]
+        for body in invalid:
+            request_data = dict({'schema': 'public', 'relation': self._testMethodName}, **body)
+            response = self.client().post('/query/aggregate',
+                                          data=json.dumps(request_data),
+                                          content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+            check_common_data(self, response.json, response.status_code)
+
+    def test_query_select_total(self):
+        """
+        The total amount of rows matching the filter is returned exact, estimated or counted with the page
+        :return:
+        """
+        con, cur = TestQuery.open_connection(self.app)
+        cur.execute('ANALYZE public.{}'.format(self._testMethodName))
+        con.commit()
+        TestQuery.close_connection(con, cur)
+
+        request_data = {
+            'schema': 'public',
+            'relation': self._testMethodName,
+            'filter': {'column': 'manufacturer', 'operator': '!=', 'value': 'BMW'},
+            'order_fields': ['id'],
+            'limit': 3
+        }
+        for total, compact in (('exact', False), ('inline', False), ('inline', True)):
+            request_data.update({'total': total, 'compact': compact})
+            response = self.client().post('/query/select',
+                                          data=json.dumps(request_data),
+                                          content_type='application/json')
+            data = response.json
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['count'], 3)
+            self.assertEqual(data['total'], 8)
+            rows = data['data']['rows'] if compact else data['data']
+            self.assertEqual(len(rows[0]), 4)
+            if compact:
+                self.assertEqual(data['data']['columns'], ['id', 'manufacturer', 'type', 'licenseplate'])
+
+        request_data.update({'total': 'inline', 'compact': False, 'offset': 20})
+        response = self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.json['count'], 0)
+        self.assertEqual(response.json['total'], 8)
+
+        request_data.update({'total': 'estimate', 'offset': 0, 'engine': 'database'})
+        response = self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 3)
+        self.assertEqual(response.json['total'], 8)
+
+        del request_data['total']
+        response = self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json')
+        self.assertIsNone(response.json['total'])
+
+        for invalid in ({'total': 'inline', 'engine': 'database'}, {'total': 'all'}, {'total': 'exact', 'stream': True}):
+            response = self.client().post('/query/select',
+                                          data=json.dumps(dict(request_data, **invalid)),
+                                          content_type='application/json')
+            self.assertEqual(response.status_code, 400, invalid)
+
+    def test_query_count(self):
+        """
+        Rows are counted exact or estimated from the statistics and the planner
+        :return:
+        """
+        request_data = {'schema': 'public', 'relation': self._testMethodName}
+        response = self.client().post('/query/count', data=json.dumps(request_data), content_type='application/json')
+        data = response.json
+        self.assertEqual(response.status_code, 200)
+        check_common_data(self, data, response.status_code)
+        self.assertEqual(data['count'], 10)
+        self.assertEqual(data['data'], {'total': 10, 'strategy': 'exact'})
+
+        con, cur = TestQuery.open_connection(self.app)
+        cur.execute('ANALYZE public.{}'.format(self._testMethodName))
+        con.commit()
+        TestQuery.close_connection(con, cur)
+        request_data['strategy'] = 'estimate'
+        response = self.client().post('/query/count', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 10)
+
+        request_data['filter'] = {'column': 'manufacturer', 'operator': '=', 'value': 'VW'}
+        response = self.client().post('/query/count', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 2)
+
+        request_data['strategy'] = 'inline'
+        response = self.client().post('/query/count', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        # a missing relation is reported like for a select
+        for path in ('/query/count', '/query/select'):
+            response = self.client().post(path, data=json.dumps({'schema': 'public'}),
+                                          content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json['description'], 'No schema or relation provided')
@@ -0,0 +1,172 @@
+"""
+Test module for the routing of reads to replicas
+"""
+import json
+import unittest
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.replicas import init_router, get_router, parse_replicas, CONSISTENCY_HEADER
+from p2rest.src.database.results import get_result_cache
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL
+    );
+    INSERT INTO public.{table_name} SELECT i, 'Manufacturer ' || i FROM generate_series(1, 20) i;
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+class TestReplicas(unittest.TestCase):
+    """
+    Test case for the replica router. The test database acts as its own replica
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.admin_header = {'Authorization': 'Bearer ' + self.app.config['P2REST_ADMIN_API_KEY']}
+        self.replica = '{}:{}'.format(self.app.config['P2REST_DB_HOST'], self.app.config['P2REST_DB_PORT'])
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            connection.commit()
+
+    def configure(self, **config):
+        self.app.config.update(config)
+        return init_router(self.app, get_pool(self.app))
+
+    def select(self, headers=None):
+        request_data = {'schema': 'public', 'relation': self._testMethodName}
+        return self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json',
+                                  headers=headers)
+
+    def test_parse_replicas(self):
+        """
+        Replicas are given as host and port, key value dsn or uri
+        :return:
+        """
+        self.assertEqual(parse_replicas('replica1, replica2:5433'),
+                         [{'host': 'replica1'}, {'host': 'replica2', 'port': 5433}])
+        self.assertEqual(parse_replicas('host=replica1 port=5433 dbname=cars, postgresql://reader@replica2/cars'),
+                         [{'host': 'replica1', 'port': 5433, 'dbname': 'cars'},
+                          {'host': 'replica2', 'user': 'reader', 'dbname': 'cars'}])
+        self.assertEqual(parse_replicas([{'host': 'replica1', 'port': '5433'}]), [{'host': 'replica1', 'port': 5433}])
+        self.assertEqual(parse_replicas(''), [])
+        with self.assertRaises(ValueError):
+            parse_replicas('port=5433')
+
+    def test_round_robin(self):
+        """
+        Reads are distributed over the replicas, writes and primary consistent reads use the primary
+        :return:
+        """
+        router = self.configure(P2REST_DB_REPLICAS='{0},{0}'.format(self.replica))
+        primary = get_pool(self.app)
+        for _ in range(4):
+            response = self.select()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['count'], 20)
+        stats = router.stats()
+        self.assertEqual([replica['routed'] for replica in stats['replicas']], [2, 2])
+        self.assertTrue(all(replica['ok'] for replica in stats['replicas']))
+        self.assertEqual(stats['primary_reads'], 0)
+        self.assertTrue(all(prober.pool is not primary for prober in router.replicas))
+
+        response = self.select(headers={CONSISTENCY_HEADER: 'primary'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(router.stats()['primary_reads'], 1)
+
+        response = self.client().get('/admin/statistics', headers=self.admin_header)
+        self.assertEqual(len(response.json['data']['replicas']['replicas']), 2)
+
+    def test_least_outstanding(self):
+        """
+        Reads use the replica with the least connections in use
+        :return:
+        """
+        router = self.configure(P2REST_DB_REPLICAS='{0},{0}'.format(self.replica),
+                                P2REST_DB_REPLICA_POLICY='least_outstanding')
+        busy = router.replicas[0].pool
+        connection = busy.getconn()
+        try:
+            for _ in range(3):
+                self.assertEqual(self.select().status_code, 200)
+        finally:
+            busy.putconn(connection)
+        self.assertEqual([replica['routed'] for replica in router.stats()['replicas']], [0, 3])
+
+    def test_read_your_writes(self):
+        """
+        Primary consistent reads see a write even if the relation is cached and the write counters were not checked
+        yet
+        :return:
+        """
+        self.configure(P2REST_DB_REPLICAS=self.replica)
+        results = get_result_cache(self.app)
+        results.relations = {('public', self._testMethodName): 60}
+        results.check_interval = 60
+        self.assertEqual(self.select(headers={CONSISTENCY_HEADER: 'primary'}).json['count'], 20)
+        self.assertEqual(results.stats()['entries'], 1)
+        self.assertEqual(self.select().json['count'], 20)
+        self.assertEqual(results.stats()['hits'], 1)
+
+        self.execute("INSERT INTO public.{} VALUES (21, 'Manufacturer 21')".format(self._testMethodName))
+        self.assertEqual(self.select(headers={CONSISTENCY_HEADER: 'primary'}).json['count'], 21)
+        self.assertEqual(results.stats()['bypassed'], 2)
+
+    def test_result_cache(self):
+        """
+        Misses of cached relations are read from the primary, so their results are stored although there are replicas
+        :return:
+        """
+        self.configure(P2REST_DB_REPLICAS=self.replica)
+        results = get_result_cache(self.app)
+        results.relations = {('public', self._testMethodName): 60}
+        for _ in range(3):
+            self.assertEqual(self.select().json['count'], 20)
+        stats = results.stats()
+        self.assertEqual((stats['entries'], stats['misses'], stats['hits']), (1, 1, 2))
+
+        request_data = {'queries': [{'schema': 'public', 'relation': self._testMethodName, 'limit': 5},
+                                    {'schema': 'public', 'relation': self._testMethodName}]}
+        response = self.client().post('/query/batch', data=json.dumps(request_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        stats = results.stats()
+        self.assertEqual((stats['entries'], stats['hits']), (2, 3))
+
+    def test_eviction(self):
+        """
+        Replicas that can not be reached are not used, without healthy replicas the primary is used
+        :return:
+        """
+        router = self.configure(P2REST_DB_REPLICAS='{},{}:1'.format(self.replica, self.app.config['P2REST_DB_HOST']))
+        for _ in range(3):
+            self.assertEqual(self.select().status_code, 200)
+        stats = router.stats()
+        self.assertEqual([replica['routed'] for replica in stats['replicas']], [3, 0])
+        self.assertFalse(stats['replicas'][1]['ok'])
+
+        router = self.configure(P2REST_DB_REPLICAS='{}:1'.format(self.app.config['P2REST_DB_HOST']))
+        self.assertEqual(self.select().status_code, 200)
+        self.assertIs(get_router(self.app), router)
+        self.assertEqual(router.stats()['fallbacks'], 1)
@@ -0,0 +1,137 @@
+"""
+Test module for the result cache
+"""
+import select
+import unittest
+
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+from p2rest.src.database.results import ResultCache, parse_relations, get_result_cache
+
+
+class TestResults(unittest.TestCase):
+    """
+    Test case for the result cache
+    """
+
+    def setUp(self):
+        """
+        Create a cache that does not check the write counters
+        :return:
+        """
+        self.cache = ResultCache(None, relations={('public', 'cars'): 60, ('public', 'brands'): 0},
+                                 max_bytes=1000, check_interval=0)
+
+    def select(self, relation='cars', **kwargs):
+        args = {'pool': None, 'schema': 'public', 'relation': relation, 'filter': '', 'fields': ['*'],
+                'order_fields': '', 'order_type': 'asc', 'limit': 100, 'offset': 0}
+        args.update(kwargs)
+        return args
+
+    def test_parse_relations(self):
+        """
+        Relations are normalized like identifiers and get the default ttl unless they have their own
+        :return:
+        """
+        self.assertEqual(parse_relations('public.Cars, "Public".brands=5', 60),
+                         {('public', 'cars'): 60, ('Public', 'brands'): 5.0})
+        self.assertEqual(parse_relations({'public.cars': 10}, 60), {('public', 'cars'): 10})
+        self.assertEqual(parse_relations('', 60), {})
+        with self.assertRaises(ValueError):
+            parse_relations('cars', 60)
+
+    def test_get_and_put(self):
+        """
+        Keys do not depend on the order of the filter keys, other relations are not cached
+        :return:
+        """
+        filter_value = {'column': 'id', 'operator': '=', 'value': '1'}
+        data, token = self.cache.get(self.select(filter=filter_value))
+        self.assertIsNone(data)
+        self.cache.put(token, [{'id': 1}])
+        data, token = self.cache.get(self.select(filter=dict(reversed(list(filter_value.items())))))
+        self.assertEqual(data, [{'id': 1}])
+        self.assertIsNone(token)
+        self.assertEqual(self.cache.get(self.select(relation='trucks')), (None, None))
+        statistics = self.cache.stats()
+        self.assertEqual((statistics['hits'], statistics['misses'], statistics['skipped']), (1, 1, 1))
+
+    def test_expiry_and_eviction(self):
+        """
+        Entries expire after the ttl of their relation and the least recently used entries are evicted
+        :return:
+        """
+        _, token = self.cache.get(self.select(relation='brands'))
+        self.cache.put(token, [{'id': 1}])
+        self.assertEqual(self.cache.get(self.select(relation='brands'))[0], None)
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+        for offset in range(3):
+            _, token = self.cache.get(self.select(offset=offset))
+            self.cache.put(token, [{'name': 'x' * 400}])
+        self.assertIsNotNone(self.cache.get(self.select(offset=1))[0])
+        self.assertIsNone(self.cache.get(self.select(offset=0))[0])
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertLessEqual(self.cache.size, 1000)
+
+    def test_consistency(self):
+        """
+        Misses are read from the pool of the cache, primary reads do not use the cache
+        :return:
+        """
+        replica = object()
+        args = self.select(pool=replica)
+        _, token = self.cache.get(args)
+        self.assertIs(args['pool'], self.cache.pool)
+        self.cache.put(token, [{'id': 1}])
+        args = self.select(pool=replica)
+        self.assertEqual(self.cache.get(args)[0], [{'id': 1}])
+        self.assertIs(args['pool'], replica)
+
+        data, token = self.cache.get(self.select(), primary=True)
+        self.assertIsNone(data)
+        self.cache.put(token, [{'id': 2}])
+        self.assertEqual(self.cache.get(self.select())[0], [{'id': 2}])
+        self.assertEqual(self.cache.stats()['bypassed'], 1)
+
+    def test_invalidation(self):
+        """
+        Results that were read before an invalidation are not stored
+        :return:
+        """
+        _, token = self.cache.get(self.select())
+        self.cache.notify('public.cars')
+        self.cache.put(token, [{'id': 1}])
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+        _, token = self.cache.get(self.select())
+        self.cache.put(token, [{'id': 1}])
+        self.cache.notify(None)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_write_trigger(self):
+        """
+        The write trigger sends the name of the table on the channel of the cache
+        :return:
+        """
+        app = create_app('test')
+        pool = get_pool(app)
+        with pool.connection() as connection:
+            connection.cursor().execute('CREATE TABLE IF NOT EXISTS public.test_results (id integer)')
+            connection.commit()
+        listener = pool.connect()
+        try:
+            get_result_cache(app).install_write_trigger('public.test_results')
+            listener.autocommit = True
+            listener.cursor().execute('LISTEN p2rest_results')
+            with pool.connection() as connection:
+                connection.cursor().execute('INSERT INTO public.test_results VALUES (1)')
+                connection.commit()
+            select.select([listener], [], [], 5)
+            listener.poll()
+            self.assertEqual([notify.payload for notify in listener.notifies], ['public.test_results'])
+        finally:
+            listener.close()
+            with pool.connection() as connection:
+                connection.cursor().execute('DROP TABLE public.test_results')
+                connection.commit()
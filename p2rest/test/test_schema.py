@@ -51,3 +51,39 @@ class TestSchema(unittest.TestCase):
         self.assertTrue('duration' in data.keys())
         self.assertEqual(data['status_code'], 200)
         self.assertTrue(data['count'] > 0)
+
+    def test_create_and_delete_schema(self):
+        """
+        Creates a schema, reads it and deletes it again
+        :return:
+        """
+        response = self.client().post('/schema/', json={'schema': 'test_schema_endpoint'})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client().get('/schema/test_schema_endpoint')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['data'][0]['schema_name'], 'test_schema_endpoint')
+
+        response = self.client().delete('/schema/test_schema_endpoint')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client().get('/schema/test_schema_endpoint')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['data'], [])
+
+        # the former key of the name is still accepted
+        response = self.client().post('/schema/', json={'name': 'Test_Schema_Endpoint'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client().get('/schema/test_schema_endpoint')
+        self.assertEqual(response.json['data'][0]['schema_name'], 'test_schema_endpoint')
+        self.assertEqual(self.client().delete('/schema/test_schema_endpoint').status_code, 200)
+
+    def test_invalid_schema_name(self):
+        """
+        Names that are no identifiers are rejected instead of being pasted into the statement
+        :return:
+        """
+        response = self.client().post('/schema/', json={'schema': 'x; DROP SCHEMA public CASCADE'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client().delete('/schema/public CASCADE; SELECT 1')
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,84 @@
+"""
+Test module for the statement cache
+"""
+import unittest
+
+from p2rest.src import create_app
+from p2rest.src.database.pool import ConnectionPool
+from p2rest.src.database.statements import StatementCache, CompiledStatement
+
+
+class TestStatements(unittest.TestCase):
+    """
+    Test case for the statement cache
+    """
+
+    def setUp(self):
+        """
+        Create the app and a pool
+        :return:
+        """
+        self.app = create_app('test')
+        self.pool = ConnectionPool.from_config(self.app.config, prepare_threshold=1)
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        with self.pool.connection() as connection:
+            connection.cursor().execute('DROP TABLE IF EXISTS public.test_statements')
+            connection.commit()
+        self.pool.closeall()
+
+    def test_compiled_statement(self):
+        """
+        Placeholders are converted into numbered parameters for PREPARE
+        :return:
+        """
+        statement = CompiledStatement('p2rest_1', "SELECT * FROM t WHERE (a = %s) and (\"b%%\" like %s) LIMIT %s")
+        self.assertEqual(statement.prepare_query,
+                         "PREPARE p2rest_1 AS SELECT * FROM t WHERE (a = $1) and (\"b%\" like $2) LIMIT $3")
+        self.assertEqual(statement.execute_query, 'EXECUTE p2rest_1 (%s, %s, %s)')
+        self.assertEqual(CompiledStatement('p2rest_2', 'SELECT 1').execute_query, 'EXECUTE p2rest_2')
+
+    def test_lru_eviction(self):
+        """
+        The least recently used statement is evicted when the cache is full
+        :return:
+        """
+        cache = StatementCache(max_size=2)
+        first = cache.get('SELECT 1')
+        cache.get('SELECT 2')
+        self.assertIs(cache.get('SELECT 1'), first)
+        cache.get('SELECT 3')
+        self.assertNotEqual(cache.get('SELECT 2').name, 'p2rest_2')
+        statistics = cache.stats()
+        self.assertEqual(statistics['hits'], 1)
+        self.assertEqual(statistics['misses'], 4)
+        self.assertEqual(statistics['evictions'], 2)
+
+    def test_prepare_after_schema_change(self):
+        """
+        A prepared statement whose result type changed is prepared again
+        :return:
+        """
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('CREATE TABLE public.test_statements (id integer)')
+            cursor.execute('INSERT INTO public.test_statements VALUES (1), (2)')
+            connection.commit()
+
+            query = 'SELECT * FROM public.test_statements WHERE id = %s'
+            self.pool.statements.execute(cursor, query, [1])
+            self.assertEqual(cursor.fetchall(), [(1,)])
+            cursor.execute('ALTER TABLE public.test_statements ADD COLUMN name text')
+            connection.commit()
+            # the settings of the transaction are kept when the statement is prepared again
+            cursor.execute("SET LOCAL statement_timeout = '1234ms'")
+            self.pool.statements.execute(cursor, query, [2])
+            self.assertEqual(cursor.fetchall(), [(2, None)])
+            self.assertEqual(self.pool.statements.stats()['prepares'], 2)
+            cursor.execute('SHOW statement_timeout')
+            self.assertEqual(cursor.fetchone()[0], '1234ms')
+            connection.rollback()
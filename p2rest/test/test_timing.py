@@ -0,0 +1,106 @@
+"""
+Test module for the request timings
+"""
+import json
+import unittest
+from p2rest.src import create_app
+from p2rest.src.database.pool import get_pool
+
+QUERY_CREATE_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+    CREATE TABLE public.{table_name} (
+        id integer NOT NULL PRIMARY KEY,
+        manufacturer varchar(50) NOT NULL
+    );
+    INSERT INTO public.{table_name} SELECT i, 'Manufacturer ' || i FROM generate_series(1, 20) i;
+"""
+
+QUERY_DROP_TABLE = """
+    DROP TABLE IF EXISTS public.{table_name};
+"""
+
+
+def parse_server_timing(header):
+    """
+    Returns the durations of a Server-Timing header by name
+    """
+    timings = {}
+    for metric in header.split(','):
+        parts = [part.strip() for part in metric.split(';')]
+        timings[parts[0]] = float([part for part in parts if part.startswith('dur=')][0][4:])
+    return timings
+
+
+class TestTiming(unittest.TestCase):
+    """
+    Test case for the Server-Timing header and the timings of the response envelope
+    """
+
+    def setUp(self):
+        """
+        Create the app and a table
+        :return:
+        """
+        self.app = create_app('test')
+        self.client = self.app.test_client
+        self.execute(QUERY_CREATE_TABLE.format(table_name=self._testMethodName))
+
+    def tearDown(self):
+        """
+        Clean up after this test case has run
+        :return:
+        """
+        self.execute(QUERY_DROP_TABLE.format(table_name=self._testMethodName))
+
+    def execute(self, query):
+        with get_pool(self.app).connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query)
+            connection.commit()
+
+    def select(self, **kwargs):
+        request_data = dict({'schema': 'public', 'relation': self._testMethodName}, **kwargs)
+        return self.client().post('/query/select', data=json.dumps(request_data), content_type='application/json')
+
+    def test_server_timing(self):
+        """
+        Every phase of a select is reported in the Server-Timing header, the envelope is unchanged by default
+        :return:
+        """
+        response = self.select()
+        self.assertEqual(response.status_code, 200)
+        timings = parse_server_timing(response.headers['Server-Timing'])
+        self.assertEqual(list(timings), ['connect', 'compile', 'execute', 'fetch', 'convert', 'serialize', 'total'])
+        # the phases do not overlap, the values are rounded to microseconds
+        self.assertGreaterEqual(timings['total'] + 0.01, sum(v for k, v in timings.items() if k != 'total'))
+        self.assertNotIn('timings', response.json)
+        self.assertRegex(response.json['duration'], r'^\d+:\d{2}:\d{2}(\.\d+)?$')
+
+        self.app.config['P2REST_SERVER_TIMING'] = False
+        response = self.select()
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_timing_envelope(self):
+        """
+        With P2REST_TIMING_ENVELOPE the timings are appended to the json responses, including errors and streams
+        :return:
+        """
+        self.app.config['P2REST_TIMING_ENVELOPE'] = True
+        response = self.select(engine='database')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 20)
+        self.assertEqual(set(response.json['timings']),
+                         {'connect', 'compile', 'execute', 'fetch', 'serialize', 'total'})
+
+        response = self.select(fields=['id / 0'])
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('execute', response.json['timings'])
+
+        response = self.select(stream=True)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data())
+        self.assertEqual(data['count'], 20)
+        self.assertIn('convert', data['timings'])
+
+        response = self.client().get('/health/live')
+        self.assertIn('total', response.json['timings'])